@@ -0,0 +1,66 @@
+# Benchmark loading the park models: pickled sklearn forests vs. the compact format (see compact_forest.py)
+# Each load is run in a fresh Python process so load time and peak memory (RSS) aren't affected by earlier loads.
+# Usage: python src/benchmark_compact_forest.py   (after python src/compact_forest.py)
+
+import os
+import sys
+import glob
+import argparse
+import json
+import subprocess
+
+LOAD_PICKLE = '''
+import pickle
+model = pickle.load(open({file!r}, 'rb'))
+n_features = model.n_features_in_
+'''
+
+LOAD_COMPACT = '''
+from compact_forest import CompactForest
+model = CompactForest({file!r})
+n_features = model.meta['n_features']
+'''
+
+TIMED = '''
+import sys, time, json, resource
+sys.path.insert(0, {src!r})
+import numpy, sklearn.ensemble
+rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.time()
+{load}
+t_load = time.time() - t0
+X = numpy.random.RandomState(47).uniform(0, 100, size=(48, n_features))
+t0 = time.time()
+model.predict(X)
+t_pred = time.time() - t0
+print(json.dumps({{'load_s': t_load, 'predict_s': t_pred,
+                  'rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0)/1024}}))
+'''
+
+
+def time_load(load_code, file):
+    '''
+    Load one model in a new process and time it; returns dict w/ load_s, predict_s (48 rows), and rss_mb (peak RSS added)
+    '''
+    src = os.path.dirname(os.path.abspath(__file__))
+    code = TIMED.format(src=src, load=load_code.format(file=file))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Time loading the park models: pickles vs. the compact format')
+    parser.add_argument('model_dir', nargs='?', default='./model/', help='Directory w/ the pickled and compact models')
+    model_dir = parser.parse_args().model_dir
+
+    print('{:<32}{:>12}{:>12}{:>12}{:>12}{:>12}{:>12}'.format('model', 'pkl load s', 'npy load s', 'pkl pred s', 'npy pred s',
+                                                                'pkl RSS MB', 'npy RSS MB'))
+    for model_file in sorted(glob.glob(os.path.join(model_dir, '*_rf_model.pkl'))):
+        compact = os.path.splitext(model_file)[0] + '/'
+        if not os.path.exists(compact):
+            continue
+        old = time_load(LOAD_PICKLE, model_file)
+        new = time_load(LOAD_COMPACT, compact)
+        print('{:<32}{:>12.3f}{:>12.3f}{:>12.4f}{:>12.4f}{:>12.1f}{:>12.1f}'.format(os.path.basename(model_file),
+              old['load_s'], new['load_s'], old['predict_s'], new['predict_s'], old['rss_mb'], new['rss_mb']))
@@ -0,0 +1,64 @@
+# Benchmark daily aggregation of raw LotSpot data: original groupby on date objects + merge vs.
+# process_LotSpot.agg_lotspot_daily (each day's rows found w/ day_slices (a searchsorted of local midnights),
+# NumPy reduceat over each day's rows for the totals/mean/max, segment medians, then a reindex to fill missing days).
+# Also checks both give the same result.
+# Usage: python src/benchmark_daily_agg.py [n_rows]
+
+import argparse
+import time as timer
+import numpy as np
+import pandas as pd
+
+from benchmark_features import make_frame
+from features import add_calendar_fields, clean_in_out
+from process_LotSpot import agg_lotspot_daily
+
+
+def legacy_agg_lotspot_daily(df):
+    '''
+    Original agg_by_date + fill_missing_dates from process_LotSpot.py, kept for comparison
+    '''
+    df_gb_day = df.groupby('date').agg(total_cars=pd.NamedAgg(column='in_out',aggfunc='sum'),
+        med_pc = pd.NamedAgg(column='percent_capacity', aggfunc='median'),
+        avg_pc = pd.NamedAgg(column='percent_capacity', aggfunc='mean'),
+        max_pc = pd.NamedAgg(column='percent_capacity', aggfunc='max')).reset_index()
+
+    df_gb_day['date'] = pd.to_datetime(df_gb_day['date'])
+    all_dates = pd.date_range(start=df_gb_day['date'].min(), end=df_gb_day['date'].max(), freq='D')
+    df_all_dates = pd.DataFrame({'date':all_dates})
+    return pd.merge(df_all_dates, df_gb_day, how='left', left_on='date', right_on='date')
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Time daily aggregation of raw LotSpot data: groupby + merge vs. agg_lotspot_daily')
+    parser.add_argument('n_rows', nargs='?', type=int, default=10**7, help='Number of raw rows')
+    n_rows = parser.parse_args().n_rows
+    df = make_frame(n_rows)
+    df['in_out'] = clean_in_out(df['in_out'])
+    rng = np.random.RandomState(47)
+    df['percent_capacity'] = rng.randint(0, 50, n_rows)/49*100
+    df.loc[rng.rand(n_rows) < 0.001, 'percent_capacity'] = np.nan
+    df = add_calendar_fields(df)
+    # drop a couple of weeks so there are missing dates to fill
+    df = df[(df['datetime'] < '2021-03-01') | (df['datetime'] > '2021-03-15')].reset_index(drop=True)
+
+    # best of 3
+    t_old, t_new = np.inf, np.inf
+    for i in range(3):
+        t0 = timer.time()
+        df_old = legacy_agg_lotspot_daily(df)
+        t_old = min(t_old, timer.time() - t0)
+
+        t0 = timer.time()
+        df_new = agg_lotspot_daily(df)
+        t_new = min(t_new, timer.time() - t0)
+
+    pd.testing.assert_frame_equal(df_new, df_old)
+    diff = (df_new[['med_pc','avg_pc','max_pc']] - df_old[['med_pc','avg_pc','max_pc']]).abs().max().max()
+
+    print('Daily aggregation of ' + str(len(df)) + ' rows (' + str(len(df_new)) + ' days)')
+    print('date object groupby + merge : ' + str(round(t_old, 2)) + ' s')
+    print('day number groupby + reindex: ' + str(round(t_new, 2)) + ' s')
+    print('Speedup : ' + str(round(t_old/t_new, 1)) + 'x')
+    print('Max difference in % capacity stats : ' + str(diff))
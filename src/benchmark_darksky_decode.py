@@ -0,0 +1,80 @@
+# Benchmark decoding Dark Sky responses: original per-response parsing vs. batch decoder in darksky_decode.py
+# Also checks that both give the same values.
+# Usage: python src/benchmark_darksky_decode.py [n_days]
+
+import argparse
+import time as timer
+import pandas as pd
+
+from darksky_decode import decode_daily, decode_hourly
+from synthetic_data import make_darksky_response
+
+
+def legacy_parse_historical(dat_dict, lat, lon):
+    '''
+    Original per-response parsing from get_darksky_historical (before darksky_decode.py), kept for comparison
+    '''
+    daily = dat_dict['daily']['data'][0]
+    df_daily = pd.DataFrame.from_dict([daily])
+
+    df_daily['lat'] = lat
+    df_daily['lon'] = lon
+
+    time_fields = ['time','sunriseTime','sunsetTime','precipIntensityMaxTime','temperatureHighTime','temperatureLowTime',
+              'apparentTemperatureHighTime','apparentTemperatureLowTime','windGustTime','uvIndexTime','temperatureMinTime',
+              'temperatureMaxTime','temperatureMaxTime','apparentTemperatureMinTime','apparentTemperatureMaxTime']
+    for field in time_fields:
+        df_daily[field] = pd.to_datetime(df_daily[field], origin='unix', unit='s',utc=True).dt.tz_convert(dat_dict['timezone'])
+
+    hourly = dat_dict['hourly']
+    df_hourly = pd.DataFrame.from_dict(hourly['data'])
+    df_hourly['lat'] = lat
+    df_hourly['lon'] = lon
+    df_hourly['time'] = pd.to_datetime(df_hourly['time'], origin='unix', unit='s', utc=True).dt.tz_convert(dat_dict['timezone'])
+
+    return df_daily, df_hourly
+
+
+def check_same(df_new, df_old):
+    '''
+    Check decoded frame has same columns/values as the original parsing (float32 vs float64 and
+    categorical vs object dtypes are allowed to differ). Column order is ignored, since concatenating the
+    per-response frames puts fields missing from the first response after lat/lon.
+    '''
+    df_new = df_new.copy()
+    for col in df_new.columns:
+        if isinstance(df_new[col].dtype, pd.CategoricalDtype):
+            df_new[col] = df_new[col].astype(object)
+    pd.testing.assert_frame_equal(df_new, df_old, check_dtype=False, check_like=True, rtol=1e-6)
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Time the batch Dark Sky decoder against per-response parsing')
+    parser.add_argument('n_days', nargs='?', type=int, default=500, help='Number of responses to decode')
+    n_days = parser.parse_args().n_days
+    lat, lon = 39.646865, -105.196314
+    days = [str(day)[0:10] for day in pd.date_range(start='2019-08-30', periods=n_days)]
+    responses = [(make_darksky_response(lat, lon, day, seed=i), lat, lon) for i, day in enumerate(days)]
+
+    t0 = timer.time()
+    frames = [legacy_parse_historical(dat_dict, lat, lon) for dat_dict, lat, lon in responses]
+    df_daily_old = pd.concat([f[0] for f in frames], ignore_index=True)
+    df_hourly_old = pd.concat([f[1] for f in frames], ignore_index=True)
+    t_old = timer.time() - t0
+
+    t0 = timer.time()
+    df_daily = decode_daily(responses)
+    df_hourly = decode_hourly(responses)
+    t_new = timer.time() - t0
+
+    check_same(df_daily, df_daily_old)
+    check_same(df_hourly, df_hourly_old)
+
+    n_hours = len(df_hourly)
+    print('Decoded ' + str(n_days) + ' responses (' + str(n_hours) + ' hourly rows)')
+    print('Per-response parsing : ' + str(round(t_old, 3)) + ' s  (' + str(int(n_days/t_old)) + ' responses/s)')
+    print('Batch decoder        : ' + str(round(t_new, 3)) + ' s  (' + str(int(n_days/t_new)) + ' responses/s)')
+    print('Speedup : ' + str(round(t_old/t_new, 1)) + 'x')
+    print('Hourly frame memory : ' + str(round(df_hourly_old.memory_usage(deep=True).sum()/1e6, 1)) + ' MB -> '
+          + str(round(df_hourly.memory_usage(deep=True).sum()/1e6, 1)) + ' MB')
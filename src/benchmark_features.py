@@ -0,0 +1,66 @@
+# Benchmark derived-feature computation: original .apply/.dt code vs. vectorized features.py
+# on a synthetic LotSpot-like frame. Also checks both give the same values.
+# Usage: python src/benchmark_features.py [n_rows]
+
+import argparse
+import time as timer
+import numpy as np
+import pandas as pd
+
+from features import add_calendar_fields, clean_in_out, add_model_fields
+
+
+def legacy_features(df):
+    '''
+    Original feature code from process_LotSpot.read_process_park_data and modeling.py, kept for comparison
+    '''
+    df['in_out'] = df['in_out'].apply(lambda x: x if x<2 else np.NaN)
+    df['date']  = df['datetime'].dt.date
+    df['month'] = df['datetime'].dt.month
+    df['day']   = df['datetime'].dt.day
+    df['hour']  = df['datetime'].dt.hour
+    df['dow']   = df['datetime'].dt.dayofweek
+    df['is_wknd'] = df['dow'].apply(lambda x: 0 if x<5 else 1)
+    return df
+
+
+def new_features(df):
+    df['in_out'] = clean_in_out(df['in_out'])
+    df = add_calendar_fields(df)
+    return add_model_fields(df)
+
+
+def make_frame(n_rows, seed=47):
+    '''
+    Synthetic LotSpot-like frame: sorted US/Mountain datetimes over ~5 years, in_out mostly 0/1 w/ a few bad values
+    '''
+    rng = np.random.RandomState(seed)
+    t0 = pd.Timestamp('2019-08-30', tz='US/Mountain').value
+    ns = np.sort(t0 + rng.randint(0, 5*365*86400, n_rows).astype('int64')*10**9)
+    return pd.DataFrame({'datetime': pd.to_datetime(ns, utc=True).tz_convert('US/Mountain'),
+                         'in_out': rng.choice([0, 1, 2, 3], size=n_rows, p=[0.49, 0.49, 0.01, 0.01])})
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Time derived-feature computation: .apply/.dt code vs. features.py')
+    parser.add_argument('n_rows', nargs='?', type=int, default=10**7, help='Number of rows in the synthetic frame')
+    n_rows = parser.parse_args().n_rows
+    df = make_frame(n_rows)
+
+    t0 = timer.time()
+    df_old = legacy_features(df.copy())
+    t_old = timer.time() - t0
+
+    t0 = timer.time()
+    df_new = new_features(df.copy())
+    t_new = timer.time() - t0
+
+    pd.testing.assert_frame_equal(df_new, df_old, check_dtype=False)
+
+    print('Derived features for ' + str(n_rows) + ' rows')
+    print('.apply/.dt accessors : ' + str(round(t_old, 2)) + ' s')
+    print('features.py          : ' + str(round(t_new, 2)) + ' s')
+    print('Speedup : ' + str(round(t_old/t_new, 1)) + 'x')
+    print('Memory : ' + str(round(df_old.memory_usage(deep=True).sum()/1e6)) + ' MB -> '
+          + str(round(df_new.memory_usage(deep=True).sum()/1e6)) + ' MB')
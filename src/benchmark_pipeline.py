@@ -0,0 +1,165 @@
+# Benchmark every stage of the pipeline on synthetic data (see synthetic_data.write_synthetic_parks), at several
+# scales, so changes can be checked for speed/memory regressions without the real LotSpot files or a Dark Sky key.
+# Each scale gets its own data tree (laid out like the repo), and each stage is run in a fresh Python process
+# in that tree, so its wall time and peak memory (RSS) aren't affected by the stages before it.
+# Results are written to a JSON report; pass an earlier report w/ --compare to print the change for each stage.
+#
+# Usage: python src/benchmark_pipeline.py [--scales month year] [--stages ...] [--out report.json] [--compare old.json]
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+from synthetic_data import write_synthetic_parks
+
+# name : (number of parks, number of days)
+SCALES = {'month':     (2, 31),
+          'year':      (2, 365),
+          'five_years': (2, 1826),
+          'fifty_parks': (50, 31)}
+
+# Code for each stage, in pipeline order: (setup (not timed), timed). Both run w/ park_names (list) defined,
+# in the scale's data tree; later stages read what earlier ones saved.
+STAGES = {
+    'read_process_park_data': ('from process_LotSpot import read_process_park_data',
+                               'n_rows = sum(len(read_process_park_data(park_name)) for park_name in park_names)'),
+    'agg_lotspot_daily':      ('from process_LotSpot import read_process_park_data, agg_lotspot_daily\n'
+                               'dfs = [read_process_park_data(park_name) for park_name in park_names]',
+                               'n_rows = sum(len(agg_lotspot_daily(df)) for df in dfs)'),
+    'process_LotSpot':        ('from process_LotSpot import run_parks',
+                               'results = run_parks(park_names, n_workers=1)\n'
+                               'assert all(error is None for park_name, stats, error in results), results\n'
+                               'n_rows = sum(stats["raw_rows"] for park_name, stats, error in results)'),
+    'combine_weather':        ('from combine_weather import combine_weather',
+                               'n_rows = sum(combine_weather(park_names).values())'),
+    'model_data':             ('from modeling import build_park_model_data',
+                               'n_rows = sum(len(build_park_model_data(park_name)) for park_name in park_names)'),
+    'model_fit':              ('from modeling import fit_park',
+                               'n_rows = sum(len(fit_park(park_name, method="random", budget={fit_budget})["X_train"])'
+                               ' for park_name in park_names)'),
+    'eda_figures':            ('import generate_figures_EDA\n'
+                               'generate_figures_EDA.park_info.update(park_info)\n'
+                               'os.makedirs(generate_figures_EDA.IMAGE_DIR, exist_ok=True)',
+                               'results, n_skipped = generate_figures_EDA.render_figures(park_names, n_workers=1, force=True)\n'
+                               'assert all(res[3] is None for res in results), results\n'
+                               'n_rows = len(results)'),
+}
+
+TIMED = '''
+import os, sys, time, json, pickle, resource
+sys.path.insert(0, {src!r})
+with open('./data/park_info.pkl', 'rb') as f:
+    park_info = pickle.load(f)
+park_names = list(park_info.keys())
+{setup}
+t0 = time.time()
+{timed}
+wall_s = time.time() - t0
+rss_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+print(json.dumps({{'wall_s': wall_s, 'peak_rss_mb': rss_kb/1024, 'n_rows': int(n_rows)}}), flush=True)
+# skip interpreter teardown, where pyarrow's thread pools can abort the process after the stage is done
+os._exit(0)
+'''
+
+
+def run_stage(stage, work_dir, fit_budget=3):
+    '''
+    Run one stage in a new process in work_dir; returns dict w/ wall_s (timed part only), peak_rss_mb (whole process),
+    and n_rows (rows or figures produced), plus returncode and error (last lines of stderr) if the process failed
+    '''
+    setup, timed = STAGES[stage]
+    code = TIMED.format(src=os.path.dirname(os.path.abspath(__file__)), setup=setup, timed=timed.format(fit_budget=fit_budget))
+    t0 = time.time()
+    proc = subprocess.run([sys.executable, '-c', code], cwd=work_dir, capture_output=True, text=True)
+    lines = [line for line in proc.stdout.strip().splitlines() if line.startswith('{')]
+    res = json.loads(lines[-1]) if len(lines) > 0 else {}
+    res['process_s'] = time.time() - t0
+    if proc.returncode != 0 or len(lines) == 0:
+        res['returncode'] = proc.returncode
+        res['error'] = ' | '.join(proc.stderr.strip().splitlines()[-3:]) or 'exit code ' + str(proc.returncode)
+    return res
+
+
+def run_scale(scale, work_dir, stages, fit_budget=3, seed=47):
+    '''
+    Make the synthetic data for a scale (in work_dir/scale) and run each stage on it, in order
+
+    RETURNS
+    report (dict) : n_parks, n_days, raw_rows, generate_s, and stages {stage : run_stage result}
+    '''
+    n_parks, n_days = SCALES[scale]
+    scale_dir = os.path.join(work_dir, scale)
+    shutil.rmtree(scale_dir, ignore_errors=True)
+    t0 = time.time()
+    park_info, n_rows = write_synthetic_parks(scale_dir, n_parks, n_days, seed=seed)
+    for sub_dir in ['model', 'images']:
+        os.makedirs(os.path.join(scale_dir, sub_dir), exist_ok=True)
+    report = {'n_parks': n_parks, 'n_days': n_days, 'raw_rows': n_rows, 'generate_s': time.time() - t0, 'stages': {}}
+
+    for stage in stages:
+        res = run_stage(stage, scale_dir, fit_budget=fit_budget)
+        report['stages'][stage] = res
+        print('{:<12}{:<24}{:>10}{:>10}{:>12}  {}'.format(scale, stage, fmt(res.get('wall_s')), fmt(res.get('peak_rss_mb'), 0),
+                                                      res.get('n_rows', '-'), res.get('error', 'ok')), flush=True)
+    return report
+
+
+def fmt(x, digits=2):
+    return '-' if x is None else str(round(x, digits))
+
+
+def compare_reports(old, new):
+    '''
+    Print wall time and peak RSS for each (scale, stage) in both reports, w/ new/old ratios
+    '''
+    print('\n{:<12}{:<24}{:>10}{:>10}{:>8}{:>10}{:>10}{:>8}'.format('scale', 'stage', 'old s', 'new s', 'ratio',
+                                                                 'old MB', 'new MB', 'ratio'))
+    for scale, report in new['scales'].items():
+        for stage, res in report['stages'].items():
+            res_old = old['scales'].get(scale, {}).get('stages', {}).get(stage)
+            if res_old is None or 'error' in res or 'error' in res_old:
+                continue
+            print('{:<12}{:<24}{:>10}{:>10}{:>8}{:>10}{:>10}{:>8}'.format(
+                scale, stage, fmt(res_old['wall_s']), fmt(res['wall_s']), fmt(res['wall_s']/res_old['wall_s']),
+                fmt(res_old['peak_rss_mb'], 0), fmt(res['peak_rss_mb'], 0), fmt(res['peak_rss_mb']/res_old['peak_rss_mb'])))
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Time each pipeline stage on synthetic data at several scales')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=list(SCALES))
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help='Stages to run (later stages need the data saved by process_LotSpot and combine_weather)')
+    parser.add_argument('--fit-budget', type=int, default=3, help='Random search budget for the model_fit stage')
+    parser.add_argument('--work-dir', default=None, help='Where to write the synthetic data (default is a temp dir, deleted after)')
+    parser.add_argument('--out', default='./benchmark_pipeline.json', help='JSON report file')
+    parser.add_argument('--compare', default=None, help='Earlier JSON report to compare to')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='benchmark_pipeline_')
+    stages = [stage for stage in STAGES if stage in args.stages]
+    report = {'run_on': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+              'machine': platform.platform(), 'n_cpus': os.cpu_count(), 'fit_budget': args.fit_budget, 'scales': {}}
+
+    print('{:<12}{:<24}{:>10}{:>10}{:>12}  {}'.format('scale', 'stage', 'wall s', 'RSS MB', 'rows', 'status'))
+    try:
+        for scale in args.scales:
+            report['scales'][scale] = run_scale(scale, work_dir, stages, fit_budget=args.fit_budget)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('Wrote ' + args.out)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare_reports(json.load(f), report)
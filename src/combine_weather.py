@@ -1,31 +1,143 @@
-# Combine weather dataframes for each day (made w/ get_darksky_weather.py) into single combined dataframe
+# Combine weather dataframes for each day (made w/ get_darksky_weather.py) into single combined dataset per park
+# (weather_hourly and weather_daily in the store, see storage.py)
+# Run w/ --incremental to only add days not already combined (see manifest files)
 
 import os
+import re
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import pickle
 
-if __name__=='__main__':
+from darksky_decode import CATEGORY_FIELDS
+from storage import STORE_DIR, dataset_dir, dataset_exists, read_dataset, write_dataset
 
-    with open('./data/park_info.pkl', 'rb') as f:
-        park_info = pickle.load(f)
+DAILY_FILE_DIR = './data/proc/weather/historical/daily_files'
+
+# matches e.g. east_mount_falcon_historical_2020-05-01_hourly.pkl
+DAILY_FILE_PATTERN = re.compile(r'^(.+)_historical_(\d{4}-\d{2}-\d{2})_(hourly|daily)\.pkl$')
+
+
+def list_daily_files(daily_file_dir=DAILY_FILE_DIR):
+    '''
+    List the daily weather directory once and group files by park and type
+
+    OUTPUT
+    files (dict) : {(park_name, 'hourly' or 'daily') : {day : file name}}
+    '''
+    files = {}
+    for file in os.listdir(daily_file_dir):
+        match = DAILY_FILE_PATTERN.match(file)
+        if match is not None:
+            park_name, day, kind = match.groups()
+            files.setdefault((park_name, kind), {})[day] = file
+    return files
+
+
+def manifest_file_name(park_name, kind, store_dir=STORE_DIR):
+    # starts w/ '_' so it's ignored when reading the dataset
+    return os.path.join(dataset_dir('weather_' + kind, park_name, store_dir), '_combined_days.json')
+
+
+def read_manifest(park_name, kind, store_dir=STORE_DIR):
+    '''
+    Return set of days already merged into the dataset (empty if there is no manifest)
+    '''
+    try:
+        with open(manifest_file_name(park_name, kind, store_dir), 'r') as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+
+def write_manifest(park_name, kind, days, store_dir=STORE_DIR):
+    with open(manifest_file_name(park_name, kind, store_dir), 'w') as f:
+        json.dump(sorted(days), f)
+
+
+def combine_frames(frames):
+    '''
+    Concatenate weather frames in one go, drop duplicate times (keeping the newest) and sort by time.
+    Categorical columns from different days have different categories, so they're re-made after concat.
+    '''
+    df = pd.concat(frames, ignore_index=True)
+    df = df.drop_duplicates(subset='time', keep='last').sort_values('time').reset_index(drop=True)
+    for col in CATEGORY_FIELDS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
 
-    for park_name in park_info.keys():
 
-        print('Combining Daily historical weather Files for ' + park_name)
+def combine_park_weather(park_name, kind, day_files, incremental=False, daily_file_dir=DAILY_FILE_DIR,
+                         store_dir=STORE_DIR, pool=None):
+    '''
+    Combine daily weather files for a park into the park's weather_<kind> dataset.
 
-        daily_file_dir = './data/proc/weather/historical/daily_files'
-        wea_files = os.listdir(daily_file_dir)
-        hourly_files = sorted([file for file in wea_files if file.startswith(park_name + '_historical') & file.endswith('hourly.pkl')])
-        daily_files = sorted([file for file in wea_files if file.startswith(park_name + '_historical') & file.endswith('daily.pkl')])
+    INPUT
+    park_name (str)
+    kind (str) : 'hourly' or 'daily'
+    day_files (dict) : {day : file name} (see list_daily_files)
+    incremental (bool) : If True, only read days not in the manifest and add them to the existing dataset
+    pool (ThreadPoolExecutor) : Optional pool to read files in parallel
 
-        df_comb_hourly = pd.DataFrame()
-        for file in hourly_files:
-            df = pd.read_pickle(daily_file_dir + '/' + file)
-            df_comb_hourly = pd.concat([df_comb_hourly, df])
-        df_comb_hourly.to_pickle('./data/proc/weather/historical/combined/' + (park_name + '_historical_combined_wea_hourly.pkl') )
+    OUTPUT
+    n_new (int) : Number of daily files read
+    '''
+    name = 'weather_' + kind
+
+    done_days = set()
+    if incremental and dataset_exists(name, park_name, store_dir):
+        done_days = read_manifest(park_name, kind, store_dir)
+    new_days = sorted(set(day_files) - done_days)
+    if len(new_days) == 0:
+        return 0
+
+    paths = [os.path.join(daily_file_dir, day_files[day]) for day in new_days]
+    frames = list(pool.map(pd.read_pickle, paths)) if pool is not None else [pd.read_pickle(path) for path in paths]
+    if len(done_days) > 0:
+        # re-read the months the new days fall in, so those month partitions can be re-written whole
+        frames.insert(0, read_dataset(name, park_name, start=new_days[0][0:7] + '-01', store_dir=store_dir))
+        write_dataset(combine_frames(frames), name, park_name, mode='replace_months', store_dir=store_dir)
+    else:
+        write_dataset(combine_frames(frames), name, park_name, mode='replace_park', store_dir=store_dir)
+    write_manifest(park_name, kind, done_days | set(new_days), store_dir)
+
+    return len(new_days)
+
+
+def combine_weather(park_names, incremental=False, daily_file_dir=DAILY_FILE_DIR, store_dir=STORE_DIR, n_workers=8):
+    '''
+    Combine daily weather files for all parks (listing the daily file directory only once)
+
+    INPUT
+    park_names (list)
+    incremental (bool) : See combine_park_weather
+    n_workers (int) : Number of threads used to read files
+
+    OUTPUT
+    n_read (dict) : {(park_name, kind) : number of daily files read}
+    '''
+    files = list_daily_files(daily_file_dir)
+    n_read = {}
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for park_name in park_names:
+            for kind in ['hourly', 'daily']:
+                n_read[(park_name, kind)] = combine_park_weather(park_name, kind, files.get((park_name, kind), {}),
+                                                                 incremental=incremental, daily_file_dir=daily_file_dir,
+                                                                 store_dir=store_dir, pool=pool)
+    return n_read
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Combine daily historical weather files for each park')
+    parser.add_argument('--incremental', action='store_true', help='Only add days not already combined')
+    args = parser.parse_args()
+
+    with open('./data/park_info.pkl', 'rb') as f:
+        park_info = pickle.load(f)
 
-        df_comb_daily = pd.DataFrame()
-        for file in daily_files:
-            df = pd.read_pickle(daily_file_dir + '/' + file)
-            df_comb_daily = pd.concat([df_comb_daily, df])
-        df_comb_daily.to_pickle('./data/proc/weather/historical/combined/' + (park_name + '_historical_combined_wea_daily.pkl') )
\ No newline at end of file
+    n_read = combine_weather(list(park_info.keys()), incremental=args.incremental)
+    for (park_name, kind), n in n_read.items():
+        print('Combined ' + str(n) + ' ' + kind + ' historical weather files for ' + park_name)
@@ -0,0 +1,185 @@
+# Compact, fast-loading format for the random forest models saved by modeling.py
+# All trees' nodes are stored as flat NumPy arrays (one .npy file each, float32 thresholds/values) in a directory,
+# which is memory-mapped on load instead of unpickling thousands of sklearn Tree objects.
+#
+# Usage: python src/compact_forest.py [--max-trees N] [--max-mb MB]   (exports every ./model/<park>_rf_model.pkl)
+
+import os
+import json
+import glob
+import hashlib
+import pickle
+import argparse
+import numpy as np
+
+ARRAYS = ['feature','threshold','left','right','value','roots']
+
+
+def tree_arrays(tree, offset):
+    '''
+    Node arrays for one fitted sklearn tree, w/ child indexes shifted by offset (the tree's first node in the flat arrays).
+    Leaves point to themselves, so traversal can just keep stepping until max depth.
+    '''
+    t = tree.tree_
+    n = t.node_count
+    nodes = np.arange(n, dtype=np.int32) + offset
+    is_leaf = t.children_left < 0
+    left  = np.where(is_leaf, nodes, t.children_left + offset).astype(np.int32)
+    right = np.where(is_leaf, nodes, t.children_right + offset).astype(np.int32)
+    feature = np.where(is_leaf, 0, t.feature).astype(np.int16)
+
+    # sklearn compares float32 X to float64 thresholds; round thresholds down to the nearest float32
+    # so x <= threshold gives the same answer for every float32 x
+    threshold = t.threshold.astype(np.float32)
+    too_big = threshold.astype(np.float64) > t.threshold
+    threshold[too_big] = np.nextafter(threshold[too_big], np.float32(-np.inf))
+    threshold[is_leaf] = 0
+
+    value = t.value[:, 0, 0].astype(np.float32)
+    return feature, threshold, left, right, value, t.max_depth
+
+
+def file_sha1(file):
+    h = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def export_forest(model, out_dir, max_trees=None, max_bytes=None, model_file=None):
+    '''
+    Write a fitted RandomForestRegressor to the compact format
+
+    INPUT
+    model : Fitted sklearn RandomForestRegressor (single output)
+    out_dir (str) : Directory to write to
+    max_trees (int) : Only keep the first max_trees trees (trees in a random forest are independent, so this
+                      just averages fewer trees)
+    max_bytes (int) : Keep as many trees as fit in this size
+    model_file (str) : Pickle file the model was loaded from; its sha1 is saved, so a stale export can be spotted
+                       (see is_current)
+
+    RETURNS
+    meta (dict) : n_trees, n_nodes, max_depth, n_features, n_bytes, and model_sha1 (if model_file)
+    '''
+    trees = model.estimators_[:max_trees]
+    parts, offset, n_bytes = [], 0, 0
+    for tree in trees:
+        part = tree_arrays(tree, offset)
+        size = sum(arr.nbytes for arr in part[:5]) + 4
+        if max_bytes is not None and n_bytes + size > max_bytes and len(parts) > 0:
+            break
+        parts.append(part)
+        offset += len(part[0])
+        n_bytes += size
+
+    arrays = {'feature':   np.concatenate([part[0] for part in parts]),
+              'threshold': np.concatenate([part[1] for part in parts]),
+              'left':      np.concatenate([part[2] for part in parts]),
+              'right':     np.concatenate([part[3] for part in parts]),
+              'value':     np.concatenate([part[4] for part in parts]),
+              'roots':     np.cumsum([0] + [len(part[0]) for part in parts[:-1]]).astype(np.int32)}
+    meta = {'n_trees': len(parts), 'n_nodes': int(offset), 'max_depth': int(max(part[5] for part in parts)),
+            'n_features': int(model.n_features_in_), 'n_bytes': int(n_bytes)}
+    if model_file is not None:
+        meta['model_sha1'] = file_sha1(model_file)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, name + '.npy'), arrays[name])
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+class CompactForest:
+    '''
+    Random forest loaded from the compact format (see export_forest); predict() gives the same predictions as
+    the sklearn model (to float32 precision)
+
+    INPUT
+    model_dir (str) : Directory written by export_forest
+    mmap (bool) : Memory-map the arrays (default) rather than reading them into memory
+    '''
+
+    def __init__(self, model_dir, mmap=True):
+        with open(os.path.join(model_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(model_dir, name + '.npy'), mmap_mode='r' if mmap else None))
+
+    def predict(self, X, batch_size=4096):
+        '''
+        Mean of the trees' predictions for each row of X (n_rows x n_features); all trees and rows in a batch are
+        stepped down one level at a time.
+        '''
+        X = np.asarray(X, dtype=np.float32)
+        n_features = X.shape[1]
+        roots = np.asarray(self.roots)
+        pred = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), batch_size):
+            X_batch = X[start:start+batch_size].ravel()
+            row_offset = np.arange(len(X_batch)//n_features, dtype=np.int64)*n_features
+            node = np.repeat(roots[:, None], len(row_offset), axis=1)
+            for depth in range(self.meta['max_depth']):
+                go_left = X_batch[row_offset + self.feature[node]] <= self.threshold[node]
+                node = np.where(go_left, self.left[node], self.right[node])
+                # most paths end well before the deepest leaf
+                if depth % 8 == 7 and (self.left[node] == node).all():
+                    break
+            pred[start:start+batch_size] = self.value[node].mean(axis=0, dtype=np.float64)
+        return pred
+
+
+def compact_dir(model_file):
+    '''
+    Compact model directory for a pickled model file, eg ./model/x_rf_model.pkl -> ./model/x_rf_model/
+    '''
+    return os.path.splitext(model_file)[0] + '/'
+
+
+def is_current(model_file):
+    '''
+    True if there is a compact export of a pickled model file, made from the file as it is now
+    (eg not from an older model that modeling.py has since replaced)
+    '''
+    try:
+        with open(os.path.join(compact_dir(model_file), 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return os.path.exists(model_file) and meta.get('model_sha1') == file_sha1(model_file)
+
+
+def check_matches(model, forest, X, tol=1e-3):
+    '''
+    Check a CompactForest gives the same predictions as the sklearn model it came from (only valid if no trees
+    were dropped). Returns max absolute difference; raises AssertionError if over tol.
+    '''
+    diff = np.abs(model.predict(X) - forest.predict(X)).max()
+    assert diff <= tol, 'compact forest predictions differ by up to ' + str(diff)
+    return diff
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Export pickled park models to the compact forest format')
+    parser.add_argument('--model-dir', default='./model/')
+    parser.add_argument('--max-trees', type=int, default=None, help='Keep at most this many trees')
+    parser.add_argument('--max-mb', type=float, default=None, help='Keep as many trees as fit in this many MB')
+    args = parser.parse_args()
+
+    for model_file in sorted(glob.glob(os.path.join(args.model_dir, '*_rf_model.pkl'))):
+        with open(model_file, 'rb') as f:
+            model = pickle.load(f)
+        out_dir = compact_dir(model_file)
+        meta = export_forest(model, out_dir, max_trees=args.max_trees,
+                             max_bytes=None if args.max_mb is None else int(args.max_mb*1e6), model_file=model_file)
+
+        # check predictions on random points (all model features are roughly in this range)
+        X = np.random.RandomState(47).uniform(-10, 110, size=(1000, meta['n_features']))
+        if meta['n_trees'] == len(model.estimators_):
+            check_matches(model, CompactForest(out_dir), X)
+
+        print(os.path.basename(model_file) + ' : ' + str(round(os.path.getsize(model_file)/1e6, 1)) + ' MB -> '
+              + str(round(meta['n_bytes']/1e6, 1)) + ' MB (' + str(meta['n_trees']) + ' trees, ' + str(meta['n_nodes']) + ' nodes)')
@@ -0,0 +1,211 @@
+# Shared HTTP client for the Dark Sky API, used by all the weather fetching scripts
+# Holds one pooled keep-alive session and caches raw json responses on disk,
+# so re-running a job (or re-parsing after a change) doesn't cost any API calls.
+
+import os
+import json
+import hashlib
+import threading
+import time as timer
+import requests
+from requests.adapters import HTTPAdapter
+
+DARKSKY_BASE_URL = 'https://api.darksky.net/forecast/'
+
+CACHE_DIR = './data/raw/weather/darksky_cache/'
+
+# Forecasts are re-requested once the cached response is older than this (seconds)
+FORECAST_TTL = 3600
+
+# status codes worth retrying (rate limited or server-side trouble)
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class TokenBucket:
+    '''
+    Simple thread-safe token bucket rate limiter. Allows bursts of up to 'capacity'
+    requests, refilled at 'rate' requests per second.
+
+    INPUT
+    rate (float) : Requests per second
+    capacity (int) : Max burst size (default is one second's worth of requests)
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1, rate))
+        self.tokens = self.capacity
+        self.last = timer.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Block until a token is available, then take it.
+        '''
+        while True:
+            with self.lock:
+                now = timer.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last)*self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens)/self.rate
+            timer.sleep(wait)
+
+
+def make_session(pool_size=10):
+    '''
+    Make a requests Session w/ a connection pool big enough for pool_size worker threads,
+    so connections are kept alive and re-used across requests.
+    '''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    '''
+    Return the shared module-level session, creating it on first use.
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def request_json(req_url, session=None, rate_limiter=None, max_retries=4, backoff=1.0, timeout=30, api_key=None):
+    '''
+    GET a url and return the decoded json. Retries connection errors, timeouts, and
+    retryable status codes w/ exponential backoff (backoff, 2*backoff, 4*backoff ...)
+
+    INPUT
+    req_url (str)
+    session (requests.Session) : Default is the shared session (see get_session)
+    rate_limiter (TokenBucket) : Optional; a token is taken before every attempt
+    max_retries (int) : Number of retries after the first attempt
+    backoff (float) : Seconds to wait before the first retry
+    api_key (str) : Key in req_url; replaced by '<key>' in error messages, so it doesn't end up in logs
+
+    OUTPUT
+    dat_dict (dict) : Decoded json response
+    '''
+    if session is None:
+        session = get_session()
+    safe_url = req_url.replace(api_key, '<key>') if api_key else req_url
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            content = session.get(req_url, timeout=timeout)
+            if content.status_code < 400:
+                return content.json()
+            error = requests.HTTPError(str(content.status_code) + ' for url: ' + safe_url, response=content)
+            if content.status_code not in RETRY_STATUS:
+                raise error
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # requests' own messages include the full url
+            error = type(e)(str(e).replace(api_key, '<key>') if api_key else str(e))
+        if attempt < max_retries:
+            timer.sleep(backoff * 2**attempt)
+    raise error
+
+
+def cache_path(lat, lon, time, cache_dir=CACHE_DIR):
+    '''
+    Path of the cached response for a (lat, lon, time) request. File name is a hash of
+    the request key, so it is the same no matter which script made the request.
+    Use time='forecast' for forecasts.
+    '''
+    key = str(float(lat)) + ',' + str(float(lon)) + ',' + str(time)
+    name = hashlib.sha1(key.encode()).hexdigest() + '.json'
+    return os.path.join(os.path.expanduser(cache_dir), name)
+
+
+def read_cache(path, ttl=None):
+    '''
+    Return cached json at path, or None if it doesn't exist (or is older than ttl seconds)
+    '''
+    try:
+        if ttl is not None and timer.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(path, dat_dict):
+    '''
+    Write json to the cache. Written to a temp file then renamed, so readers (and other
+    threads) never see a half-written file.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(dat_dict, f)
+    os.replace(tmp_path, path)
+
+
+def get_historical_json(api_key, lat, lon, time, session=None, rate_limiter=None,
+                        base_url=DARKSKY_BASE_URL, cache_dir=CACHE_DIR):
+    '''
+    Get raw Dark Sky historical (time machine) response for a location and time.
+    Past days don't change, so cached responses never expire.
+
+    INPUT
+    api_key (str): Secret!
+    lat, lon (float)
+    time (str) : Formatted like '2020-05-01T00:00:00'
+    session, rate_limiter : See request_json
+    base_url (str) : API url; can be pointed at a local server for testing
+    cache_dir (str) : Response cache directory; None to disable the cache
+
+    OUTPUT
+    dat_dict (dict) : Decoded json response
+    '''
+    path = cache_path(lat, lon, time, cache_dir) if cache_dir is not None else None
+    if path is not None:
+        dat_dict = read_cache(path)
+        if dat_dict is not None:
+            return dat_dict
+
+    req_url = base_url + api_key + '/' + str(lat) + ',' + str(lon) + ',' + time
+    dat_dict = request_json(req_url, session=session, rate_limiter=rate_limiter, api_key=api_key)
+    if path is not None:
+        write_cache(path, dat_dict)
+    return dat_dict
+
+
+def get_forecast_json(api_key, lat, lon, session=None, rate_limiter=None, base_url=DARKSKY_BASE_URL,
+                      cache_dir=CACHE_DIR, ttl=FORECAST_TTL):
+    '''
+    Get raw Dark Sky forecast response for a location. Cached responses are re-used
+    until they are older than ttl seconds.
+
+    INPUT
+    api_key (str): Secret!
+    lat, lon (float)
+    ttl (float) : Max age of cached forecast (seconds)
+    (others as in get_historical_json)
+
+    OUTPUT
+    dat_dict (dict) : Decoded json response
+    '''
+    path = cache_path(lat, lon, 'forecast', cache_dir) if cache_dir is not None else None
+    if path is not None:
+        dat_dict = read_cache(path, ttl=ttl)
+        if dat_dict is not None:
+            return dat_dict
+
+    req_url = base_url + api_key + '/' + str(lat) + ',' + str(lon)
+    dat_dict = request_json(req_url, session=session, rate_limiter=rate_limiter, api_key=api_key)
+    if path is not None:
+        write_cache(path, dat_dict)
+    return dat_dict
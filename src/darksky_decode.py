@@ -0,0 +1,157 @@
+# Decode raw Dark Sky json responses into DataFrames w/ a fixed, typed schema
+# Handles a whole batch of responses at once (ie all cached days for a park) and
+# converts all the unix time fields in one pass instead of one column at a time.
+
+import numpy as np
+import pandas as pd
+
+# Unix-time fields in the daily data block
+DAILY_TIME_FIELDS = ['time','sunriseTime','sunsetTime','precipIntensityMaxTime','temperatureHighTime','temperatureLowTime',
+                     'apparentTemperatureHighTime','apparentTemperatureLowTime','windGustTime','uvIndexTime',
+                     'temperatureMinTime','temperatureMaxTime','apparentTemperatureMinTime','apparentTemperatureMaxTime']
+
+HOURLY_TIME_FIELDS = ['time']
+
+# Text fields w/ a small set of values
+CATEGORY_FIELDS = ['summary','icon','precipType']
+
+# Everything else DarkSky returns is a numeric measurement
+MEASUREMENT_FIELDS = ['moonPhase','precipIntensity','precipIntensityMax','precipProbability','precipAccumulation',
+                      'temperature','apparentTemperature','temperatureHigh','temperatureLow',
+                      'apparentTemperatureHigh','apparentTemperatureLow','temperatureMin','temperatureMax',
+                      'apparentTemperatureMin','apparentTemperatureMax','dewPoint','humidity','pressure',
+                      'windSpeed','windGust','windBearing','cloudCover','uvIndex','visibility','ozone',
+                      'nearestStormDistance','nearestStormBearing']
+
+
+def get_field_order(records):
+    '''
+    Return list of all keys in a list of dicts, in order of first appearance
+    (same column order pd.DataFrame.from_dict gives)
+    '''
+    fields = {}
+    for rec in records:
+        for key in rec:
+            fields[key] = None
+    return list(fields)
+
+
+def convert_times(columns, timezone):
+    '''
+    Convert several columns of unix times (seconds) to tz-aware datetimes in one pass.
+
+    INPUT
+    columns (dict) : field name -> list of unix times (None if missing); all same length
+    timezone (str) : e.g. 'America/Denver'
+
+    OUTPUT
+    dict of field name -> tz-aware DatetimeIndex
+    '''
+    names = list(columns)
+    if len(names) == 0:
+        return {}
+    n_rows = len(columns[names[0]])
+    # float so missing times come through as NaN -> NaT
+    stacked = np.array([columns[name] for name in names], dtype=np.float64).ravel()
+    times = pd.to_datetime(stacked, unit='s', utc=True).tz_convert(timezone)
+    return {name: times[i*n_rows:(i+1)*n_rows] for i, name in enumerate(names)}
+
+
+def build_frame(records, lats, lons, time_fields, timezone):
+    '''
+    Build a typed DataFrame from a list of data-point dicts.
+
+    INPUT
+    records (list of dict) : DarkSky data points
+    lats, lons (list of float) : Location for each record
+    time_fields (list) : Fields to convert from unix time
+    timezone (str)
+
+    OUTPUT
+    df (Pandas DataFrame)
+    '''
+    fields = get_field_order(records)
+    times = convert_times({field: [rec.get(field) for rec in records] for field in fields if field in time_fields},
+                          timezone)
+
+    columns = {}
+    for field in fields:
+        if field in times:
+            columns[field] = times[field]
+        elif field in MEASUREMENT_FIELDS:
+            columns[field] = np.array([rec.get(field) for rec in records], dtype=np.float32)
+        elif field in CATEGORY_FIELDS:
+            columns[field] = pd.Categorical([rec.get(field) for rec in records])
+        else:
+            columns[field] = [rec.get(field, np.nan) for rec in records]
+    columns['lat'] = np.array(lats, dtype=np.float64)
+    columns['lon'] = np.array(lons, dtype=np.float64)
+
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(records)))
+
+
+def get_timezone(responses):
+    '''
+    Return the timezone shared by all responses in a batch
+    '''
+    timezones = set(dat_dict['timezone'] for dat_dict, lat, lon in responses)
+    if len(timezones) != 1:
+        raise ValueError('Responses in a batch must all have the same timezone, got ' + str(sorted(timezones)))
+    return timezones.pop()
+
+
+def decode_hourly(responses, forecast=False):
+    '''
+    Decode the hourly data from a batch of Dark Sky responses into a single DataFrame.
+
+    INPUT
+    responses (list) : List of (dat_dict, lat, lon) tuples
+    forecast (bool) : If True, add 'datetime_requested' column (time forecast was made)
+
+    OUTPUT
+    df_hourly (Pandas DataFrame) : Measurements are float32, summary/icon/precipType categorical,
+    time fields tz-aware datetimes
+    '''
+    timezone = get_timezone(responses)
+    records, lats, lons, requested = [], [], [], []
+    for dat_dict, lat, lon in responses:
+        data = dat_dict['hourly']['data']
+        records.extend(data)
+        lats.extend([lat]*len(data))
+        lons.extend([lon]*len(data))
+        if forecast:
+            requested.extend([dat_dict['currently']['time']]*len(data))
+
+    df_hourly = build_frame(records, lats, lons, HOURLY_TIME_FIELDS, timezone)
+    if forecast:
+        df_hourly['datetime_requested'] = convert_times({'requested': requested}, timezone)['requested']
+    return df_hourly
+
+
+def decode_daily(responses, forecast=False):
+    '''
+    Decode the daily data from a batch of Dark Sky responses into a single DataFrame.
+    For historical responses only the first day is used (the day that was requested);
+    for forecasts all days are kept.
+
+    INPUT
+    responses (list) : List of (dat_dict, lat, lon) tuples
+    forecast (bool) : If True, keep all days and add 'datetime_requested' column
+
+    OUTPUT
+    df_daily (Pandas DataFrame) : Same types as decode_hourly
+    '''
+    timezone = get_timezone(responses)
+    records, lats, lons, requested = [], [], [], []
+    for dat_dict, lat, lon in responses:
+        data = dat_dict['daily']['data'] if forecast else dat_dict['daily']['data'][0:1]
+        records.extend(data)
+        lats.extend([lat]*len(data))
+        lons.extend([lon]*len(data))
+        if forecast:
+            requested.extend([dat_dict['currently']['time']]*len(data))
+
+    df_daily = build_frame(records, lats, lons, DAILY_TIME_FIELDS, timezone)
+    if forecast:
+        df_daily['datetime_requested'] = convert_times({'requested': requested}, timezone)['requested']
+    return df_daily
@@ -0,0 +1,169 @@
+# Local stand-in for the Dark Sky API, for testing the weather jobs w/o an API key or network access
+# Answers historical and forecast requests w/ fake responses (see synthetic_data.make_darksky_response),
+# and can answer every Nth request w/ 429 (rate limited) to exercise retries.
+#
+# Usage: python src/darksky_stub.py             (check get_darksky_weather.backfill_historical against the stub:
+#                                                 retry on 429, resume skips saved days, request rate limit)
+#        python src/darksky_stub.py --serve [--port 8070]   (just serve, at base_url http://127.0.0.1:8070/forecast/)
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+
+from synthetic_data import make_darksky_response, make_park_info
+from get_darksky_weather import backfill_historical, daily_file_names
+
+
+class DarkSkyStubHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.request_times.append(time.monotonic())
+            n_request = len(server.request_times)
+        if server.throttle_every and n_request % server.throttle_every == 0:
+            with server.lock:
+                server.n_throttled += 1
+            self.send_json(429, {'error': 'rate limited'})
+            return
+
+        # /forecast/<key>/<lat>,<lon>[,<time>]; a time means a historical day, no time means a forecast from today
+        try:
+            fields = urlparse(self.path).path.rstrip('/').split('/')[-1].split(',')
+            lat, lon = float(fields[0]), float(fields[1])
+            if len(fields) > 2:
+                day, forecast = fields[2][0:10], False
+            else:
+                day, forecast = str(pd.Timestamp.now(tz='America/Denver').date()), True
+            pd.Timestamp(day)
+        except (IndexError, ValueError):
+            self.send_json(400, {'error': 'bad request ' + self.path})
+            return
+        self.send_json(200, make_darksky_response(lat, lon, day, forecast=forecast))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stub_server(host='127.0.0.1', port=0, throttle_every=None):
+    '''
+    Make (but don't start) a stub Dark Sky server. Use port=0 to pick a free port.
+
+    INPUT
+    throttle_every (int) : Answer every throttle_every-th request w/ 429 (default never)
+
+    RETURNS
+    server (ThreadingHTTPServer) : Keeps request_times (time.monotonic() of each request) and n_throttled
+    base_url (str) : base_url to give the Dark Sky client
+    '''
+    server = ThreadingHTTPServer((host, port), DarkSkyStubHandler)
+    server.lock = threading.Lock()
+    server.request_times = []
+    server.n_throttled = 0
+    server.throttle_every = throttle_every
+    return server, 'http://' + host + ':' + str(server.server_address[1]) + '/forecast/'
+
+
+def max_in_window(times, window=1.0):
+    '''
+    Max number of times (sorted) in any window seconds long
+    '''
+    times = np.sort(times)
+    return int((np.searchsorted(times, times + window, side='left') - np.arange(len(times))).max())
+
+
+def check_backfill(n_parks=2, n_days=8, rate=5, throttle_every=5, n_workers=8):
+    '''
+    Run backfill_historical against a stub server and check that
+    - requests answered w/ 429 are retried, and every day still gets saved
+    - a re-run only fetches the days that are missing
+    - requests stay under the rate limit (the token bucket allows a burst of max(1, rate), then rate per second)
+    Raises AssertionError if not.
+
+    RETURNS
+    results (dict) : Counts and timings from the runs
+    '''
+    park_info = make_park_info(n_parks, seed=0)
+    start = '2020-05-01'
+    end = str((pd.Timestamp(start) + pd.Timedelta(days=n_days - 1)).date())
+    n_jobs = n_parks*n_days
+
+    server, base_url = make_stub_server(throttle_every=throttle_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_dir = tempfile.mkdtemp()
+    try:
+        # first run: everything fetched, throttled requests retried
+        t0 = time.time()
+        summary = backfill_historical('stub-key', park_info, start, end, base_dir=base_dir, n_workers=n_workers,
+                                      rate=rate, base_url=base_url, cache_dir=None)
+        seconds = time.time() - t0
+        assert summary['failed'] == [], 'failed: ' + str(summary['failed'])
+        assert summary['fetched'] == n_jobs and summary['skipped'] == 0, str(summary)
+        assert server.n_throttled > 0, 'stub never answered 429'
+        assert len(server.request_times) == n_jobs + server.n_throttled, \
+            str(len(server.request_times)) + ' requests for ' + str(n_jobs) + ' days and ' + str(server.n_throttled) + ' 429s'
+        for park_name in park_info:
+            daily_file, hourly_file = daily_file_names(base_dir, park_name, start)
+            assert len(pd.read_pickle(daily_file)) == 1 and len(pd.read_pickle(hourly_file)) == 24
+
+        # rate limit: burst of capacity, then rate per second
+        capacity = max(1, rate)
+        n_requests, n_throttled = len(server.request_times), server.n_throttled
+        busiest_second = max_in_window(server.request_times)
+        span = max(server.request_times) - min(server.request_times)
+        assert busiest_second <= capacity + rate, str(busiest_second) + ' requests in one second'
+        assert span >= (n_requests - capacity)/rate - 0.1, str(n_requests) + ' requests in ' + str(round(span, 2)) + ' s'
+
+        # resume: delete one day, re-run, only that day is fetched
+        removed = daily_file_names(base_dir, list(park_info)[-1], end)[0]
+        os.remove(removed)
+        resumed = backfill_historical('stub-key', park_info, start, end, base_dir=base_dir, n_workers=n_workers,
+                                      rate=rate, base_url=base_url, cache_dir=None)
+        assert resumed['fetched'] == 1 and resumed['skipped'] == n_jobs - 1 and resumed['failed'] == [], str(resumed)
+        assert len(server.request_times) - n_requests == 1 + server.n_throttled - n_throttled
+        assert os.path.exists(removed)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(base_dir)
+
+    return {'days': n_jobs, 'requests': n_requests, 'throttled': n_throttled, 'seconds': round(seconds, 2),
+            'busiest_second': busiest_second, 'rate': rate, 'resumed_fetched': resumed['fetched'],
+            'resumed_skipped': resumed['skipped']}
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Stub Dark Sky API server, and a backfill check against it')
+    parser.add_argument('--serve', action='store_true', help='Just serve (default is to run the backfill check)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8070)
+    parser.add_argument('--throttle-every', type=int, default=None, help='Answer every Nth request w/ 429')
+    args = parser.parse_args()
+
+    if args.serve:
+        server, base_url = make_stub_server(args.host, args.port, args.throttle_every)
+        print('Serving fake Dark Sky responses at base_url ' + base_url)
+        server.serve_forever()
+    else:
+        results = check_backfill(throttle_every=args.throttle_every or 5)
+        print('Backfill check passed: ' + str(results['days']) + ' days in ' + str(results['requests']) + ' requests ('
+              + str(results['throttled']) + ' answered 429 and retried) in ' + str(results['seconds']) + ' s; busiest second '
+              + str(results['busiest_second']) + ' requests at rate ' + str(results['rate']) + '/s; resume fetched '
+              + str(results['resumed_fetched']) + ', skipped ' + str(results['resumed_skipped']))
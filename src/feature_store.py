@@ -0,0 +1,78 @@
+# Cache of model design matrices (features + target), so model runs don't have to redo the loads, merges,
+# and filtering when the input data hasn't changed.
+# Each entry is ./data/features/<name>/ w/ X.npy (contiguous float32 features), y.npy (float64 target),
+# days.npy (int32 days since 1970-01-01 for each row), and meta.json (key, column names).
+# The key is a hash of the input datasets' fingerprints (see storage.dataset_fingerprint) and the feature settings.
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+FEATURE_DIR = './data/features/'
+
+
+def feature_key(fingerprints, settings):
+    '''
+    Cache key for a design matrix
+
+    INPUT
+    fingerprints (list) : Fingerprints (hashes) of each input dataset
+    settings (dict) : Anything else the matrix depends on (feature names, filters); must be JSON-able
+    '''
+    return hashlib.sha1(json.dumps([fingerprints, settings], sort_keys=True).encode()).hexdigest()
+
+
+def save_features(name, key, df, target='percent_capacity', date_col='date', feature_dir=FEATURE_DIR):
+    '''
+    Save a design matrix DataFrame (target, date, and numeric feature columns) under name, w/ cache key.
+    Returns the directory written to.
+    '''
+    path = os.path.join(feature_dir, name)
+    os.makedirs(path, exist_ok=True)
+    features = [col for col in df.columns if col not in (target, date_col)]
+    meta = {'key': key, 'columns': list(df.columns), 'features': features, 'target': target, 'date_col': date_col,
+            'n_rows': len(df)}
+
+    # drop the old meta first, so if this is interrupted the old key doesn't match the new half-written arrays
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        os.remove(os.path.join(path, 'meta.json'))
+    np.save(os.path.join(path, 'X.npy'), np.ascontiguousarray(df[features].values, dtype=np.float32))
+    np.save(os.path.join(path, 'y.npy'), df[target].values.astype(np.float64))
+    np.save(os.path.join(path, 'days.npy'), np.array(df[date_col].values, dtype='datetime64[D]').astype(np.int32))
+    # meta is written last, so a half-written entry never has a matching key
+    with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+    return path
+
+
+def load_features(name, key, feature_dir=FEATURE_DIR):
+    '''
+    Load a saved design matrix if its key matches, otherwise return None.
+    A missing, truncated, or inconsistent entry also returns None (so the caller rebuilds it).
+
+    OUTPUT
+    df (Pandas DataFrame) : Same columns (and order) as saved; features are float32, dates are 'YYYY-MM-DD' strings
+    '''
+    path = os.path.join(feature_dir, name)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['key'] != key:
+            return None
+
+        X = np.load(os.path.join(path, 'X.npy'))
+        y = np.load(os.path.join(path, 'y.npy'))
+        days = np.load(os.path.join(path, 'days.npy'))
+        if not len(X) == len(y) == len(days) == meta['n_rows'] or X.shape[1] != len(meta['features']):
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        # truncated/partly written files; a JSONDecodeError is a ValueError
+        return None
+
+    data = {col: X[:, i] for i, col in enumerate(meta['features'])}
+    data[meta['target']] = y
+    data[meta['date_col']] = np.datetime_as_string(days.astype('datetime64[D]'))
+    return pd.DataFrame(data)[meta['columns']]
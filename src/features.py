@@ -0,0 +1,174 @@
+# Derived features for LotSpot data (calendar fields, cleaning), shared by processing and modeling.
+# All computed w/ vectorized NumPy ops rather than row-wise .apply or separate .dt passes.
+
+import numpy as np
+import pandas as pd
+
+NS_PER_HOUR = 3600*10**9
+NS_PER_DAY = 24*NS_PER_HOUR
+
+
+def civil_from_days(days):
+    '''
+    Convert days since 1970-01-01 to (year, month, day) arrays
+    (H. Hinnant's days_from_civil inverse, see http://howardhinnant.github.io/date_algorithms.html)
+    '''
+    z = days + 719468
+    era = z // 146097
+    doe = z - era*146097
+    yoe = (doe - doe//1460 + doe//36524 - doe//146096) // 365
+    doy = doe - (365*yoe + yoe//4 - yoe//100)
+    mp = (5*doy + 2)//153
+    day = doy - (153*mp + 2)//5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era*400 + (month <= 2)
+    return year, month, day
+
+
+def local_ns(datetimes):
+    '''
+    Local wall-clock time as int64 nanoseconds since epoch, for a Series of (tz-aware or naive) datetimes
+    '''
+    if datetimes.dt.tz is not None:
+        datetimes = datetimes.dt.tz_localize(None)
+    return datetimes.values.astype('datetime64[ns]').view('int64')
+
+
+def add_calendar_fields(df, col='datetime'):
+    '''
+    Add date, month, day, hour, and dow (day of week, 0=Monday) columns computed from a datetime column
+    in one pass. Same values as the .dt.date/.dt.month/.dt.day/.dt.hour/.dt.dayofweek accessors (date is
+    datetime.date objects), but month/day/hour/dow are int8.
+
+    INPUT
+    df (Pandas DataFrame)
+    col (str) : Name of datetime column (local time is used for tz-aware datetimes)
+
+    OUTPUT
+    df (Pandas DataFrame) : Same dataframe w/ columns added
+    '''
+    ns = local_ns(df[col])
+    days = ns // NS_PER_DAY
+    first_day = days.min() if len(days) > 0 else 0
+    day_index = days - first_day
+
+    # work out the calendar fields once for each day in the range, then look them up for each row
+    table_days = np.arange(first_day, first_day + (day_index.max() + 1 if len(days) > 0 else 0))
+    year, month, day = civil_from_days(table_days)
+    dates = (np.datetime64('1970-01-01', 'D') + table_days.astype('timedelta64[D]')).astype(object)
+
+    df['date']  = dates[day_index]
+    df['month'] = month.astype(np.int8)[day_index]
+    df['day']   = day.astype(np.int8)[day_index]
+    df['hour']  = ((ns // NS_PER_HOUR) % 24).astype(np.int8)
+    df['dow']   = ((table_days + 3) % 7).astype(np.int8)[day_index]   # 1970-01-01 was a Thursday
+    return df
+
+
+def clean_in_out(in_out):
+    '''
+    in_out should be 0 (car out) or 1 (car in); anything else is set to NaN. Returns float32 array.
+    '''
+    in_out = np.asarray(in_out, dtype=np.float32)
+    return np.where(in_out < 2, in_out, np.float32(np.nan))
+
+
+def add_model_fields(df):
+    '''
+    Add is_wknd (1 for Saturday/Sunday, 0 otherwise) from dow column
+    '''
+    df['is_wknd'] = (df['dow'].values >= 5).astype(np.int8)
+    return df
+
+
+# Features the park models are trained on, in order (see modeling.py)
+MODEL_FEATURES = ['hour','is_wknd','temperature','cloudCover','uvIndex']
+
+
+def model_feature_matrix(df, col='time'):
+    '''
+    Build the model feature matrix (MODEL_FEATURES columns, float64) from hourly weather data,
+    ie a forecast frame w/ time, temperature, cloudCover, and uvIndex columns
+
+    INPUT
+    df (Pandas DataFrame)
+    col (str) : Name of datetime column to take hour/day of week from
+
+    OUTPUT
+    X (NumPy array) : n_rows x len(MODEL_FEATURES)
+    '''
+    df = add_model_fields(add_calendar_fields(df[[col,'temperature','cloudCover','uvIndex']].copy(), col=col))
+    return df[MODEL_FEATURES].values.astype(np.float64)
+
+
+def asof_join(df, right, left_on='datetime', right_on='time', tolerance='15min', interp_limit='3H'):
+    '''
+    Join each row of df to the row of right nearest in time (eg hourly LotSpot data to hourly weather).
+    Times are compared as int64 ns since epoch (UTC), so time zones/DST don't matter.
+    Rows w/o a right row within tolerance get numeric columns linearly interpolated between the right rows
+    before and after, if those are at most interp_limit apart (other columns are from the nearest row).
+    Any other rows are dropped.
+
+    INPUT
+    df, right (Pandas DataFrames)
+    left_on, right_on (str) : Datetime columns to join on
+    tolerance (str or Timedelta) : Max time difference for a match
+    interp_limit (str or Timedelta) : Max gap in right to interpolate across (None to not interpolate)
+
+    OUTPUT
+    df_joined (Pandas DataFrame) : df rows that were kept (in order) w/ right's columns added
+    counts (dict) : Number of rows matched, interpolated, and dropped
+    '''
+    overlap = set(df.columns) & set(right.columns)
+    if overlap:
+        raise ValueError('columns in both frames : ' + str(sorted(overlap)))
+
+    t = df[left_on].values.astype('datetime64[ns]').view('int64')
+    r = right[right_on].values.astype('datetime64[ns]').view('int64')
+    if np.any(r[1:] < r[:-1]):
+        order = np.argsort(r, kind='mergesort')
+        right, r = right.iloc[order], r[order]
+
+    # right rows just before and at/after each left time
+    i = np.searchsorted(r, t)
+    prev = np.clip(i - 1, 0, max(len(r) - 1, 0))
+    nxt = np.clip(i, 0, max(len(r) - 1, 0))
+    has_prev, has_next = i > 0, i < len(r)
+    big = np.iinfo(np.int64).max
+    d_prev = np.where(has_prev, t - r[prev], big)
+    d_next = np.where(has_next, r[nxt] - t, big)
+    nearest = np.where(d_next <= d_prev, nxt, prev)
+
+    matched = np.minimum(d_prev, d_next) <= pd.Timedelta(tolerance).value
+    if interp_limit is None or len(r) == 0:
+        interp = np.zeros(len(t), dtype=bool)
+    else:
+        interp = ~matched & has_prev & has_next & (r[nxt] - r[prev] <= pd.Timedelta(interp_limit).value)
+    keep = matched | interp
+
+    df_joined = (df if keep.all() else df.loc[keep]).reset_index(drop=True)
+    idx, interp_kept = nearest[keep], interp[keep]
+    if interp_kept.any():
+        prev_i, next_i = prev[keep][interp_kept], nxt[keep][interp_kept]
+        weight = (t[keep][interp_kept] - r[prev_i])/(r[next_i] - r[prev_i])
+    for col in right.columns:
+        if col == right_on:
+            # time of the weather row used, or the row's own time if interpolated
+            ns = np.where(interp_kept, t[keep], r[idx])
+            values = pd.to_datetime(ns, utc=True)
+            if right[col].dt.tz is not None:
+                values = values.tz_convert(right[col].dt.tz)
+            else:
+                values = values.tz_localize(None)
+        elif pd.api.types.is_categorical_dtype(right[col].dtype):
+            values = right[col].values.take(idx)
+        else:
+            values = right[col].values[idx]
+            if interp_kept.any() and np.issubdtype(values.dtype, np.floating):
+                col_values = right[col].values
+                before, after = col_values[prev_i], col_values[next_i]
+                values[interp_kept] = before + weight.astype(values.dtype)*(after - before)
+        df_joined[col] = values
+
+    counts = {'matched': int(matched.sum()), 'interpolated': int(interp.sum()), 'dropped': int((~keep).sum())}
+    return df_joined, counts
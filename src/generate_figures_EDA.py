@@ -1,7 +1,23 @@
-import pandas as pd
+# Make EDA figures for each park (daily/hourly LotSpot data and weather)
+# Each (park, figure) is rendered in its own worker process, and figures whose input data hasn't changed
+# since the last run are skipped.
+# Usage: python src/generate_figures_EDA.py [--workers N] [--force]
+
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from storage import read_dataset, dataset_fingerprint
+from features import asof_join
+from occupancy_cube import read_cube, build_cube, cube_means
+
 # make plots look nice
 plt.rcParams['font.size'] = 14
 plt.rcParams['axes.labelsize'] = 'large'
@@ -19,122 +35,224 @@ park_info['mount_galbraith']    = {'pretty_name':'Mount Galbraith', 'lat':39.774
 park_info['west_mount_falcon']  = {'pretty_name':'West Mount Falcon', 'lat':39.637136, 'lon':-105.239178}
 park_info['west_three_sisters'] = {'pretty_name':'West Three Sisters', 'lat':39.624941, 'lon':-105.360398}
 
+IMAGE_DIR = './images/'
+# Hash of each figure's inputs when it was last rendered
+RENDER_CACHE_FILE = IMAGE_DIR + '_eda_render_cache.json'
+# Panels w/ more points than this are drawn from a random sample (time series) or as hexbins (scatter)
+MAX_POINTS = 20000
+# Hours the bar charts average over (6am-7pm)
+OPEN_HOURS = range(6, 20)
+
 
-def load_proc_park_data(park_name, type='raw'):
+def load_proc_park_data(park_name, type='raw', columns=None, start=None, end=None):
     '''
     Loads processed data frames w/ LotSpot data for parks. These are made in process_LotSpot.py
 
     INPUT
     park_name (str)
     type ('str'): Options are 'raw' (default), 'daily', and 'hourly'.
+    columns (list): Only load these columns (default is all)
+    start, end (str): Only load data in this date range (default is all)
     
     OUTPUT
     df (Pandas DataFrame) 
 
     '''
-    base_dir = './data/proc/LotSpot/'
-    
-    if type=='raw':
-        df = pd.read_pickle(base_dir  + park_name + '_raw.pkl')
-    
-    if type=='daily':
-        df = pd.read_pickle(base_dir  + park_name + '_daily.pkl')
-        
-    if type=='hourly':
-        df = pd.read_pickle(base_dir  + park_name + '_resampled_hourly.pkl')
-    
-    return df
+    return read_dataset('lotspot_' + type, park_name, columns=columns, start=start, end=end)
+
+def load_cube(park_name):
+    '''
+    Park's occupancy cube (see occupancy_cube.py), made from the hourly data if process_LotSpot.py hasn't saved one
+    '''
+    cube = read_cube(park_name)
+    return build_cube(park_name) if cube is None else cube
+
+def load_hourly_weather(park_name):
+    '''
+    Hourly LotSpot data for open hours (6am-7pm) joined w/ hourly weather
+    '''
+    dfh = load_proc_park_data(park_name, type='hourly', columns=['datetime','percent_capacity','hour','dow'])
+    dfh = dfh[(dfh['hour']>5) & (dfh['hour']<20)]
+    wea = read_dataset('weather_hourly', park_name, columns=['time','temperature','cloudCover','precipIntensity','windGust','uvIndex'])
+    dfh, counts = asof_join(dfh, wea, left_on='datetime', right_on='time')
+    print(park_name + ' weather join : ' + str(counts))
+    return dfh
+
+def sample_rows(df, n=None):
+    '''
+    Random (but repeatable) n rows (default MAX_POINTS) of df, in their original order, or all of df if it isn't bigger than n
+    '''
+    n = MAX_POINTS if n is None else n
+    if len(df) <= n:
+        return df
+    return df.sample(n, random_state=47).sort_index()
+
+def plot_daily_ts(park_name):
+    # Plot Timeseries of daily-aggregated data
+    df_gb_day = load_proc_park_data(park_name, type='daily', columns=['date','total_cars','max_pc'])
+
+    fig,ax = plt.subplots(2,figsize=(14,10), sharex=True)
+    ax[0].plot(df_gb_day['date'], df_gb_day['total_cars'],'o-')
+    ax[0].set_ylabel('Total Cars')
+    ax[0].set_title(park_info[park_name]['pretty_name'])
+    ax[1].plot(df_gb_day['date'], df_gb_day['max_pc'],'o-')
+    ax[1].set_ylabel('Max % Of Cap.')
+    plt.savefig(IMAGE_DIR + park_name + '_Daily_TS.png')
+    plt.close()
+
+def plot_avg_by_hour(park_name):
+    # Average % capacity by hour (from the park's occupancy cube)
+    d_gbh = cube_means(load_cube(park_name), 'hour', hours=OPEN_HOURS)
+    fig,ax = plt.subplots(1, figsize=(8,6))
+    ax.bar(d_gbh['hour'], d_gbh['percent_capacity'])
+    ax.set_xlabel('Hour')
+    ax.set_ylabel('Average % Of Capacity')
+    ax.set_title(park_info[park_name]['pretty_name'])
+    plt.savefig(IMAGE_DIR + park_name + '_AvgPerCap_vs_hour.png')
+    plt.close()
+
+def plot_avg_by_dow(park_name):
+    # Average % capacity by day of week, over open hours (from the park's occupancy cube)
+    df_gb_dow = cube_means(load_cube(park_name), 'dow', hours=OPEN_HOURS)
+    fig,ax = plt.subplots(1, figsize=(8,6))
+    ax.bar(df_gb_dow['dow'], df_gb_dow['percent_capacity'])
+    ax.set_xlabel('Day of Week (0=Monday)')
+    ax.set_ylabel('Average % Of Capacity')
+    ax.set_title(park_info[park_name]['pretty_name'])
+    plt.savefig(IMAGE_DIR + park_name + '_AvgPerCap_vs_DayofWeek.png')
+    plt.close()
+
+def plot_weather_ts(park_name):
+    # Plot timeseries of % capacity and weather variables
+    dfh = sample_rows(load_hourly_weather(park_name))
+    fig,ax = plt.subplots(6, figsize=(14,12), sharex=True)
+    ax[0].plot(dfh['datetime'].values, dfh['percent_capacity'],'.')
+    ax[0].set_ylabel('% Capacity')
+    ax[0].set_title(park_info[park_name]['pretty_name'])
+    ax[1].plot(dfh['datetime'].values, dfh['temperature'],'.')
+    ax[1].set_ylabel('Temp.')
+    ax[2].plot(dfh['datetime'].values, dfh['uvIndex'],'.')
+    ax[2].set_ylabel('UV Index')
+    ax[3].plot(dfh['datetime'].values, dfh['precipIntensity'],'.')
+    ax[3].set_ylabel('Precip')
+    ax[4].plot(dfh['datetime'].values, dfh['cloudCover'],'.')
+    ax[4].set_ylabel('Cloud Cover')
+    ax[5].plot(dfh['datetime'].values, dfh['windGust'],'.')
+    ax[5].set_ylabel('Wind Gust')
+    plt.savefig(IMAGE_DIR + park_name + '_PerCap_weather_TS.png')
+    plt.close()
+
+def plot_weather_scatter(park_name):
+    # Make scatter plots of % capacity versus weather variables
+    dfh = load_hourly_weather(park_name)
+    dense = len(dfh) > MAX_POINTS
+    # robust fits are slow, so fit to a sample when there are lots of points (and show all points as hexbins)
+    df_fit = sample_rows(dfh)
+    fig, ax = plt.subplots(nrows=2, ncols=2, figsize=(14,10), sharey=True)
+
+    panels = [('temperature', 'Temperature', None), ('uvIndex', 'UV Index', 0.2), ('cloudCover', 'Cloud Cover', None),
+              ('precipIntensity', 'Precipitation Intensity', None)]
+    for i, (col, label, x_jitter) in enumerate(panels):
+        ax_i = ax.flatten()[i]
+        if dense:
+            ax_i.hexbin(dfh[col], dfh['percent_capacity'], gridsize=50, mincnt=1, cmap='Blues', bins='log')
+        sns.regplot(x=df_fit[col], y=df_fit['percent_capacity'], x_jitter=x_jitter, robust=True,
+                    ci=None, scatter=not dense, scatter_kws={"alpha": 0.2}, ax=ax_i)
+        ax_i.set_xlabel(label)
+        ax_i.set_ylabel('% Of Capacity')
+        ax_i.set_ylim(0,100)
+
+    plt.savefig(IMAGE_DIR + park_name + '_weather_scatter.png')
+    plt.close()
+
+# figure name : (plotting function, datasets it's made from)
+FIGURES = {'Daily_TS':             (plot_daily_ts, ['lotspot_daily']),
+           'AvgPerCap_vs_hour':    (plot_avg_by_hour, ['lotspot_hourly']),
+           'AvgPerCap_vs_DayofWeek': (plot_avg_by_dow, ['lotspot_hourly']),
+           'PerCap_weather_TS':    (plot_weather_ts, ['lotspot_hourly','weather_hourly']),
+           'weather_scatter':      (plot_weather_scatter, ['lotspot_hourly','weather_hourly'])}
+
+def code_hash():
+    '''
+    sha1 of this file, so editing a figure function (or the helpers it uses) makes its figures stale
+    '''
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def figure_hash(park_name, figure, fingerprints, code=None):
+    '''
+    Hash of everything a figure depends on: its input datasets (see storage.dataset_fingerprint), settings,
+    and the plotting code (see code_hash; pass it in to avoid re-reading the file for each figure)
+    '''
+    inputs = [fingerprints[name] for name in FIGURES[figure][1]]
+    code = code_hash() if code is None else code
+    return hashlib.sha1(json.dumps([park_name, figure, inputs, MAX_POINTS, code]).encode()).hexdigest()
+
+def render_figure(park_name, figure):
+    '''
+    Render one figure; returns (park_name, figure, seconds, error message or None)
+    '''
+    t0 = time.time()
+    try:
+        FIGURES[figure][0](park_name)
+        error = None
+    except Exception as e:
+        plt.close('all')
+        error = repr(e)
+    return park_name, figure, time.time() - t0, error
+
+def render_figures(park_names, n_workers=None, force=False):
+    '''
+    Render every figure for each park in a process pool, skipping figures whose input hash is the same as
+    when they were last rendered (unless force).
+
+    RETURNS
+    results (list) : (park_name, figure, seconds, error) for each figure rendered
+    n_skipped (int) : Number of figures that were up to date
+    '''
+    try:
+        with open(RENDER_CACHE_FILE) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        cache = {}
+
+    jobs, hashes, code = [], {}, code_hash()
+    for park_name in park_names:
+        fingerprints = {name: dataset_fingerprint(name, park_name) for name in ['lotspot_daily','lotspot_hourly','weather_hourly']}
+        for figure in FIGURES:
+            key = park_name + '/' + figure
+            hashes[key] = figure_hash(park_name, figure, fingerprints, code)
+            up_to_date = cache.get(key) == hashes[key] and os.path.exists(IMAGE_DIR + park_name + '_' + figure + '.png')
+            if force or not up_to_date:
+                jobs.append((park_name, figure))
+
+    if n_workers == 1:
+        results = [render_figure(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(render_figure, *job) for job in jobs]
+            results = [future.result() for future in futures]
+
+    for park_name, figure, seconds, error in results:
+        key = park_name + '/' + figure
+        if error is None:
+            cache[key] = hashes[key]
+        else:
+            cache.pop(key, None)
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    with open(RENDER_CACHE_FILE, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    return results, len(park_names)*len(FIGURES) - len(jobs)
 
 if __name__=='__main__':
 
-    #park_name = 'east_mount_falcon'
-    for park_name in park_info.keys():
-
-        # Plot Timeseries of daily-aggregated data
-        df_gb_day = load_proc_park_data(park_name, type='daily')
-            
-        fig,ax = plt.subplots(2,figsize=(14,10), sharex=True)
-        ax[0].plot(df_gb_day['date'], df_gb_day['total_cars'],'o-')
-        ax[0].set_ylabel('Total Cars')
-        ax[0].set_title(park_info[park_name]['pretty_name'])
-        ax[1].plot(df_gb_day['date'], df_gb_day['max_pc'],'o-')
-        ax[1].set_ylabel('Max % Of Cap.')
-        plt.savefig('./images/' + park_name + '_Daily_TS.png')
-        plt.close()
-
-        # Load hourly resampled data and filter to open hours
-        #dfh = read_process_park_data_into_hourly(park_name)
-        dfh = load_proc_park_data(park_name, type='hourly')
-        dfh = dfh[(dfh['hour']>5) & (dfh['hour']<20)]
-    
-        # Group by hour and plot average % capacity
-        d_gbh = dfh.groupby('hour').mean().reset_index()
-        fig,ax = plt.subplots(1, figsize=(8,6))
-        ax.bar(d_gbh['hour'], d_gbh['percent_capacity'])
-        ax.set_xlabel('Hour')
-        ax.set_ylabel('Average % Of Capacity')
-        ax.set_title(park_info[park_name]['pretty_name'])
-        plt.savefig('./images/' + park_name + '_AvgPerCap_vs_hour.png')
-        plt.close()
-
-        # Group by day of week and plot average % capacity
-        df_gb_dow = dfh.groupby('dow').mean().reset_index()
-        fig,ax = plt.subplots(1, figsize=(8,6))
-        ax.bar(df_gb_dow['dow'], df_gb_dow['percent_capacity'])
-        ax.set_xlabel('Day of Week (0=Monday)')
-        ax.set_ylabel('Average % Of Capacity')
-        ax.set_title(park_info[park_name]['pretty_name'])
-        plt.savefig('./images/' + park_name + '_AvgPerCap_vs_DayofWeek.png')
-        plt.close()
-
-        # Load weather data and merge with hourly parking data
-        wea = pd.read_pickle('./data/proc/weather/historical/combined/' + park_name + '_historical_combined_wea_hourly.pkl')
-        wea = wea[['time','temperature','cloudCover','precipIntensity','windGust','uvIndex']]
-        dfh = pd.merge(dfh, wea, left_on='datetime', right_on='time')
-
-
-        # Plot timeseries of % capacity and weather variables
-        dfh.set_index('datetime',inplace=True)
-        dfh.reset_index(inplace=True)
-        fig,ax = plt.subplots(6, figsize=(14,12), sharex=True)
-        ax[0].plot(dfh['datetime'].values, dfh['percent_capacity'],'.')
-        ax[0].set_ylabel('% Capacity')
-        ax[0].set_title(park_info[park_name]['pretty_name'])
-        ax[1].plot(dfh['datetime'].values, dfh['temperature'],'.')
-        ax[1].set_ylabel('Temp.')
-        ax[2].plot(dfh['datetime'].values, dfh['uvIndex'],'.')
-        ax[2].set_ylabel('UV Index')
-        ax[3].plot(dfh['datetime'].values, dfh['precipIntensity'],'.')
-        ax[3].set_ylabel('Precip')
-        ax[4].plot(dfh['datetime'].values, dfh['cloudCover'],'.')
-        ax[4].set_ylabel('Cloud Cover')
-        ax[5].plot(dfh['datetime'].values, dfh['windGust'],'.')
-        ax[5].set_ylabel('Wind Gust')
-        plt.savefig('./images/' + park_name + '_PerCap_weather_TS.png')
-        plt.close()
-
-        # Make scatter plots of % capacity versus weather variables
-        fig, ax = plt.subplots(nrows=2, ncols=2, figsize=(14,10), sharey=True)
-        
-        sns.regplot(dfh['temperature'], dfh['percent_capacity'], robust=True, ci=None, scatter_kws={"alpha": 0.2}, ax = ax.flatten()[0])
-        ax.flatten()[0].set_xlabel('Temperature')
-        ax.flatten()[0].set_ylabel('% Of Capacity')
-        ax.flatten()[0].set_ylim(0,100)
-
-        sns.regplot(dfh['uvIndex'], dfh['percent_capacity'], x_jitter=0.2, robust=True, ci=None,scatter_kws={"alpha": 0.2}, ax = ax.flatten()[1])
-        ax.flatten()[1].set_xlabel('UV Index')
-        ax.flatten()[1].set_ylabel('% Of Capacity')
-        ax.flatten()[1].set_ylim(0,100)
-
-        sns.regplot(dfh['cloudCover'], dfh['percent_capacity'], robust=True, ci=None,scatter_kws={"alpha": 0.2}, ax = ax.flatten()[2])
-        ax.flatten()[2].set_xlabel('Cloud Cover')
-        ax.flatten()[2].set_ylabel('% Of Capacity')
-        ax.flatten()[2].set_ylim(0,100)
-
-        sns.regplot(dfh['precipIntensity'], dfh['percent_capacity'], robust=True, ci=None,scatter_kws={"alpha": 0.2}, ax = ax.flatten()[3])
-        ax.flatten()[3].set_xlabel('Precipitation Intensity')
-        ax.flatten()[3].set_ylabel('% Of Capacity')
-        ax.flatten()[3].set_ylim(0,100)
-
-        plt.savefig('./images/' + park_name + '_weather_scatter.png')
-        plt.close()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Make EDA figures for each park')
+    parser.add_argument('--workers', type=int, default=None, help='Number of figures to render in parallel (default is # CPUs)')
+    parser.add_argument('--force', action='store_true', help='Re-render every figure, even if its data has not changed')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    results, n_skipped = render_figures(list(park_info.keys()), n_workers=args.workers, force=args.force)
+    for park_name, figure, seconds, error in results:
+        print('{:<22}{:<26}{:>8.1f} s  {}'.format(park_name, figure, seconds, 'ok' if error is None else 'FAILED: ' + error))
+    print('Rendered ' + str(len(results)) + ' figures, ' + str(n_skipped) + ' up to date, in ' + str(round(time.time() - t0, 1)) + ' s')
@@ -1,12 +1,15 @@
 # Get Dark Sky weather forecast and save to file
 
 import os
-import pandas as pd
-import requests
 from datetime import datetime
 import pickle
 
-def get_darksky_forecast(api_key, lat = 39.646865, lon = -105.196314):
+from darksky_client import DARKSKY_BASE_URL, CACHE_DIR, get_forecast_json
+from darksky_decode import decode_daily, decode_hourly
+from storage import write_dataset
+
+def get_darksky_forecast(api_key, lat = 39.646865, lon = -105.196314, session=None, rate_limiter=None,
+                         base_url=DARKSKY_BASE_URL, cache_dir=CACHE_DIR):
     '''
     Get historical darksky weather **FORECAST** for specified location
     
@@ -14,38 +17,47 @@ def get_darksky_forecast(api_key, lat = 39.646865, lon = -105.196314):
     api_key
     lat
     lon
+    session, rate_limiter, base_url, cache_dir : See darksky_client.get_forecast_json
     
     OUTPUT
     df_daily, df_hourly : Pandas Dataframes with daily,hourly data
     '''
-    req_url = 'https://api.darksky.net/forecast/' + api_key + '/' + str(lat) + ',' + str(lon)
-    content = requests.get(req_url)
-    dat_dict = content.json()
-    
-    daily = dat_dict['daily']
-    df_daily = pd.DataFrame.from_dict(daily['data'])
-    df_daily['lat'] = lat
-    df_daily['lon'] = lon
-    time_fields = ['time','sunriseTime','sunsetTime','precipIntensityMaxTime','temperatureHighTime','temperatureLowTime',
-              'apparentTemperatureHighTime','apparentTemperatureLowTime','windGustTime','uvIndexTime','temperatureMinTime',
-              'temperatureMaxTime','temperatureMaxTime','apparentTemperatureMinTime','apparentTemperatureMaxTime']
-    for field in time_fields:
-        df_daily[field] = pd.to_datetime(df_daily[field], origin='unix', unit='s',utc=True).dt.tz_convert(dat_dict['timezone'])
-
-    df_daily['datetime_requested'] = pd.to_datetime(dat_dict['currently']['time'], origin='unix', unit='s',utc=True).tz_convert(dat_dict['timezone'])    
-    
-    hourly = dat_dict['hourly']
-    df_hourly = pd.DataFrame.from_dict(hourly['data'])
-    df_hourly['lat'] = lat
-    df_hourly['lon'] = lon
-
-    df_hourly['time'] = pd.to_datetime(df_hourly['time'], origin='unix', unit='s', utc=True).dt.tz_convert(dat_dict['timezone'])
-    df_hourly['datetime_requested'] = pd.to_datetime(dat_dict['currently']['time'], origin='unix', unit='s',utc=True).tz_convert(dat_dict['timezone'])
+    dat_dict = get_forecast_json(api_key, lat, lon, session=session, rate_limiter=rate_limiter, base_url=base_url,
+                                 cache_dir=cache_dir)
+    df_daily, df_hourly = parse_darksky_forecast(dat_dict, lat, lon)
 
     date_req = datetime.now().strftime('%Y-%m-%d')
     
     return date_req, df_daily, df_hourly
 
+def parse_darksky_forecast(dat_dict, lat, lon):
+    '''
+    Parse a raw Dark Sky forecast response (see get_darksky_forecast) into dataframes
+
+    INPUT
+    dat_dict (dict) : Decoded json response
+    lat, lon (float) : Location the forecast was requested for
+
+    OUTPUT
+    df_daily, df_hourly : Pandas Dataframes with daily,hourly data
+    '''
+    responses = [(dat_dict, lat, lon)]
+    df_daily = decode_daily(responses, forecast=True)
+    df_hourly = decode_hourly(responses, forecast=True)
+
+    return df_daily, df_hourly
+
+def forecast_basename(date_req):
+    return 'forecast-' + date_req + '-{i}.parquet'
+
+def save_forecast(park_name, date_req, df_daily, df_hourly):
+    '''
+    Add a park's forecast to the store; one file per park per day requested, alongside the earlier forecasts
+    (a second forecast on the same day replaces the first)
+    '''
+    write_dataset(df_daily, 'forecast_daily', park_name, mode='append', basename=forecast_basename(date_req))
+    write_dataset(df_hourly, 'forecast_hourly', park_name, mode='append', basename=forecast_basename(date_req))
+
 if __name__=='__main__':
 
     with open('./data/park_info.pkl', 'rb') as f:
@@ -61,12 +73,4 @@ if __name__=='__main__':
         #print(lon)
         date_req, df_daily, df_hourly = get_darksky_forecast(api_key=API_KEY, lat = lat, lon = lon)
         #print(date_req)
-        base_dir = './data/proc/weather/forecasts/'
-
-        df_daily.to_csv(base_dir  + park_name + '_forecast_' + date_req + '_daily'   + '.csv', index=False)
-
-        df_hourly.to_csv(base_dir + park_name + '_forecast_' + date_req + '_hourly'  + '.csv', index=False)
-
-        df_daily.to_pickle(base_dir  + park_name + '_forecast_' + date_req + '_daily'   + '.pkl')
-
-        df_hourly.to_pickle(base_dir + park_name + '_forecast_' + date_req + '_hourly'  + '.pkl')
\ No newline at end of file
+        save_forecast(park_name, date_req, df_daily, df_hourly)
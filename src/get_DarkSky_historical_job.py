@@ -2,54 +2,16 @@
 # Set up to run as cron job each day and get yesterday's weather data
 
 import os
-import pandas as pd
-import requests
 from datetime import datetime, timedelta
 import pickle
 
-def get_darksky_historical(api_key, lat = 39.646865, lon = -105.196314, time = '2020-05-01T00:00:00'):
-    '''
-
-    Get historical darksky weather data for specified location and time
-    
-    INPUT
-    api_key (str): Secret!
-    lat (float): Default is latitude for East Mount Falcon Trailhead
-    lon (float): Default is latitude for East Mount Falcon Trailhead
-    time (str) : Formatted like '2020-05-01T00:00:00'
-    
-    OUTPUT
-    df_daily, df_hourly : Pandas Dataframes with daily, hourly weather data
-    See https://darksky.net/dev/docs#api-request-types for info on data fields
-    '''
-
-    req_url = 'https://api.darksky.net/forecast/' + api_key + '/' + str(lat) + ',' + str(lon) + ',' + time
-    content = requests.get(req_url)
-    dat_dict = content.json()
-    daily = dat_dict['daily']['data'][0]
-    df_daily = pd.DataFrame.from_dict([daily])
-    
-    df_daily['lat'] = lat
-    df_daily['lon'] = lon
-
-    time_fields = ['time','sunriseTime','sunsetTime','precipIntensityMaxTime','temperatureHighTime','temperatureLowTime',
-              'apparentTemperatureHighTime','apparentTemperatureLowTime','windGustTime','uvIndexTime','temperatureMinTime',
-              'temperatureMaxTime','temperatureMaxTime','apparentTemperatureMinTime','apparentTemperatureMaxTime']
-    for field in time_fields:
-        df_daily[field] = pd.to_datetime(df_daily[field], origin='unix', unit='s',utc=True).dt.tz_convert(dat_dict['timezone'])
-        
-    hourly = dat_dict['hourly']
-    df_hourly = pd.DataFrame.from_dict(hourly['data'])
-    df_hourly['lat'] = lat
-    df_hourly['lon'] = lon
-    df_hourly['time'] = pd.to_datetime(df_hourly['time'], origin='unix', unit='s', utc=True).dt.tz_convert(dat_dict['timezone'])
-    
-    return df_daily, df_hourly
+from get_darksky_weather import get_darksky_historical
+from combine_weather import combine_weather
 
 
 if __name__=='__main__':
 
-   with open('./data/park_info.pkl', 'rb') as f:
+    with open('./data/park_info.pkl', 'rb') as f:
         park_info = pickle.load(f)
 
     API_KEY = os.getenv('DARKSKY_API_KEY')
@@ -72,10 +34,10 @@ if __name__=='__main__':
         
         base_dir = './data/proc/weather/historical/daily_files/'
         
-        df_daily.to_csv(base_dir  + park_name + '_historical_' + yesterday.strftime('%Y-%m-%d') + '_daily'   + '.csv', index=False)
-        
-        df_hourly.to_csv(base_dir + park_name + '_historical_' + yesterday.strftime('%Y-%m-%d') + '_hourly'  + '.csv', index=False)
-        
+        # daily files are just staging for combine_weather; the combined data lives in the store
         df_daily.to_pickle(base_dir  + park_name + '_historical_' + yesterday.strftime('%Y-%m-%d') + '_daily'   + '.pkl')
         
-        df_hourly.to_pickle(base_dir + park_name + '_historical_' + yesterday.strftime('%Y-%m-%d') + '_hourly'  + '.pkl')
\ No newline at end of file
+        df_hourly.to_pickle(base_dir + park_name + '_historical_' + yesterday.strftime('%Y-%m-%d') + '_hourly'  + '.pkl')
+
+    # Add the new day to the combined weather files
+    combine_weather(list(park_info.keys()), incremental=True)
@@ -1,72 +1,152 @@
 # Get weather data from Dark Sky API
 # Saves a hourly and daily DataFrame for each day
+# Run w/ --start/--end to backfill every park in park_info.pkl over a date range
+# (python src/darksky_stub.py checks the backfill against a local stub server: 429 retries, resume, rate limit)
 
 import os
+import argparse
+import time as timer
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-import requests
 import pickle
 
-def get_darksky_historical(api_key, lat = 39.646865, lon = -105.196314, time = '2020-05-01T00:00:00'):
+from darksky_client import (DARKSKY_BASE_URL, CACHE_DIR, TokenBucket, make_session, get_historical_json)
+from darksky_decode import decode_daily, decode_hourly
+
+
+def get_darksky_historical(api_key, lat = 39.646865, lon = -105.196314, time = '2020-05-01T00:00:00',
+                           session=None, rate_limiter=None, base_url=DARKSKY_BASE_URL, cache_dir=CACHE_DIR):
     '''
 
     Get historical darksky weather data for specified location and time
-    
+
     INPUT
     api_key (str): Secret!
     lat (float): Default is latitude for East Mount Falcon Trailhead
     lon (float): Default is latitude for East Mount Falcon Trailhead
     time (str) : Formatted like '2020-05-01T00:00:00'
-    
+    session (requests.Session) : Optional shared session (see make_session)
+    rate_limiter (TokenBucket) : Optional rate limiter
+    base_url (str) : API url; can be pointed at a local server for testing
+    cache_dir (str) : Raw response cache directory (see darksky_client.py)
+
     OUTPUT
     df_daily, df_hourly : Pandas Dataframes with daily, hourly weather data
     See https://darksky.net/dev/docs#api-request-types for info on data fields
     '''
 
-    req_url = 'https://api.darksky.net/forecast/' + api_key + '/' + str(lat) + ',' + str(lon) + ',' + time
-    content = requests.get(req_url)
-    dat_dict = content.json()
-    daily = dat_dict['daily']['data'][0]
-    df_daily = pd.DataFrame.from_dict([daily])
-    
-    df_daily['lat'] = lat
-    df_daily['lon'] = lon
-
-    time_fields = ['time','sunriseTime','sunsetTime','precipIntensityMaxTime','temperatureHighTime','temperatureLowTime',
-              'apparentTemperatureHighTime','apparentTemperatureLowTime','windGustTime','uvIndexTime','temperatureMinTime',
-              'temperatureMaxTime','temperatureMaxTime','apparentTemperatureMinTime','apparentTemperatureMaxTime']
-    for field in time_fields:
-        df_daily[field] = pd.to_datetime(df_daily[field], origin='unix', unit='s',utc=True).dt.tz_convert(dat_dict['timezone'])
-        
-    hourly = dat_dict['hourly']
-    df_hourly = pd.DataFrame.from_dict(hourly['data'])
-    df_hourly['lat'] = lat
-    df_hourly['lon'] = lon
-    df_hourly['time'] = pd.to_datetime(df_hourly['time'], origin='unix', unit='s', utc=True).dt.tz_convert(dat_dict['timezone'])
-    
-    return df_daily, df_hourly
+    dat_dict = get_historical_json(api_key, lat, lon, time, session=session, rate_limiter=rate_limiter,
+                                   base_url=base_url, cache_dir=cache_dir)
+    return parse_darksky_historical(dat_dict, lat, lon)
+
+
+def parse_darksky_historical(dat_dict, lat, lon):
+    '''
+    Parse a raw Dark Sky historical response (see get_darksky_historical) into dataframes
+
+    INPUT
+    dat_dict (dict) : Decoded json response
+    lat, lon (float) : Location the data was requested for
+
+    OUTPUT
+    df_daily, df_hourly : Pandas Dataframes with daily, hourly weather data
+    '''
+    responses = [(dat_dict, lat, lon)]
+    return decode_daily(responses), decode_hourly(responses)
+
+
+def daily_file_names(base_dir, park_name, day):
+    '''
+    Return (daily, hourly) pickle file names for a park and day (str formatted like '2020-05-01')
+    '''
+    base = os.path.join(os.path.expanduser(base_dir), park_name + '_historical_' + day)
+    return base + '_daily.pkl', base + '_hourly.pkl'
+
+
+def backfill_historical(api_key, park_info, start, end, base_dir='./data/proc/weather/historical/daily_files/',
+                        n_workers=8, rate=10, base_url=DARKSKY_BASE_URL, cache_dir=CACHE_DIR, session=None,
+                        rate_limiter=None):
+    '''
+    Get historical weather for every park in park_info for every day from start to end (inclusive),
+    using a pool of worker threads sharing one keep-alive session and a rate limiter.
+    (park, day) pairs that already have both daily and hourly files in base_dir are skipped,
+    so an interrupted backfill can just be re-run.
+
+    INPUT
+    api_key (str)
+    park_info (dict) : Park info dict (see make_park_info.py)
+    start, end (str) : Date range, formatted like '2020-05-01'
+    base_dir (str) : Directory to save daily files to
+    n_workers (int) : Number of worker threads
+    rate (float) : Max requests per second
+    base_url (str) : API url
+    cache_dir (str) : Raw response cache directory; days already in the cache cost no API calls
+    session, rate_limiter : Optional session and rate limiter to use (and keep) instead of new ones
+
+    OUTPUT
+    summary (dict) : 'fetched' and 'skipped' counts, and list of 'failed' (park_name, day, error)
+    '''
+    days = [str(day)[0:10] for day in pd.date_range(start=start, end=end)]
+
+    jobs = []
+    n_skipped = 0
+    for park_name in park_info.keys():
+        for day in days:
+            if all(os.path.exists(file) for file in daily_file_names(base_dir, park_name, day)):
+                n_skipped += 1
+            else:
+                jobs.append((park_name, day))
+
+    own_session = session is None
+    if own_session:
+        session = make_session(pool_size=n_workers)
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(rate)
+
+    def fetch_and_save(park_name, day):
+        df_daily, df_hourly = get_darksky_historical(api_key=api_key, lat=park_info[park_name]['lat'],
+                                                     lon=park_info[park_name]['lon'], time=day + 'T00:00:00',
+                                                     session=session, rate_limiter=rate_limiter, base_url=base_url,
+                                                     cache_dir=cache_dir)
+        daily_file, hourly_file = daily_file_names(base_dir, park_name, day)
+        # write hourly first; resume only checks for both, so a partial day gets re-fetched
+        df_hourly.to_pickle(hourly_file)
+        df_daily.to_pickle(daily_file)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = {pool.submit(fetch_and_save, park_name, day): (park_name, day) for park_name, day in jobs}
+        for future in as_completed(futures):
+            park_name, day = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed.append((park_name, day, repr(e)))
+                print('Failed: ' + park_name + ' ' + day + ' : ' + repr(e))
+
+    if own_session:
+        session.close()
+
+    return {'fetched': len(jobs) - len(failed), 'skipped': n_skipped, 'failed': failed}
+
 
 if __name__=='__main__':
 
+    parser = argparse.ArgumentParser(description='Backfill historical Dark Sky weather for all parks')
+    parser.add_argument('--start', default='2019-08-30', help='First day to get (YYYY-MM-DD)')
+    parser.add_argument('--end', default='2020-05-16', help='Last day to get (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=8, help='Number of worker threads')
+    parser.add_argument('--rate', type=float, default=10, help='Max requests per second')
+    parser.add_argument('--base-dir', default='./data/proc/weather/historical/daily_files/')
+    args = parser.parse_args()
+
     with open('./data/park_info.pkl', 'rb') as f:
         park_info = pickle.load(f)
 
     API_KEY = os.getenv('DARKSKY_API_KEY')
 
-    day_vec = pd.date_range(start='8/30/2019', end='5/16/2020').to_pydatetime().tolist()
-
-    #for park_name in park_info.keys():
-    ipark=6
-    park_name = list(park_info.keys())[ipark]
-    print(park_name)
-    lat = park_info[park_name]['lat']
-    print(lat)
-    lon = park_info[park_name]['lon']
-    print(lon)
-    for i in range(len(day_vec)):
-        the_time = str(day_vec[i])[0:10] + 'T00:00:00'
-        df_daily, df_hourly = get_darksky_historical(api_key=API_KEY, lat = lat, lon = lon, time = the_time)
-
-        base_dir = '~/Galvanize/Lot-Spot_Analysis/data/proc/weather/historical/daily_files/'
-
-        df_daily.to_pickle(base_dir  + park_name + '_historical_'  + str(day_vec[i])[0:10] + '_daily.pkl')
-        df_hourly.to_pickle(base_dir + park_name + '_historical_' + str(day_vec[i])[0:10] + '_hourly.pkl')
\ No newline at end of file
+    t0 = timer.time()
+    summary = backfill_historical(API_KEY, park_info, args.start, args.end, base_dir=args.base_dir,
+                                  n_workers=args.workers, rate=args.rate)
+    print('Fetched ' + str(summary['fetched']) + ', skipped ' + str(summary['skipped']) +
+          ', failed ' + str(len(summary['failed'])) + ' in ' + str(round(timer.time() - t0, 1)) + ' s')
@@ -1,5 +1,15 @@
 # Train a random forest model to predict parking lot capacity
-
+# Usage: python src/modeling.py [--tune grid|random|halving] [--budget N] [--workers N]
+#        python src/modeling.py --update [--holdout-days 7] [--window-days 28]   (add trees for new days to saved models)
+
+import os
+import sys
+import copy
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 np.random.seed(47)
@@ -9,6 +19,10 @@ from datetime import datetime
 
 from sklearn.model_selection import train_test_split
 from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GroupKFold
+from sklearn.model_selection import RandomizedSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa, needed to import HalvingRandomSearchCV
+from sklearn.model_selection import HalvingRandomSearchCV
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
 from sklearn.metrics import r2_score
@@ -16,6 +30,10 @@ from sklearn.inspection import plot_partial_dependence
 
 import pickle
 
+from storage import read_dataset, dataset_fingerprint
+from features import add_model_fields, asof_join, MODEL_FEATURES
+from feature_store import feature_key, save_features, load_features
+
 # make plots look nice
 plt.rcParams['font.size'] = 14
 plt.rcParams['axes.labelsize'] = 'large'
@@ -24,10 +42,25 @@ plt.rcParams['ytick.labelsize'] = 'large'
 plt.rcParams['lines.linewidth'] = 3
 plt.style.use('ggplot')
 
+# Random forest hyperparameters to search over
+RF_PARAMS = {'n_estimators':[100, 200, 250],
+             'max_features':['auto','sqrt','log2'],
+             'min_samples_split':[2,5,10],
+             'max_depth':[5,10,None]
+             }
+
+# Extra features for the single multi-park model (see fit_global); park_id is the park's position in park_info
+PARK_FEATURES = ['park_id','capacity','lat','lon']
+GLOBAL_MODEL_FILE = './model/global_rf_model.pkl'
+
+# Best params found for each (park, data, search settings) are saved here so unchanged parks aren't re-tuned
+TUNING_CACHE_DIR = './model/tuning_cache/'
+
+MODEL_DIR = './model/'
+
 
-def load_resampled_park_data(park_name):
-    base_dir = './data/proc/LotSpot/'
-    df = pd.read_pickle(base_dir  + park_name + '_resampled_hourly.pkl')
+def load_resampled_park_data(park_name, columns=None):
+    df = read_dataset('lotspot_hourly', park_name, columns=columns)
     return df
 
 def train_test_split_days(df):
@@ -82,115 +115,591 @@ def plot_feature_importance(tree_model, feature_names):
     ax.set_xlabel('Feature Importance')
     return fig,ax
 
+# Weather columns and hours (6am-7pm) used for the model data (see load_park_model_data)
+MODEL_WEATHER_COLUMNS = ['time','temperature','cloudCover','precipIntensity','uvIndex']
+MODEL_HOURS = (6, 19)
+# Hourly weather is joined to the nearest hour within tolerance, or interpolated across gaps up to interp_limit
+WEATHER_JOIN = {'tolerance': '15min', 'interp_limit': '3H'}
+
+def build_park_model_data(park_name):
+    '''
+    Load hourly LotSpot data for a park, merged w/ hourly weather, w/ only the columns used by the model
+
+    OUTPUT
+    df (Pandas DataFrame) : date, hour, is_wknd, temperature, cloudCover, uvIndex, and percent_capacity columns
+    '''
+    df = load_resampled_park_data(park_name)
+    df = df[(df['hour']>=MODEL_HOURS[0]) & (df['hour']<=MODEL_HOURS[1])]
+    df = add_model_fields(df)
+    df['hour'] = df['hour'].astype('category')
+    #df_post_covid = df[df['datetime']>'2020-03-01']
+    #df = df[df['datetime']<'2020-03-01']
+
+    # load and merge weather data
+    wea = read_dataset('weather_hourly', park_name, columns=MODEL_WEATHER_COLUMNS)
+    df, counts = asof_join(df, wea, left_on='datetime', right_on='time', tolerance=WEATHER_JOIN['tolerance'],
+                           interp_limit=WEATHER_JOIN['interp_limit'])
+    print(park_name + ' weather join : ' + str(counts))
+
+    # drop un-needed columns for model
+    df.drop(['datetime','day','month','time','dow','precipIntensity'], axis=1, inplace=True)
+    # drop any rows with NaNs
+    df.dropna(axis=0, how='any', inplace=True)
+    return df
+
+def load_park_model_data(park_name, use_cache=True):
+    '''
+    build_park_model_data, but cached in the feature store (see feature_store.py): the merged data is only rebuilt
+    when the park's hourly LotSpot or weather data (or the model features) have changed.
+    Features come back as float32 (same values) and dates as strings.
+    '''
+    if not use_cache:
+        return build_park_model_data(park_name)
+    fingerprints = [dataset_fingerprint('lotspot_hourly', park_name), dataset_fingerprint('weather_hourly', park_name)]
+    key = feature_key(fingerprints, {'weather_columns': MODEL_WEATHER_COLUMNS, 'hours': MODEL_HOURS,
+                                     'features': MODEL_FEATURES, 'weather_join': WEATHER_JOIN})
+    df = load_features(park_name, key)
+    if df is None:
+        df = build_park_model_data(park_name)
+        save_features(park_name, key, df)
+    return df
+
+def data_fingerprint(*arrays):
+    '''
+    sha1 hex digest of the contents of one or more NumPy arrays
+    '''
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.dtype, arr.shape)).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+def day_groups(dates):
+    '''
+    Integer day number (0 to # days-1) for each row, from a column of dates, to use as CV groups
+    '''
+    return pd.factorize(dates)[0].astype(np.int32)
+
+def make_search(method='grid', budget=27, n_jobs=-1, cv=5, seed=47):
+    '''
+    Make a (not yet fit) hyperparameter search over RF_PARAMS. The forests themselves are single-threaded;
+    all parallelism is in the search (n_jobs), so cores aren't over-subscribed.
+
+    INPUT
+    method (str) : 'grid' (every combination), 'random' (budget randomly chosen combinations),
+                   or 'halving' (successive halving over budget random candidates, w/ n_estimators as the resource)
+    budget (int) : Number of parameter combinations to try for 'random'/'halving'
+    n_jobs (int) : Number of fits to run in parallel
+    cv : # of folds or sklearn CV splitter (eg GroupKFold to keep days together)
+    seed (int)
+
+    RETURNS
+    search : sklearn search object (w/ refit=False)
+    '''
+    rf = RandomForestRegressor(n_jobs=1, random_state=seed)
+    if method == 'grid':
+        return GridSearchCV(rf, RF_PARAMS, cv=cv, n_jobs=n_jobs, refit=False)
+    elif method == 'random':
+        return RandomizedSearchCV(rf, RF_PARAMS, n_iter=budget, cv=cv, n_jobs=n_jobs, refit=False, random_state=seed)
+    elif method == 'halving':
+        params = {key: values for key, values in RF_PARAMS.items() if key != 'n_estimators'}
+        max_trees = max(RF_PARAMS['n_estimators'])
+        return HalvingRandomSearchCV(rf, params, n_candidates=budget, resource='n_estimators', factor=3,
+                                     min_resources=max_trees//9, max_resources=max_trees, cv=cv, n_jobs=n_jobs,
+                                     refit=False, random_state=seed)
+    raise ValueError('Unknown tuning method ' + method)
+
+def tune_rf(park_name, X_train, y_train, groups=None, method='grid', budget=27, n_jobs=-1, cache_dir=TUNING_CACHE_DIR):
+    '''
+    Find the best random forest parameters for a park's training data. Results are cached by
+    (park, data fingerprint, search settings), so re-running on unchanged data skips the search.
+
+    INPUT
+    park_name (str)
+    X_train, y_train (NumPy arrays)
+    groups (NumPy array) : Day number of each training row (see day_groups); if given, CV folds keep whole days
+                           together (like train_test_split_days), otherwise rows are split into folds individually
+    method, budget, n_jobs : See make_search
+    cache_dir (str)
+
+    RETURNS
+    tuning (dict) : best_params, best_score (mean CV R^2), n_fits, search_s, and cached (True if read from cache)
+    '''
+    settings = {'method': method, 'budget': budget if method != 'grid' else None, 'params': RF_PARAMS,
+                'cv': 'rows' if groups is None else 'days'}
+    arrays = (X_train, y_train) if groups is None else (X_train, y_train, groups)
+    key = data_fingerprint(*arrays) + json.dumps(settings, sort_keys=True)
+    cache_file = os.path.join(cache_dir, park_name + '-' + hashlib.sha1(key.encode()).hexdigest()[:16] + '.json')
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            tuning = json.load(f)
+        tuning['cached'] = True
+        return tuning
+
+    t0 = time.time()
+    search = make_search(method, budget, n_jobs, cv=5 if groups is None else GroupKFold(n_splits=5))
+    search.fit(X_train, y_train, groups=groups)
+    tuning = {'park_name': park_name, 'method': method, 'cv': settings['cv'], 'best_params': search.best_params_,
+              'best_score': float(search.best_score_), 'n_fits': int(len(search.cv_results_['params'])*search.n_splits_),
+              'search_s': time.time() - t0}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file + '.tmp', 'w') as f:
+        json.dump(tuning, f, indent=1)
+    os.replace(cache_file + '.tmp', cache_file)
+    tuning['cached'] = False
+    return tuning
+
+def fit_park(park_name, method='grid', budget=27, group_days=True, n_jobs=-1):
+    '''
+    Split a park's data, fit the mean and default random forest baselines, then tune and fit the final forest.
+    If group_days, tuning CV folds keep whole days together.
+
+    RETURNS
+    result (dict) : Metrics, tuning info, fitted rf_best model, X_train and feature_names (for plots)
+    '''
+    # re-seed so each park's split doesn't depend on which parks ran before it (or in which process)
+    np.random.seed(47)
+    df = load_park_model_data(park_name)
+
+    # Train/test split ; Note I keep entire days together per Kayla's suggestion, since data within a certain day might be correlated
+    X_train, X_test, y_train, y_test, feature_names, df_train, df_test = train_test_split_days(df)
+    res = {'park_name': park_name, 'feature_names': list(feature_names), 'X_train': X_train}
+
+    # Predict the mean - hopefully we can do better!
+    y_hat_mean = np.mean(y_train)*np.ones_like(y_train)
+    res['pred_mean_train_r2'] = round(r2_score(y_train,y_hat_mean),2)
+    y_hat_mean = np.mean(y_train)*np.ones_like(y_test)
+    res['pred_mean_test_r2'] = round(r2_score(y_test,y_hat_mean),2)
+    res['pred_mean_test_rmse'] = round(np.sqrt(mean_squared_error(y_test,y_hat_mean)),2)
+
+    # Fit Random Forest with default parameters
+    rf = RandomForestRegressor(n_jobs=n_jobs)
+    rf.fit(X_train,y_train)
+    y_hat_rf = rf.predict(X_test)
+    res['rf_def_train_r2']  = round(rf.score(X_train,y_train),2)
+    res['rf_def_test_r2']   = round(rf.score(X_test,y_test),2)
+    res['rf_def_test_rmse'] = round(np.sqrt(mean_squared_error(y_test,y_hat_rf)),2)
+
+    # Tune random forest model, then re-fit w/ the best params on all the training data
+    groups = day_groups(df_train['date'].values) if group_days else None
+    res['tuning'] = tune_rf(park_name, X_train, y_train, groups=groups, method=method, budget=budget, n_jobs=n_jobs)
+    t0 = time.time()
+    rf_best = RandomForestRegressor(n_jobs=n_jobs, **res['tuning']['best_params'])
+    rf_best.fit(X_train, y_train)
+    res['fit_s'] = time.time() - t0
+    res['rf_best'] = rf_best
+    res['model_bytes'] = len(pickle.dumps(rf_best))
+
+    y_hat_rf_best = rf_best.predict(X_test)
+    res['rf_opt_train_r2']  = round(rf_best.score(X_train,y_train),2)
+    res['rf_opt_test_r2']   = round(rf_best.score(X_test,y_test),2)
+    res['rf_opt_test_rmse'] = round(np.sqrt(mean_squared_error(y_test, y_hat_rf_best)),2)
+    res['holdout_r2'] = r2_score(y_test, y_hat_rf_best)
+    res['data_through'] = df['date'].max()
+    return res
+
+def cv_report(results):
+    '''
+    Compare tuning CV R^2 (for the best params) to R^2 on the held out days for each park.
+    A CV score much higher than the holdout score means the CV folds are leaking information.
+
+    RETURNS
+    df (Pandas DataFrame) : park_name, cv, cv_r2, holdout_r2, and gap (cv_r2 - holdout_r2)
+    '''
+    df = pd.DataFrame({'park_name': [res['park_name'] for res in results],
+                       'cv': [res['tuning'].get('cv', 'rows') for res in results],
+                       'cv_r2': [res['tuning']['best_score'] for res in results],
+                       'holdout_r2': [res['holdout_r2'] for res in results]})
+    df['gap'] = df['cv_r2'] - df['holdout_r2']
+    return df.round(3)
+
+def fit_global(park_info, method='grid', budget=27, group_days=True, n_jobs=-1):
+    '''
+    Fit one random forest on the data from all parks, w/ PARK_FEATURES added so the model can tell parks apart.
+    Each park's data is split into train/test days exactly as in fit_park, so test scores can be compared
+    w/ the per-park models. One tuning run is done for all parks.
+
+    INPUT
+    park_info (dict) : From make_park_info.py
+    method, budget, group_days, n_jobs : See fit_park
+
+    RETURNS
+    result (dict) : Tuning info, fitted rf_best model, fit_s, model_bytes, feature_names, and
+                    park_scores ({park_name : (test R^2, test RMSE)})
+    '''
+    X_train, y_train, dates_train, tests = [], [], [], {}
+    for park_id, park_name in enumerate(park_info.keys()):
+        np.random.seed(47)
+        df = load_park_model_data(park_name)
+        df['park_id'] = park_id
+        for key in PARK_FEATURES[1:]:
+            df[key] = park_info[park_name][key]
+        X_tr, X_te, y_tr, y_te, feature_names, df_train, df_test = train_test_split_days(df)
+        X_train.append(X_tr)
+        y_train.append(y_tr)
+        dates_train.append(df_train['date'].values)
+        tests[park_name] = (X_te, y_te)
+
+    X_train, y_train = np.concatenate(X_train), np.concatenate(y_train)
+    # group on date alone, so the same day at different parks (same weather) stays in one fold
+    groups = day_groups(np.concatenate(dates_train)) if group_days else None
+    res = {'park_name': 'global', 'feature_names': list(feature_names)}
+    res['tuning'] = tune_rf('global', X_train, y_train, groups=groups, method=method, budget=budget, n_jobs=n_jobs)
+
+    t0 = time.time()
+    rf_best = RandomForestRegressor(n_jobs=n_jobs, **res['tuning']['best_params'])
+    rf_best.fit(X_train, y_train)
+    res['fit_s'] = time.time() - t0
+    res['rf_best'] = rf_best
+    res['model_bytes'] = len(pickle.dumps(rf_best))
+
+    res['park_scores'] = {}
+    for park_name, (X_test, y_test) in tests.items():
+        y_hat = rf_best.predict(X_test)
+        res['park_scores'][park_name] = (round(r2_score(y_test, y_hat),2), round(np.sqrt(mean_squared_error(y_test, y_hat)),2))
+    return res
+
+def compare_global(results, res_global):
+    '''
+    Side-by-side test R^2/RMSE for each park, per-park models vs. the global model,
+    plus total fit time (s) and model size (MB) for each approach
+
+    RETURNS
+    df (Pandas DataFrame)
+    '''
+    rows = []
+    for res in results:
+        r2, rmse = res_global['park_scores'][res['park_name']]
+        rows.append([res['park_name'], res['rf_opt_test_r2'], r2, res['rf_opt_test_rmse'], rmse])
+    rows.append(['fit time (s)', round(sum(res['fit_s'] for res in results),1), round(res_global['fit_s'],1), None, None])
+    rows.append(['size (MB)', round(sum(res['model_bytes'] for res in results)/1e6,1), round(res_global['model_bytes']/1e6,1), None, None])
+    return pd.DataFrame(rows, columns=['park_name','per_park_r2','global_r2','per_park_rmse','global_rmse'])
+
+def fit_parks(park_names, n_workers=None, **kwargs):
+    '''
+    Run fit_park for several parks, w/ one park per worker process. When parks run in parallel each park's
+    search and forests are single-threaded; w/ n_workers=1 the search uses all cores instead.
+
+    RETURNS
+    results (list) : fit_park result for each park, in the order of park_names
+    '''
+    if n_workers is None:
+        n_workers = min(len(park_names), os.cpu_count())
+    if n_workers == 1:
+        return [fit_park(park_name, n_jobs=-1, **kwargs) for park_name in park_names]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(fit_park, park_name, n_jobs=1, **kwargs) for park_name in park_names]
+        return [future.result() for future in futures]
+
+def model_file_names(park_name, model_dir=MODEL_DIR):
+    '''
+    Pickled model file and its JSON metadata file (see model_meta) for a park
+    '''
+    base = os.path.join(model_dir, park_name + '_rf_model')
+    return base + '.pkl', base + '.json'
+
+def write_model_meta(park_name, meta, model_dir=MODEL_DIR):
+    meta_file = model_file_names(park_name, model_dir)[1]
+    os.makedirs(model_dir, exist_ok=True)
+    with open(meta_file + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(meta_file + '.tmp', meta_file)
+
+def save_model(park_name, model, meta, model_dir=MODEL_DIR):
+    '''
+    Save a park's model and its metadata. The model is written then renamed, so anything loading it
+    (eg predict_server.py) never sees half a file.
+    '''
+    model_file = model_file_names(park_name, model_dir)[0]
+    os.makedirs(model_dir, exist_ok=True)
+    with open(model_file + '.tmp', 'wb') as f:
+        pickle.dump(model, f)
+    write_model_meta(park_name, meta, model_dir)
+    os.replace(model_file + '.tmp', model_file)
+
+def load_model(park_name, model_dir=MODEL_DIR):
+    '''
+    RETURNS
+    model : The park's saved model (None if there isn't one)
+    meta (dict) : Its metadata (None if it was saved w/o any)
+    '''
+    model_file, meta_file = model_file_names(park_name, model_dir)
+    if not os.path.exists(model_file):
+        return None, None
+    with open(model_file, 'rb') as f:
+        model = pickle.load(f)
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    return model, meta
+
+def model_meta(res):
+    '''
+    Metadata for a model from fit_park: fit_through is the last day the full fit's trees could have been trained on,
+    trained_through the last day any of its trees could have been trained on (moved on by update_park),
+    data_through the last day of data when it was last fit or updated, and n_estimators the tuned forest size
+    '''
+    return {'fit': 'full', 'fitted': datetime.now().isoformat(timespec='seconds'), 'fit_through': res['data_through'],
+            'trained_through': res['data_through'], 'data_through': res['data_through'],
+            'n_estimators': res['rf_best'].n_estimators,
+            'feature_names': res['feature_names'], 'updates': []}
+
+def update_park(park_name, holdout_days=7, window_days=28, new_trees=None, max_trees=None, tolerance=0.0,
+                n_jobs=-1, model_dir=MODEL_DIR):
+    '''
+    Update a park's saved forest w/ the days that have arrived since it was last fit or updated, w/o re-tuning
+    or re-fitting it. The tuned parameters are the saved model's own. new_trees more trees are grown (warm start)
+    on the window_days days before the holdout, then the oldest trees are dropped so there are at most max_trees
+    (a sliding window, so the forest moves to recent data while prediction cost stays the same).
+
+    The holdout is the latest holdout_days whole days, leaving out any the last full fit could have trained on.
+    The updated forest is only saved if its holdout RMSE is no more than tolerance above the saved forest's;
+    either way the metadata records the attempt. Holdout days are trained on once they roll out of the holdout,
+    so the newest trees trail the data by holdout_days.
+
+    Trees are only added once the window has at least one day no kept tree was trained on (after trained_through,
+    see model_meta); until then (eg for the first holdout_days days after a full fit, while new days are all in
+    the holdout) nothing is fit and the status is 'no new days to train on', so the same days aren't re-fit
+    just to replace trees.
+
+    INPUT
+    park_name (str)
+    holdout_days (int) : Latest days to evaluate on (7 covers every day of the week)
+    window_days (int) : Days before the holdout the new trees are fit on
+    new_trees (int) : Trees to add (default 10% of the tuned n_estimators)
+    max_trees (int) : Most trees to keep (default the tuned n_estimators)
+    tolerance (float) : Allowed increase in holdout RMSE
+    n_jobs (int)
+    model_dir (str)
+
+    RETURNS
+    result (dict) : status ('promoted', 'rejected', 'no new days', or 'no new days to train on'), new_days, holdout and
+                    window (first, last day),
+                    trees_added, trees_dropped, old/new holdout RMSE and R^2, fit_s, and rf_best (the model kept)
+    '''
+    model, meta = load_model(park_name, model_dir)
+    if model is None:
+        raise FileNotFoundError(model_file_names(park_name, model_dir)[0])
+    df = load_park_model_data(park_name)
+    df['date'] = df['date'].astype(str)
+    y = df.pop('percent_capacity').values
+    feature_names = list(df.drop('date', axis=1).columns)
+    X = df.drop('date', axis=1).values
+    if model.n_features_in_ != X.shape[1] or (meta is not None and meta['feature_names'] != feature_names):
+        raise ValueError(park_name + ' model features have changed, it needs a full fit')
+    if meta is None:
+        # saved before metadata was kept; which days it was trained on is unknown
+        meta = {'fit': 'full', 'fitted': None, 'fit_through': None, 'trained_through': None, 'data_through': None,
+                'n_estimators': len(model.estimators_), 'feature_names': feature_names, 'updates': []}
+
+    days = np.sort(df['date'].unique())
+    new_days = days if meta['data_through'] is None else days[days > meta['data_through']]
+    res = {'park_name': park_name, 'new_days': len(new_days), 'rf_best': model}
+    if len(new_days) == 0:
+        res['status'] = 'no new days'
+        return res
+
+    holdout = days[-holdout_days:]
+    if meta['fit_through'] is not None:
+        holdout = holdout[holdout > meta['fit_through']]
+    window = days[days < holdout[0]][-window_days:]
+    if len(window) == 0:
+        raise ValueError(park_name + ' has no days before the holdout to fit new trees on')
+    in_holdout, in_window = df['date'].isin(holdout).values, df['date'].isin(window).values
+    res['holdout'], res['window'] = (holdout[0], holdout[-1]), (window[0], window[-1])
+    trained_through = meta.get('trained_through', meta['fit_through'])
+    if trained_through is not None and window[-1] <= trained_through:
+        res['status'] = 'no new days to train on'
+        return res
+
+    new_trees = max(1, round(0.1*meta['n_estimators'])) if new_trees is None else new_trees
+    max_trees = meta['n_estimators'] if max_trees is None else max_trees
+    t0 = time.time()
+    rf_new = copy.deepcopy(model)
+    rf_new.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees, n_jobs=n_jobs)
+    rf_new.fit(X[in_window], y[in_window])
+    # estimators_ is in the order the trees were grown, so the oldest are first
+    n_drop = max(0, len(rf_new.estimators_) - max_trees)
+    rf_new.estimators_ = rf_new.estimators_[n_drop:]
+    rf_new.set_params(warm_start=False, n_estimators=len(rf_new.estimators_))
+    res['fit_s'] = time.time() - t0
+    res['trees_added'], res['trees_dropped'] = new_trees, n_drop
+
+    for name, rf in [('old', model), ('new', rf_new)]:
+        y_hat = rf.predict(X[in_holdout])
+        res[name + '_holdout_rmse'] = float(np.sqrt(mean_squared_error(y[in_holdout], y_hat)))
+        res[name + '_holdout_r2'] = float(r2_score(y[in_holdout], y_hat))
+    promoted = res['new_holdout_rmse'] <= res['old_holdout_rmse'] + tolerance
+    res['status'] = 'promoted' if promoted else 'rejected'
+
+    meta['data_through'] = days[-1]
+    meta['updates'] = (meta['updates'] + [{'updated': datetime.now().isoformat(timespec='seconds'), 'status': res['status'],
+                                           'window': list(res['window']), 'holdout': list(res['holdout']),
+                                           'trees_added': new_trees, 'trees_dropped': n_drop,
+                                           'old_holdout_rmse': round(res['old_holdout_rmse'], 3),
+                                           'new_holdout_rmse': round(res['new_holdout_rmse'], 3)}])[-30:]
+    if promoted:
+        meta['fit'], meta['fitted'] = 'update', meta['updates'][-1]['updated']
+        meta['trained_through'] = window[-1]
+        save_model(park_name, rf_new, meta, model_dir)
+        res['rf_best'] = rf_new
+    else:
+        write_model_meta(park_name, meta, model_dir)
+    return res
+
+def update_summary(res):
+    '''
+    One line describing an update_park result
+    '''
+    if res['status'] == 'no new days':
+        return res['park_name'] + ' : no new days'
+    if res['status'] == 'no new days to train on':
+        return (res['park_name'] + ' : ' + str(res['new_days']) + ' new days, all still in the holdout ('
+                + ' to '.join(res['holdout']) + '), no new days to train on')
+    return (res['park_name'] + ' : ' + res['status'] + ', ' + str(res['new_days']) + ' new days, +' + str(res['trees_added'])
+            + '/-' + str(res['trees_dropped']) + ' trees on ' + ' to '.join(res['window']) + ' in ' + str(round(res['fit_s'], 1))
+            + ' s, holdout ' + ' to '.join(res['holdout']) + ' RMSE ' + str(round(res['old_holdout_rmse'], 2)) + ' -> '
+            + str(round(res['new_holdout_rmse'], 2)) + ', R^2 ' + str(round(res['old_holdout_r2'], 2)) + ' -> '
+            + str(round(res['new_holdout_r2'], 2)))
+
 if __name__=='__main__':
 
+    parser = argparse.ArgumentParser(description='Train a random forest model for each park')
+    parser.add_argument('--tune', choices=['grid','random','halving'], default='grid',
+                        help='Hyperparameter search: full grid, randomized, or successive halving')
+    parser.add_argument('--budget', type=int, default=27, help='Number of parameter combinations to try w/ random/halving')
+    parser.add_argument('--workers', type=int, default=None, help='Number of parks to fit in parallel (default is # CPUs)')
+    parser.add_argument('--cv', choices=['days','rows'], default='days',
+                        help='Tuning CV folds: keep whole days together (default) or split individual rows')
+    parser.add_argument('--global', dest='global_model', action='store_true',
+                        help='Also fit one model for all parks (w/ park features) and compare it to the per-park models')
+    parser.add_argument('--update', action='store_true',
+                        help='Add trees for new days to each saved model (see update_park) instead of re-tuning and re-fitting')
+    parser.add_argument('--holdout-days', type=int, default=7, help='Latest days to evaluate updates on')
+    parser.add_argument('--window-days', type=int, default=28, help='Days before the holdout that new trees are fit on')
+    parser.add_argument('--new-trees', type=int, default=None, help='Trees to add per update (default 10%% of the tuned number)')
+    parser.add_argument('--max-trees', type=int, default=None, help='Most trees to keep, dropping the oldest (default the tuned number)')
+    args = parser.parse_args()
+
     with open('./data/park_info.pkl', 'rb') as f:
         park_info = pickle.load(f)
 
+    if args.update:
+        file1 = open("./model/model_summary.txt","a")
+        file1.write('\n~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n')
+        file1.write('\nModel Update Run on: ' + datetime.now().strftime('%Y-%m-%d') + '\n')
+        failed = []
+        for park_name in park_info.keys():
+            if not os.path.exists(model_file_names(park_name)[0]):
+                print(park_name + ' : no saved model (run w/o --update first)')
+                continue
+            try:
+                res = update_park(park_name, holdout_days=args.holdout_days, window_days=args.window_days,
+                                  new_trees=args.new_trees, max_trees=args.max_trees)
+            except Exception as e:
+                # eg features changed since the model was fit (re-fit it w/o --update); go on w/ the other parks
+                failed.append(park_name)
+                print(park_name + ' : update failed : ' + repr(e))
+                file1.write(park_name + ' : update failed : ' + repr(e) + '\n')
+                continue
+            print(update_summary(res))
+            file1.write(update_summary(res) + '\n')
+        file1.close()
+        if failed:
+            print('Update failed for ' + str(len(failed)) + ' park(s): ' + ', '.join(failed))
+        sys.exit(1 if failed else 0)
+
+    t0 = time.time()
+    results = fit_parks(list(park_info.keys()), n_workers=args.workers, method=args.tune, budget=args.budget,
+                        group_days=(args.cv == 'days'))
+    t_total = time.time() - t0
+
     file1 = open("./model/model_summary.txt","a")
 
     file1.write('\n~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n')
     file1.write('\nModel Script Run on: ' + datetime.now().strftime('%Y-%m-%d'))
+    file1.write('\nTuning: ' + args.tune + ('' if args.tune == 'grid' else ' (budget ' + str(args.budget) + ')')
+                + ', CV folds by ' + args.cv + ', total time ' + str(round(t_total)) + ' s')
 
-    for park_name in park_info.keys():
+    for res in results:
 
+        park_name = res['park_name']
         print(park_name)
         file1.write('\n\n' + park_name + '\n\n')
-        df = load_resampled_park_data(park_name)
-        df = df[(df['hour']>5) & (df['hour']<20)]
-        df['is_wknd'] = df['dow'].apply(lambda x: 0 if x<5 else 1)
-        df['hour'] = df['hour'].astype('category')
-        #df_post_covid = df[df['datetime']>'2020-03-01']
-        #df = df[df['datetime']<'2020-03-01']
-
-        # load and merge weather data
-        wea = pd.read_pickle('./data/proc/weather/historical/combined/' + park_name + '_historical_combined_wea_hourly.pkl')
-        wea = wea[['time','temperature','cloudCover','precipIntensity','uvIndex']]
-        df = pd.merge(df,wea,left_on='datetime',right_on='time')
-
-        # drop un-needed columns for model
-        df.drop(['datetime','day','month','time','dow','precipIntensity'], axis=1, inplace=True)
-        # drop any rows with NaNs
-        df.dropna(axis=0, how='any', inplace=True)
-
-        # Train/test split ; Note I keep entire days together per Kayla's suggestion, since data within a certain day might be correlated
-        X_train, X_test, y_train, y_test, feature_names, df_train, df_test = train_test_split_days(df)
-        
-        file1.write('\nFeature names: ' + str(list(feature_names)) +'\n' )
-
-        # Predict the mean - hopefully we can do better!
-        y_hat_mean = np.mean(y_train)*np.ones_like(y_train)
-        pred_mean_train_r2 = round(r2_score(y_train,y_hat_mean),2)
-        y_hat_mean = np.mean(y_train)*np.ones_like(y_test)
-        pred_mean_test_r2 = round(r2_score(y_test,y_hat_mean),2)        
-        pred_mean_test_rmse = round(np.sqrt(mean_squared_error(y_test,y_hat_mean)),2)
-        print( 'Predict mean train  R^2 : ' + str(pred_mean_train_r2)  )
-        print( 'Predict mean test R^2 : ' +  str(pred_mean_test_r2) )
-        print( 'Predict mean RMSE : ' + str(pred_mean_test_rmse) )
-
-        file1.write('Predict mean train R^2 : ' + str(pred_mean_train_r2) + '\n')
-        file1.write('Predict mean test R^2 : ' +  str(pred_mean_test_r2) + '\n')
-        file1.write('Predict mean RMSE : ' + str(pred_mean_test_rmse) + '\n')
-
-        # Fit Random Forest with default parameters
-        rf = RandomForestRegressor(n_jobs=-1)
-        rf.fit(X_train,y_train)
-        y_hat_rf = rf.predict(X_test)
-        rf_def_train_r2  = round(rf.score(X_train,y_train),2)
-        rf_def_test_r2   = round(rf.score(X_test,y_test),2)
-        rf_def_test_rmse = round(np.sqrt(mean_squared_error(y_test,y_hat_rf)),2)
-        print('RF-Default Train R^2 : ' + str( rf_def_train_r2 ) )
-        print('RF-Default Test R^2 : '  + str( rf_def_test_r2  ) )
-        print('RF-Default Test RMSE : ' + str( rf_def_test_rmse) )
-
-        file1.write('\nRF default train R^2 : ' + str(rf_def_train_r2)  + '\n')
-        file1.write('RF default test R^2 : '    + str(rf_def_test_r2)   + '\n')
-        file1.write('RF default test RMSE : '   + str(rf_def_test_rmse) + '\n')
-
-        # Use GridSearchCV to tune random forest model
-        rf_params = {'n_estimators':[100, 200, 250],
-                    'max_features':['auto','sqrt','log2'],
-                    'min_samples_split':[2,5,10],
-                    'n_jobs':[-1],
-                    'max_depth':[5,10,None]
-                    }
-        cv = GridSearchCV(RandomForestRegressor(), rf_params, n_jobs=-1, verbose=1)
-        cv.fit(X_train,y_train)
-
-        rf_best = cv.best_estimator_
+        file1.write('\nFeature names: ' + str(res['feature_names']) +'\n' )
+
+        print( 'Predict mean train  R^2 : ' + str(res['pred_mean_train_r2'])  )
+        print( 'Predict mean test R^2 : ' +  str(res['pred_mean_test_r2']) )
+        print( 'Predict mean RMSE : ' + str(res['pred_mean_test_rmse']) )
 
+        file1.write('Predict mean train R^2 : ' + str(res['pred_mean_train_r2']) + '\n')
+        file1.write('Predict mean test R^2 : ' +  str(res['pred_mean_test_r2']) + '\n')
+        file1.write('Predict mean RMSE : ' + str(res['pred_mean_test_rmse']) + '\n')
+
+        print('RF-Default Train R^2 : ' + str( res['rf_def_train_r2'] ) )
+        print('RF-Default Test R^2 : '  + str( res['rf_def_test_r2']  ) )
+        print('RF-Default Test RMSE : ' + str( res['rf_def_test_rmse']) )
+
+        file1.write('\nRF default train R^2 : ' + str(res['rf_def_train_r2'])  + '\n')
+        file1.write('RF default test R^2 : '    + str(res['rf_def_test_r2'])   + '\n')
+        file1.write('RF default test RMSE : '   + str(res['rf_def_test_rmse']) + '\n')
+
+        rf_best = res['rf_best']
+        tuning = res['tuning']
         print(rf_best)
+        print('Tuning : ' + ('cached' if tuning['cached'] else str(tuning['n_fits']) + ' fits in ' + str(round(tuning['search_s'])) + ' s'))
         file1.write('\nTuned Model Params: ' + str(rf_best) + '\n')
+        file1.write('Tuning: ' + ('cached' if tuning['cached'] else str(tuning['n_fits']) + ' fits in ' + str(round(tuning['search_s'])) + ' s')
+                    + ', CV R^2 : ' + str(round(tuning['best_score'],2)) + '\n')
 
-        y_hat_rf_best = rf_best.predict(X_test)
-        rf_opt_train_r2  = round(rf_best.score(X_train,y_train),2)
-        rf_opt_test_r2   = round(rf_best.score(X_test,y_test),2)
-        rf_opt_test_rmse =round(np.sqrt(mean_squared_error(y_test, y_hat_rf_best)),2)
+        print('RF-Tuned Train R^2 : '  + str(res['rf_opt_train_r2'] ) )
+        print('RF-Tuned Test R^2 : '   + str(res['rf_opt_test_r2']) )
+        print('RF-Tuned Test RMSE : '  + str(res['rf_opt_test_rmse'] ) )
 
-        print('RF-Tuned Train R^2 : '  + str(rf_opt_train_r2 ) )
-        print('RF-Tuned Test R^2 : '   + str(rf_opt_test_r2) )
-        print('RF-Tuned Test RMSE : '  + str(rf_opt_test_rmse ) )
-
-        file1.write('\nRF tuned train  R^2 : ' + str(rf_opt_train_r2)  + '\n')
-        file1.write('RF tuned test R^2 : '   + str(rf_opt_test_r2)   + '\n')
-        file1.write('RF tuned test RMSE : '  + str(rf_opt_test_rmse) + '\n')
+        file1.write('\nRF tuned train  R^2 : ' + str(res['rf_opt_train_r2'])  + '\n')
+        file1.write('RF tuned test R^2 : '   + str(res['rf_opt_test_r2'])   + '\n')
+        file1.write('RF tuned test RMSE : '  + str(res['rf_opt_test_rmse']) + '\n')
 
         # Plot Feature Importances
-        plot_feature_importance(rf_best, feature_names)
+        plot_feature_importance(rf_best, res['feature_names'])
         plt.savefig('./images/' + park_name + '_rf_featimp.png', bbox_inches='tight')
 
         # Make partial dependence plot
         my_plots = plot_partial_dependence(rf_best,       
                                     features=[0, 1, 2, 3, 4], # column numbers of plots we want to show
-                                    X=X_train,            # raw predictors data.
+                                    X=res['X_train'],     # raw predictors data.
                                     feature_names=['Hour','Is Weekend','Temperature','Cloud Cover','uvIndex'], # labels on graphs
                                     grid_resolution=20) # number of values to plot on x axis
         fig = plt.gcf()
         fig.set_size_inches(11,8)
         plt.savefig('./images/' + park_name + '_rf_part_dep.png')
 
-        # save (pickle) model
-        with open('./model/' + park_name + '_rf_model.pkl', 'wb') as f:
-            pickle.dump(rf_best, f)
-    
-    file1.close()
\ No newline at end of file
+        # save (pickle) model, w/ what it was fit on (for --update)
+        save_model(park_name, rf_best, model_meta(res))
+
+    # CV vs holdout for every park
+    df_cv = cv_report(results)
+    print(df_cv.to_string(index=False))
+    file1.write('\n\nTuning CV vs holdout R^2\n' + df_cv.to_string(index=False) + '\n')
+
+    if args.global_model:
+        res_global = fit_global(park_info, method=args.tune, budget=args.budget, group_days=(args.cv == 'days'))
+        tuning = res_global['tuning']
+        print(res_global['rf_best'])
+        file1.write('\n\nGlobal model\n\nFeature names: ' + str(res_global['feature_names']) + '\n')
+        file1.write('Tuned Model Params: ' + str(res_global['rf_best']) + '\n')
+        file1.write('Tuning: ' + ('cached' if tuning['cached'] else str(tuning['n_fits']) + ' fits in ' + str(round(tuning['search_s'])) + ' s')
+                    + ', CV R^2 : ' + str(round(tuning['best_score'],2)) + '\n')
+
+        df_comp = compare_global(results, res_global)
+        print(df_comp.to_string(index=False))
+        file1.write('\nPer-park vs global model (test set)\n' + df_comp.to_string(index=False) + '\n')
+
+        with open(GLOBAL_MODEL_FILE, 'wb') as f:
+            pickle.dump(res_global['rf_best'], f)
+
+    file1.close()
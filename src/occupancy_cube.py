@@ -0,0 +1,138 @@
+# Aggregate "cube" of hourly % capacity for each park: count, sum, sum of squares, and max for every
+# (month, day of week, hour) cell, so averages like "Saturdays at 10am" don't need a scan of the hourly data.
+# Kept up to date by process_LotSpot.py as hourly data is added; stored as
+# ./data/store/lotspot_cube/park_name=<park>/cube.npz
+
+import os
+import numpy as np
+import pandas as pd
+
+from storage import STORE_DIR, dataset_dir, read_dataset
+
+# months x days of week (0=Monday) x hours
+CUBE_SHAPE = (12, 7, 24)
+CUBE_AXES = ['month', 'dow', 'hour']
+CUBE_ARRAYS = ['count', 'sum', 'sumsq', 'max']
+
+
+def empty_cube():
+    return {'count': np.zeros(CUBE_SHAPE, dtype=np.int64),
+            'sum':   np.zeros(CUBE_SHAPE),
+            'sumsq': np.zeros(CUBE_SHAPE),
+            'max':   np.full(CUBE_SHAPE, -np.inf),
+            'last_hour': None}
+
+
+def add_to_cube(cube, df):
+    '''
+    Add hourly rows (w/ datetime, month, dow, hour, and percent_capacity columns) to a cube, in place.
+    Rows at or before the last hour already in the cube are ignored, so adding the same rows twice is harmless.
+    Rows w/ missing percent_capacity are not counted.
+    '''
+    if cube['last_hour'] is not None:
+        df = df[df['datetime'] > cube['last_hour']]
+    if len(df) == 0:
+        return cube
+    pc = df['percent_capacity'].values.astype(np.float64)
+    ok = ~np.isnan(pc)
+    cell = ((df['month'].values.astype(np.int64) - 1)*CUBE_SHAPE[1] + df['dow'].values)*CUBE_SHAPE[2] + df['hour'].values
+    cell, pc = cell[ok], pc[ok]
+
+    n_cells = np.prod(CUBE_SHAPE)
+    cube['count'] += np.bincount(cell, minlength=n_cells).reshape(CUBE_SHAPE)
+    cube['sum']   += np.bincount(cell, weights=pc, minlength=n_cells).reshape(CUBE_SHAPE)
+    cube['sumsq'] += np.bincount(cell, weights=pc*pc, minlength=n_cells).reshape(CUBE_SHAPE)
+    np.maximum.at(cube['max'].reshape(-1), cell, pc)
+    cube['last_hour'] = df['datetime'].max()
+    return cube
+
+
+def cube_file_name(park_name, store_dir=STORE_DIR):
+    return os.path.join(dataset_dir('lotspot_cube', park_name, store_dir), 'cube.npz')
+
+
+def write_cube(park_name, cube, store_dir=STORE_DIR):
+    file = cube_file_name(park_name, store_dir)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    last_hour = -1 if cube['last_hour'] is None else cube['last_hour'].value
+    with open(file + '.tmp', 'wb') as f:
+        np.savez(f, last_hour=last_hour, **{name: cube[name] for name in CUBE_ARRAYS})
+    os.replace(file + '.tmp', file)
+
+
+def read_cube(park_name, store_dir=STORE_DIR):
+    '''
+    Saved cube for a park, or None if there isn't one
+    '''
+    try:
+        with np.load(cube_file_name(park_name, store_dir)) as data:
+            cube = {name: data[name] for name in CUBE_ARRAYS}
+            last_hour = int(data['last_hour'])
+    except FileNotFoundError:
+        return None
+    cube['last_hour'] = None if last_hour < 0 else pd.Timestamp(last_hour, tz='UTC')
+    return cube
+
+
+def build_cube(park_name, store_dir=STORE_DIR):
+    '''
+    Make a park's cube from all of its hourly data
+    '''
+    df = read_dataset('lotspot_hourly', park_name, columns=['datetime','percent_capacity'] + CUBE_AXES, store_dir=store_dir)
+    return add_to_cube(empty_cube(), df)
+
+
+def update_cube(park_name, df_new=None, rebuild=False, store_dir=STORE_DIR):
+    '''
+    Add new hourly rows to a park's saved cube and save it. If rebuild (or there's no saved cube yet),
+    the cube is re-made from all the park's hourly data instead (so call this after the hourly data is saved).
+    '''
+    cube = None if rebuild else read_cube(park_name, store_dir)
+    if cube is None:
+        cube = build_cube(park_name, store_dir)
+    elif df_new is not None:
+        add_to_cube(cube, df_new)
+    write_cube(park_name, cube, store_dir)
+    return cube
+
+
+def cube_stats(cube, month=None, dow=None, hour=None):
+    '''
+    % capacity stats for one cell of the cube, or summed over any axes left as None (month is 1-12)
+
+    RETURNS
+    stats (dict) : count, mean, std, and max (NaN if count is 0)
+    '''
+    index = (slice(None) if month is None else month - 1,
+             slice(None) if dow is None else dow,
+             slice(None) if hour is None else hour)
+    count = cube['count'][index].sum()
+    if count == 0:
+        return {'count': 0, 'mean': np.nan, 'std': np.nan, 'max': np.nan}
+    mean = cube['sum'][index].sum()/count
+    var = max(cube['sumsq'][index].sum()/count - mean**2, 0)
+    return {'count': int(count), 'mean': mean, 'std': np.sqrt(var), 'max': cube['max'][index].max()}
+
+
+def cube_means(cube, by, hours=None):
+    '''
+    Mean % capacity for each month, dow, or hour (by), optionally only over some hours (eg range(6, 20))
+
+    RETURNS
+    df (Pandas DataFrame) : by and percent_capacity columns, only for values w/ data
+    '''
+    count, total = cube['count'], cube['sum']
+    if hours is not None:
+        count, total = count[:, :, list(hours)], total[:, :, list(hours)]
+        labels = np.array(list(hours))
+    else:
+        labels = np.arange(CUBE_SHAPE[2])
+    axis = CUBE_AXES.index(by)
+    other = tuple(i for i in range(3) if i != axis)
+    count, total = count.sum(axis=other), total.sum(axis=other)
+    if by == 'month':
+        labels = np.arange(1, 13)
+    elif by == 'dow':
+        labels = np.arange(7)
+    has_data = count > 0
+    return pd.DataFrame({by: labels[has_data], 'percent_capacity': total[has_data]/count[has_data]})
@@ -0,0 +1,368 @@
+# Run the whole pipeline, re-doing only the stages whose inputs have changed since they last ran
+# Stages (per park, in order): process_LotSpot -> get_darksky_weather -> combine_weather -> modeling, EDA
+# (make_park_info runs first, only if park_info.pkl is missing or make_park_info.py changed).
+# Each stage's key is a hash of its inputs (raw/weather files, upstream datasets), settings, and code; a stage is
+# skipped if its key matches the last successful run and its outputs exist. Each park's chain runs in its own
+# worker process. Per-park state is saved in ./data/pipeline/state/, and every stage run (or skip) is appended
+# to ./data/pipeline/run_log.jsonl w/ its time.
+#
+# Usage: python src/pipeline.py [--parks p1 p2] [--workers N] [--check hash|mtime] [--force stage ...]
+#                               [--fetch-weather] [--tune grid|random|halving] [--update-models] [--dry-run]
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import argparse
+import subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import generate_figures_EDA
+from storage import read_dataset, dataset_dir, dataset_exists, dataset_fingerprint
+from process_LotSpot import raw_file_name, process_park
+from get_darksky_weather import backfill_historical
+from combine_weather import DAILY_FILE_DIR, list_daily_files, combine_weather
+from modeling import (fit_park, update_park, model_file_names, model_meta, save_model, RF_PARAMS, MODEL_HOURS,
+                      MODEL_WEATHER_COLUMNS, WEATHER_JOIN)
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = './data/pipeline/'
+RUN_LOG_FILE = PIPELINE_DIR + 'run_log.jsonl'
+PARK_INFO_FILE = './data/park_info.pkl'
+WEATHER_BASE_DIR = DAILY_FILE_DIR + '/'
+
+
+def file_signature(paths, check='hash'):
+    '''
+    sha1 hex digest of a list of files: of their contents if check is 'hash', or of their sizes and modification
+    times if 'mtime' (faster, but a file that is touched w/o changing counts as changed). Missing files count too.
+    '''
+    h = hashlib.sha1()
+    for path in sorted(paths):
+        h.update(os.path.basename(path).encode())
+        if not os.path.exists(path):
+            h.update(b'missing')
+        elif check == 'mtime':
+            stat = os.stat(path)
+            h.update(str((stat.st_size, stat.st_mtime_ns)).encode())
+        else:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+    return h.hexdigest()
+
+
+def dataset_signature(name, park_name, check='hash'):
+    '''
+    Like file_signature, for the Parquet files of a dataset (see storage.dataset_fingerprint)
+    '''
+    if check != 'mtime':
+        return dataset_fingerprint(name, park_name)
+    path = dataset_dir(name, park_name)
+    return file_signature([os.path.join(root, file) for root, dirs, files in os.walk(path)
+                           for file in files if file.endswith('.parquet')], check='mtime')
+
+
+def code_signature(modules):
+    '''
+    Hash of the source files a stage runs, so changing the code re-runs the stage
+    '''
+    return file_signature([os.path.join(SRC_DIR, module) for module in modules], check='hash')
+
+
+# Each stage's inputs function returns everything its result depends on (JSON-able), outputs function returns
+# True if its outputs all exist, and run function does the work (returns dict of stats).
+# All take (park_name, park info dict, options dict).
+
+def process_lotspot_inputs(park_name, info, opts):
+    return {'raw': file_signature([raw_file_name(park_name)], opts['check'])}
+
+def process_lotspot_outputs(park_name, info, opts):
+    return all(dataset_exists(name, park_name) for name in ['lotspot_raw', 'lotspot_daily', 'lotspot_hourly'])
+
+def process_lotspot_run(park_name, info, opts):
+    # only raw rows appended since the last run are resampled to hourly (full rebuild if the file was re-written)
+    return process_park(park_name, incremental=True)
+
+
+def lotspot_days(park_name):
+    '''
+    First and last day (str) of a park's daily LotSpot data
+    '''
+    dates = read_dataset('lotspot_daily', park_name, columns=['date'])['date']
+    return str(dates.min())[0:10], str(dates.max())[0:10]
+
+def get_weather_inputs(park_name, info, opts):
+    start, end = lotspot_days(park_name)
+    return {'lat': info['lat'], 'lon': info['lon'], 'start': start, 'end': end}
+
+def get_weather_outputs(park_name, info, opts):
+    return True
+
+def get_weather_run(park_name, info, opts):
+    start, end = lotspot_days(park_name)
+    summary = backfill_historical(opts['api_key'], {park_name: info}, start, end, base_dir=WEATHER_BASE_DIR)
+    if len(summary['failed']) > 0:
+        raise RuntimeError(str(len(summary['failed'])) + ' days failed, eg ' + str(summary['failed'][0]))
+    return {'fetched': summary['fetched'], 'skipped': summary['skipped']}
+
+
+def weather_files(park_name):
+    files = list_daily_files(DAILY_FILE_DIR)
+    return [os.path.join(DAILY_FILE_DIR, file) for kind in ['hourly', 'daily']
+            for file in files.get((park_name, kind), {}).values()]
+
+def combine_weather_inputs(park_name, info, opts):
+    return {'daily_files': file_signature(weather_files(park_name), opts['check'])}
+
+def combine_weather_outputs(park_name, info, opts):
+    return all(dataset_exists(name, park_name) for name in ['weather_hourly', 'weather_daily'])
+
+def combine_weather_run(park_name, info, opts):
+    n_read = combine_weather([park_name], incremental=True)
+    return {'files_read': sum(n_read.values())}
+
+
+def modeling_inputs(park_name, info, opts):
+    return {'lotspot_hourly': dataset_signature('lotspot_hourly', park_name, opts['check']),
+            'weather_hourly': dataset_signature('weather_hourly', park_name, opts['check']),
+            'settings': [RF_PARAMS, MODEL_HOURS, MODEL_WEATHER_COLUMNS, WEATHER_JOIN, opts['tune']]}
+
+def modeling_outputs(park_name, info, opts):
+    return os.path.exists(model_file_names(park_name)[0])
+
+def modeling_run(park_name, info, opts):
+    if opts['update_models'] and os.path.exists(model_file_names(park_name)[0]):
+        try:
+            res = update_park(park_name, n_jobs=opts['n_jobs'])
+            stats = {'update': res['status']}
+            if 'new_holdout_rmse' in res:
+                stats['holdout_rmse'] = round(res['new_holdout_rmse'], 2)
+            return stats
+        except ValueError:
+            # features changed, or too few days to update; fall back to a full fit
+            pass
+    res = fit_park(park_name, method=opts['tune'], n_jobs=opts['n_jobs'])
+    save_model(park_name, res['rf_best'], model_meta(res))
+    return {'test_r2': res['rf_opt_test_r2'], 'test_rmse': res['rf_opt_test_rmse']}
+
+
+def eda_inputs(park_name, info, opts):
+    inputs = {name: dataset_signature(name, park_name, opts['check'])
+              for name in ['lotspot_daily', 'lotspot_hourly', 'weather_hourly']}
+    inputs['code'] = generate_figures_EDA.code_hash()
+    return inputs
+
+def eda_outputs(park_name, info, opts):
+    return all(os.path.exists(generate_figures_EDA.IMAGE_DIR + park_name + '_' + figure + '.png')
+               for figure in generate_figures_EDA.FIGURES)
+
+def eda_run(park_name, info, opts):
+    # figures are rendered directly (not w/ render_figures), so parallel park workers don't share its cache file
+    os.makedirs(generate_figures_EDA.IMAGE_DIR, exist_ok=True)
+    errors = [error for park, figure, seconds, error in
+              (generate_figures_EDA.render_figure(park_name, figure) for figure in generate_figures_EDA.FIGURES)
+              if error is not None]
+    if len(errors) > 0:
+        raise RuntimeError('; '.join(errors))
+    return {'figures': len(generate_figures_EDA.FIGURES)}
+
+
+# name : (stages it depends on, source files it runs, inputs, outputs, run), in the order they run for a park
+STAGES = {'process_LotSpot':     ([], ['process_LotSpot.py', 'features.py', 'occupancy_cube.py', 'storage.py'],
+                                  process_lotspot_inputs, process_lotspot_outputs, process_lotspot_run),
+          'get_darksky_weather': (['process_LotSpot'], ['get_darksky_weather.py', 'darksky_client.py', 'darksky_decode.py'],
+                                  get_weather_inputs, get_weather_outputs, get_weather_run),
+          'combine_weather':     (['get_darksky_weather'], ['combine_weather.py', 'storage.py'],
+                                  combine_weather_inputs, combine_weather_outputs, combine_weather_run),
+          'modeling':            (['process_LotSpot', 'combine_weather'],
+                                  ['modeling.py', 'features.py', 'feature_store.py', 'storage.py'],
+                                  modeling_inputs, modeling_outputs, modeling_run),
+          'EDA':                 (['process_LotSpot', 'combine_weather'],
+                                  ['generate_figures_EDA.py', 'features.py', 'occupancy_cube.py', 'storage.py'],
+                                  eda_inputs, eda_outputs, eda_run)}
+
+
+def state_file_name(park_name):
+    return os.path.join(PIPELINE_DIR, 'state', park_name + '.json')
+
+def read_state(park_name):
+    '''
+    {stage : {'key', 'finished'}} for a park's last successful stage runs (empty if none)
+    '''
+    try:
+        with open(state_file_name(park_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_state(park_name, state):
+    file = state_file_name(park_name)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(file + '.tmp', file)
+
+
+def stage_key(stage, park_name, info, opts):
+    deps, modules, inputs, outputs, run = STAGES[stage]
+    return hashlib.sha1(json.dumps([inputs(park_name, info, opts), code_signature(modules)], sort_keys=True).encode()).hexdigest()
+
+
+def run_branch(park_name, info, opts, force=(), dry_run=False):
+    '''
+    Run (or skip) every stage for one park, in order. A stage whose dependency failed is 'blocked';
+    get_darksky_weather is 'off' unless opts['fetch_weather'].
+    In a dry run, stages that would run are 'stale' (and stages after a stale one are assumed stale too).
+
+    RETURNS
+    records (list) : Dict for each stage w/ park, stage, status ('ran', 'skipped', 'failed', 'blocked', 'off',
+                     or 'stale'), seconds, and error or stats
+    '''
+    state = read_state(park_name)
+    status, records = {}, []
+    for stage, (deps, modules, inputs, outputs, run) in STAGES.items():
+        t0 = time.time()
+        record = {'park': park_name, 'stage': stage}
+        try:
+            if stage == 'get_darksky_weather' and not opts['fetch_weather']:
+                record['status'] = 'off'
+            elif any(status[dep] in ('failed', 'blocked') for dep in deps):
+                record['status'] = 'blocked'
+            elif dry_run and any(status[dep] == 'stale' for dep in deps):
+                record['status'] = 'stale'
+            else:
+                key = stage_key(stage, park_name, info, opts)
+                up_to_date = (stage not in force and state.get(stage, {}).get('key') == key
+                              and outputs(park_name, info, opts))
+                if up_to_date:
+                    record['status'] = 'skipped'
+                elif dry_run:
+                    record['status'] = 'stale'
+                else:
+                    record['stats'] = run(park_name, info, opts)
+                    record['status'] = 'ran'
+                    state[stage] = {'key': key, 'finished': datetime.now().isoformat(timespec='seconds')}
+                    write_state(park_name, state)
+        except Exception as e:
+            record['status'] = 'failed'
+            record['error'] = repr(e)
+        record['s'] = round(time.time() - t0, 3)
+        status[stage] = record['status']
+        records.append(record)
+    return records
+
+
+def run_make_park_info(force=False, dry_run=False):
+    '''
+    Re-make park_info.pkl (by running make_park_info.py) if it's missing or the script changed since it was last run.
+    An existing park_info.pkl w/ no saved state is taken as up to date (it may have been edited by hand).
+    '''
+    t0 = time.time()
+    state = read_state('_global')
+    key = code_signature(['make_park_info.py'])
+    record = {'park': None, 'stage': 'make_park_info'}
+    if os.path.exists(PARK_INFO_FILE) and 'make_park_info' not in state and not force:
+        state['make_park_info'] = {'key': key, 'finished': None}
+        write_state('_global', state)
+    if os.path.exists(PARK_INFO_FILE) and state.get('make_park_info', {}).get('key') == key and not force:
+        record['status'] = 'skipped'
+    elif dry_run:
+        record['status'] = 'stale'
+    else:
+        proc = subprocess.run([sys.executable, os.path.join(SRC_DIR, 'make_park_info.py')], capture_output=True, text=True)
+        if proc.returncode == 0:
+            record['status'] = 'ran'
+            state['make_park_info'] = {'key': key, 'finished': datetime.now().isoformat(timespec='seconds')}
+            write_state('_global', state)
+        else:
+            record['status'] = 'failed'
+            record['error'] = proc.stderr.strip().splitlines()[-1]
+    record['s'] = round(time.time() - t0, 3)
+    return record
+
+
+def run_pipeline(park_names=None, n_workers=None, check='hash', force=(), fetch_weather=False, tune='grid',
+                 update_models=False, dry_run=False):
+    '''
+    Run the pipeline for some (default all) parks, each park's stages in a worker process, and append every
+    stage's record (see run_branch) to the run log
+
+    INPUT
+    park_names (list) : Parks to run (default all in park_info.pkl)
+    n_workers (int) : Number of parks run in parallel (default is # CPUs); 1 runs in this process
+    check (str) : 'hash' (file contents) or 'mtime' (file sizes and modification times) to tell if inputs changed
+    force (list) : Stages to re-run even if up to date
+    fetch_weather (bool) : Get missing historical weather days from Dark Sky (needs DARKSKY_API_KEY)
+    tune (str) : Hyperparameter search for the models (see modeling.make_search)
+    update_models (bool) : Add trees for new days to saved models (see modeling.update_park) instead of re-fitting them
+    dry_run (bool) : Only report which stages would run
+
+    RETURNS
+    records (list)
+    '''
+    run_id = datetime.now().isoformat(timespec='seconds')
+    records = [run_make_park_info(force='make_park_info' in force, dry_run=dry_run)]
+    if records[0]['status'] == 'failed':
+        return records
+    with open(PARK_INFO_FILE, 'rb') as f:
+        park_info = pickle.load(f)
+    if park_names is None:
+        park_names = list(park_info.keys())
+
+    opts = {'check': check, 'fetch_weather': fetch_weather, 'tune': tune, 'update_models': update_models,
+            'api_key': os.getenv('DARKSKY_API_KEY'),
+            'n_jobs': -1 if n_workers == 1 or len(park_names) == 1 else 1}
+    if n_workers == 1 or len(park_names) == 1:
+        for park_name in park_names:
+            records += run_branch(park_name, park_info[park_name], opts, force, dry_run)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(run_branch, park_name, park_info[park_name], opts, force, dry_run)
+                       for park_name in park_names]
+            for future in futures:
+                records += future.result()
+
+    if not dry_run:
+        os.makedirs(PIPELINE_DIR, exist_ok=True)
+        with open(RUN_LOG_FILE, 'a') as f:
+            for record in records:
+                f.write(json.dumps(dict(record, run_id=run_id)) + '\n')
+    return records
+
+
+def print_records(records):
+    print('{:<22}{:<22}{:<10}{:>9}  {}'.format('park', 'stage', 'status', 'time (s)', ''))
+    for record in records:
+        print('{:<22}{:<22}{:<10}{:>9.1f}  {}'.format(str(record['park'] or '-'), record['stage'], record['status'],
+                                                     record['s'], record.get('error', record.get('stats', ''))))
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Run the pipeline, skipping stages whose inputs have not changed')
+    parser.add_argument('--parks', nargs='+', default=None, help='Parks to run (default all)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of parks to run in parallel (default is # CPUs)')
+    parser.add_argument('--check', choices=['hash','mtime'], default='hash',
+                        help='Tell if input files changed by their contents (default) or modification times')
+    parser.add_argument('--force', nargs='+', default=[], choices=['make_park_info'] + list(STAGES),
+                        help='Re-run these stages even if up to date')
+    parser.add_argument('--fetch-weather', action='store_true', help='Get missing weather days from Dark Sky (needs DARKSKY_API_KEY)')
+    parser.add_argument('--tune', choices=['grid','random','halving'], default='grid', help='Hyperparameter search for the models')
+    parser.add_argument('--update-models', action='store_true',
+                        help='When the model data changes, add trees for the new days to saved models instead of re-fitting')
+    parser.add_argument('--dry-run', action='store_true', help='Only show which stages would run')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    records = run_pipeline(park_names=args.parks, n_workers=args.workers, check=args.check, force=args.force,
+                           fetch_weather=args.fetch_weather, tune=args.tune, update_models=args.update_models,
+                           dry_run=args.dry_run)
+    print_records(records)
+    n_ran = sum(record['status'] == 'ran' for record in records)
+    print('Ran ' + str(n_ran) + ' of ' + str(len(records)) + ' stages in ' + str(round(time.time() - t0, 1)) + ' s')
+    if any(record['status'] == 'failed' for record in records):
+        sys.exit(1)
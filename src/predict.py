@@ -0,0 +1,131 @@
+# Predict parking lot % capacity for each park from the latest weather forecast,
+# using the random forest models saved by modeling.py
+# Saves a combined predictions table to the store (see storage.py)
+
+import os
+import sys
+import time
+import pickle
+import numpy as np
+import pandas as pd
+
+from storage import read_dataset, write_dataset, dataset_exists
+from features import model_feature_matrix
+from compact_forest import CompactForest, compact_dir, is_current
+
+MODEL_DIR = './model/'
+
+
+def load_models(park_names, model_dir=MODEL_DIR, compact=False):
+    '''
+    Load (unpickle) the saved model for each park. Parks w/o a model file are skipped.
+    If compact, memory-map the compact version of each model instead where there is one made from the current
+    pickle (see compact_forest.py); a stale compact version (eg from before modeling.py re-fit or updated the
+    model) is skipped w/ a warning.
+
+    OUTPUT
+    models (dict) : {park_name : fitted model}
+    '''
+    models = {}
+    for park_name in park_names:
+        file = os.path.join(model_dir, park_name + '_rf_model.pkl')
+        if compact and is_current(file):
+            models[park_name] = CompactForest(compact_dir(file))
+            continue
+        if compact and os.path.exists(compact_dir(file)):
+            print('Warning: ' + compact_dir(file) + ' is out of date w/ ' + file + ', using the pickle '
+                  '(re-run compact_forest.py)', file=sys.stderr)
+        if os.path.exists(file):
+            with open(file, 'rb') as f:
+                model = pickle.load(f)
+            # batches here are small (48 hours); spinning up a thread per core costs more than it saves
+            if hasattr(model, 'n_jobs'):
+                model.n_jobs = 1
+            models[park_name] = model
+    return models
+
+
+def load_latest_forecast(park_name, since=None):
+    '''
+    Load the most recently requested hourly forecast for a park
+
+    INPUT
+    park_name (str)
+    since (str or Timestamp) : Only look at forecasts for times after this (default is 3 days ago),
+                               so old months don't have to be read
+
+    OUTPUT
+    df (Pandas DataFrame) : Hourly forecast, w/ 'datetime_requested' the time the forecast was made
+                            (None if there are no forecasts for the park)
+    '''
+    if not dataset_exists('forecast_hourly', park_name):
+        return None
+    if since is None:
+        since = pd.Timestamp.now(tz='US/Mountain').normalize() - pd.Timedelta(days=3)
+    df = read_dataset('forecast_hourly', park_name, columns=['time','datetime_requested','temperature','cloudCover','uvIndex'],
+                      start=since)
+    df = df[df['datetime_requested'] == df['datetime_requested'].max()]
+    return df.reset_index(drop=True)
+
+
+def predict_parks(models, forecasts):
+    '''
+    Predict % capacity for every park from its forecast, w/ one predict call per model
+
+    INPUT
+    models (dict) : {park_name : fitted model} (see load_models)
+    forecasts (dict) : {park_name : hourly forecast DataFrame} (see load_latest_forecast)
+
+    OUTPUT
+    df_pred (Pandas DataFrame) : park_name, time, datetime_requested, and predicted percent_capacity
+                                 (no rows if no park has both a model and a forecast)
+    '''
+    frames = []
+    for park_name, model in models.items():
+        df = forecasts.get(park_name)
+        if df is None or len(df) == 0:
+            continue
+        X = model_feature_matrix(df)
+        df_park = df[['time','datetime_requested']].copy()
+        df_park.insert(0, 'park_name', park_name)
+        df_park['percent_capacity'] = model.predict(X).astype(np.float32)
+        frames.append(df_park)
+    if len(frames) == 0:
+        return pd.DataFrame({'park_name': pd.Series(dtype=object), 'time': pd.Series(dtype='datetime64[ns, US/Mountain]'),
+                             'datetime_requested': pd.Series(dtype='datetime64[ns, US/Mountain]'),
+                             'percent_capacity': pd.Series(dtype=np.float32)})
+    return pd.concat(frames, ignore_index=True)
+
+
+def save_predictions(df_pred):
+    '''
+    Save predictions to the 'predictions' dataset; one file per park per forecast (nothing is saved if there are none)
+    '''
+    for park_name, df in df_pred.groupby('park_name'):
+        issued = df['datetime_requested'].iloc[0].strftime('%Y-%m-%dT%H%M')
+        write_dataset(df.drop('park_name', axis=1), 'predictions', park_name, mode='append',
+                      basename='pred-' + issued + '-{i}.parquet')
+
+
+if __name__=='__main__':
+
+    with open('./data/park_info.pkl', 'rb') as f:
+        park_info = pickle.load(f)
+
+    t0 = time.time()
+    models = load_models(park_info.keys(), compact=('--compact' in sys.argv[1:]))
+    forecasts = {park_name: load_latest_forecast(park_name) for park_name in models}
+    t_load = time.time() - t0
+
+    t0 = time.time()
+    df_pred = predict_parks(models, forecasts)
+    t_pred = time.time() - t0
+
+    save_predictions(df_pred)
+
+    print('Loaded ' + str(len(models)) + ' models and forecasts in ' + str(round(t_load, 2)) + ' s')
+    print('Predicted ' + str(len(df_pred)) + ' park-hours in ' + str(round(t_pred*1000)) + ' ms')
+    if len(df_pred) > 0:
+        print(df_pred.pivot(index='time', columns='park_name', values='percent_capacity').round(0))
+    else:
+        print('No park has both a model and a forecast')
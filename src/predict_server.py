@@ -0,0 +1,261 @@
+# Small local HTTP service for "how full will <park> be at hour H" lookups
+# Models and latest forecasts are loaded once at startup and kept in memory; models are re-loaded
+# when their pickle file changes.
+#
+# Usage: python src/predict_server.py [--port 8050]
+#   GET /predict?park=east_mount_falcon&hour=10              (tomorrow at 10am)
+#   GET /predict?park=east_mount_falcon&date=2020-05-02&hour=10
+#   GET /metrics                                             (latency percentiles, error counts, cache stats)
+
+import os
+import json
+import time
+import pickle
+import argparse
+import threading
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+
+from predict import MODEL_DIR, load_latest_forecast
+from features import model_feature_matrix
+
+
+class PredictionService:
+    '''
+    Holds the models, forecasts, and prediction cache for the server.
+
+    INPUT
+    park_names (list)
+    forecast_source (function) : Called w/ park_name, returns hourly forecast DataFrame (w/ time, datetime_requested,
+                                 temperature, cloudCover, uvIndex). Default is the latest forecast in the store.
+    model_dir (str)
+    cache_size (int) : Max number of predictions kept in the LRU cache
+    forecast_refresh (float) : Re-load forecasts after this many seconds
+    model_check (float) : Check model files for changes at most this often (seconds)
+
+    Model and forecast re-loads are done by one request thread at a time (see refresh); other requests keep
+    using what is already loaded meanwhile.
+    '''
+
+    def __init__(self, park_names, forecast_source=load_latest_forecast, model_dir=MODEL_DIR, cache_size=10000,
+                 forecast_refresh=600, model_check=1.0):
+        self.park_names = list(park_names)
+        self.forecast_source = forecast_source
+        self.model_dir = model_dir
+        self.cache_size = cache_size
+        self.forecast_refresh = forecast_refresh
+        self.model_check = model_check
+
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.models, self.model_mtimes = {}, {}
+        self.forecasts, self.features = {}, {}
+        self.cache = OrderedDict()
+        self.latencies = deque(maxlen=10000)
+        self.n_hits, self.n_misses, self.n_reloads = 0, 0, 0
+        self.status_counts = {}
+
+        self.last_model_check = 0
+        self.check_models()
+        self.load_forecasts()
+
+    def model_file(self, park_name):
+        return os.path.join(self.model_dir, park_name + '_rf_model.pkl')
+
+    def check_models(self):
+        '''
+        (Re-)load any model whose pickle file is new or has changed since it was loaded
+        '''
+        self.last_model_check = time.time()
+        for park_name in self.park_names:
+            file = self.model_file(park_name)
+            if not os.path.exists(file):
+                continue
+            mtime = os.path.getmtime(file)
+            if self.model_mtimes.get(park_name) == mtime:
+                continue
+            with open(file, 'rb') as f:
+                model = pickle.load(f)
+            if hasattr(model, 'n_jobs'):
+                model.n_jobs = 1
+            with self.lock:
+                if park_name in self.models:
+                    self.n_reloads += 1
+                self.models[park_name] = model
+                self.model_mtimes[park_name] = mtime
+                # cached predictions from the old model are stale
+                for key in [key for key in self.cache if key[0] == park_name]:
+                    del self.cache[key]
+
+    def load_forecasts(self):
+        '''
+        Load the forecast for each park and pre-compute its model feature matrix
+        '''
+        forecasts, features = {}, {}
+        for park_name in self.park_names:
+            df = self.forecast_source(park_name)
+            if df is not None and len(df) > 0:
+                forecasts[park_name] = df.set_index('time')
+                features[park_name] = model_feature_matrix(df)
+        with self.lock:
+            self.forecasts, self.features = forecasts, features
+            self.forecasts_loaded = time.time()
+
+    def refresh(self):
+        '''
+        Check models for changes and re-load forecasts, if due. If another thread is already doing it, return
+        right away rather than unpickling the same model twice.
+        '''
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        try:
+            if time.time() - self.last_model_check > self.model_check:
+                self.check_models()
+            if time.time() - self.forecasts_loaded > self.forecast_refresh:
+                self.load_forecasts()
+        finally:
+            self.refresh_lock.release()
+
+    def predict(self, park_name, when):
+        '''
+        Predicted % capacity for a park at a time (tz-aware Timestamp, on the hour).
+        Returns (percent_capacity, forecast issue time), or raises KeyError if there is no model/forecast for it.
+        '''
+        self.refresh()
+
+        with self.lock:
+            model = self.models[park_name]
+            forecast = self.forecasts[park_name]
+            i_row = forecast.index.get_loc(when)
+            issued = forecast['datetime_requested'].iloc[i_row]
+            # (model mtime in the key, so a prediction from a model that was just replaced isn't cached as current)
+            key = (park_name, self.model_mtimes[park_name], issued.value, when.value)
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.n_hits += 1
+                return self.cache[key], issued
+            X = self.features[park_name][i_row:i_row+1]
+
+        pred = float(model.predict(X)[0])
+
+        with self.lock:
+            self.n_misses += 1
+            self.cache[key] = pred
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return pred, issued
+
+    def record_latency(self, seconds, status=200):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def metrics(self):
+        with self.lock:
+            lat = np.array(self.latencies)*1000
+            n_requests = sum(self.status_counts.values())
+            n_ok = self.status_counts.get(200, 0)
+            status_counts = {str(status): n for status, n in sorted(self.status_counts.items())}
+            models = sorted(self.models)
+            forecasts = {park_name: str(df['datetime_requested'].iloc[0]) for park_name, df in self.forecasts.items()}
+            cache_size = len(self.cache)
+        return {'requests': n_requests, 'errors': n_requests - n_ok,
+                'status_counts': status_counts,
+                'p50_ms': round(float(np.percentile(lat, 50)), 3) if len(lat) else None,
+                'p99_ms': round(float(np.percentile(lat, 99)), 3) if len(lat) else None,
+                'cache_hits': self.n_hits, 'cache_misses': self.n_misses, 'cache_size': cache_size,
+                'model_reloads': self.n_reloads, 'models': models, 'forecasts': forecasts}
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.status = status
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/metrics':
+            self.send_json(200, self.server.service.metrics())
+            return
+
+        # latency is recorded for every response (errors too), but not for /metrics itself
+        t0 = time.perf_counter()
+        self.status = 500
+        try:
+            self.handle_predict()
+        finally:
+            self.server.service.record_latency(time.perf_counter() - t0, self.status)
+
+    def handle_predict(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path != '/predict':
+            self.send_json(404, {'error': 'unknown path ' + url.path})
+            return
+
+        try:
+            park_name = query['park']
+            hour = int(query['hour'])
+            if not 0 <= hour <= 23:
+                raise ValueError('hour out of range: ' + str(hour))
+            if 'date' in query:
+                day = pd.Timestamp(query['date'])
+                if day.tz is not None or day != day.normalize():
+                    raise ValueError('date should be a day w/o time or time zone: ' + query['date'])
+            else:
+                day = pd.Timestamp.now(tz='US/Mountain').normalize().tz_localize(None) + pd.Timedelta(days=1)
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {'error': 'need park and hour (0-23), and optional date (YYYY-MM-DD): ' + repr(e)})
+            return
+
+        try:
+            tz = service.forecasts[park_name].index.tz
+            when = (day + pd.Timedelta(hours=hour)).tz_localize(tz, ambiguous=True, nonexistent='shift_forward')
+            pred, issued = service.predict(park_name, when)
+        except KeyError:
+            self.send_json(404, {'error': 'no model or forecast for ' + park_name + ' at ' + str(day.date()) + ' ' + str(hour) + 'h'})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': 'prediction failed: ' + repr(e)})
+            return
+
+        self.send_json(200, {'park': park_name, 'time': when.isoformat(), 'percent_capacity': round(pred, 1),
+                             'forecast_issued': issued.isoformat()})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=8050):
+    '''
+    Make (but don't start) the HTTP server for a PredictionService. Use port=0 to pick a free port.
+    '''
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.service = service
+    return server
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Serve parking lot % capacity predictions over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    args = parser.parse_args()
+
+    with open('./data/park_info.pkl', 'rb') as f:
+        park_info = pickle.load(f)
+
+    service = PredictionService(park_info.keys())
+    server = make_server(service, args.host, args.port)
+    print('Serving predictions for ' + str(sorted(service.models)) + ' on http://' + args.host + ':' + str(args.port))
+    server.serve_forever()
@@ -1,7 +1,42 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import pickle
 
+from storage import dataset_dir, write_dataset, read_dataset, month_key
+from features import add_calendar_fields, clean_in_out, local_ns, NS_PER_DAY
+from occupancy_cube import empty_cube, add_to_cube, write_cube, update_cube
+
+RAW_COL_NAMES = ['percent_capacity','spots_taken','total_spots','timestamp','in_out']
+
+# Compact dtypes for reading the raw files in chunks (lots have < 256 spots)
+RAW_DTYPES = {'percent_capacity':'float64', 'spots_taken':'uint8', 'total_spots':'uint8', 'timestamp':'int64', 'in_out':'int8'}
+
+def raw_file_name(park_name):
+    return './data/raw/LotSpot/' + park_name + '.csv'
+
+def process_raw_lotspot(df):
+    '''
+    Process raw LotSpot data (as read from the csv file): convert timestamp to US/Mountain datetime,
+    clean in_out, convert to percent, and add various datetime fields for analysis
+    '''
+    # add local datetime field
+    df['datetime_utc'] = pd.to_datetime(df['timestamp'], origin='unix', unit='s', utc=True)
+    df['datetime'] = df['datetime_utc'].dt.tz_convert('US/Mountain')
+    df.drop(['timestamp','datetime_utc'], axis=1, inplace=True)
+
+    df['in_out'] = clean_in_out(df['in_out'])
+
+    df['percent_capacity'] = df['percent_capacity']*100
+
+    return add_calendar_fields(df)
+
 def read_process_park_data(park_name):
     '''
     Read in raw LotSpot data for a park and process into dataframe.
@@ -15,26 +50,18 @@ def read_process_park_data(park_name):
     '''
 
     # read in raw data to dataframe
-    col_names = ['percent_capacity','spots_taken','total_spots','timestamp','in_out']
-    
-    df = pd.read_csv('./data/raw/LotSpot/' + park_name + '.csv', header=None, names=col_names )
-
-    # add local datetime field
-    df['datetime_utc'] = pd.to_datetime(df['timestamp'], origin='unix', unit='s', utc=True)
-    df['datetime'] = df['datetime_utc'].dt.tz_convert('US/Mountain')
-    df.drop(['timestamp','datetime_utc'], axis=1, inplace=True)
+    df = pd.read_csv(raw_file_name(park_name), header=None, names=RAW_COL_NAMES )
 
-    df['in_out'] = df['in_out'].apply(lambda x: x if x<2 else np.NaN)
+    return process_raw_lotspot(df)
 
-    df['percent_capacity'] = df['percent_capacity']*100
+def resample_hourly(df):
+    '''
+    Resample LotSpot data (w/ 'datetime' and 'percent_capacity' columns) to 1-hour intervals
+    '''
+    return df[['datetime','percent_capacity']].set_index('datetime').resample('H').pad(limit=3).reset_index()
 
-    df['date']  = df['datetime'].dt.date
-    df['month'] = df['datetime'].dt.month
-    df['day']   = df['datetime'].dt.day
-    df['hour']  = df['datetime'].dt.hour
-    df['dow']   = df['datetime'].dt.dayofweek
-    
-    return df
+def add_hourly_fields(df_hourly):
+    return add_calendar_fields(df_hourly)
 
 def read_process_park_data_into_hourly(park_name):
     '''
@@ -48,8 +75,7 @@ def read_process_park_data_into_hourly(park_name):
     df_hourly (Pandas Dataframe), *resampled to hourly intervals*
     '''
 
-    col_names = ['percent_capacity','spots_taken','total_spots','timestamp','in_out']
-    df = pd.read_csv('./data/raw/LotSpot/' + park_name + '.csv', header=None, names=col_names )
+    df = pd.read_csv(raw_file_name(park_name), header=None, names=RAW_COL_NAMES )
 
     df['percent_capacity'] = df['percent_capacity']*100
 
@@ -57,19 +83,108 @@ def read_process_park_data_into_hourly(park_name):
     df['datetime'] = df['datetime_utc'].dt.tz_convert('US/Mountain')
     df.drop(['timestamp','datetime_utc'], axis=1, inplace=True)
     df.drop(['spots_taken','total_spots','in_out'], axis=1, inplace=True)
-    
+
     # Resample to hourly intervals
-    df_hourly = df.set_index('datetime').resample('H').pad(limit=3).reset_index()
-    
-    df_hourly['date']  = df_hourly['datetime'].dt.date
-    df_hourly['month'] = df_hourly['datetime'].dt.month
-    df_hourly['day']   = df_hourly['datetime'].dt.day
-    df_hourly['hour']  = df_hourly['datetime'].dt.hour
-    df_hourly['dow']   = df_hourly['datetime'].dt.dayofweek
-    
-    return df_hourly
+    df_hourly = resample_hourly(df)
+
+    return add_hourly_fields(df_hourly)
+
+
+def day_slices(datetimes):
+    '''
+    Find each local day's rows in a Series of datetimes, w/o working out the local date of every row:
+    if the datetimes are sorted, local midnights are looked up in them w/ a binary search; otherwise rows
+    are sorted by local day number.
+
+    RETURNS
+    days (NumPy array) : Local day number (days since 1970-01-01) of each day that has rows
+    starts, ends (NumPy arrays) : Each day's rows are order[starts[i]:ends[i]]
+    order (NumPy array or None) : Row order (None if the datetimes were already sorted)
+    '''
+    ns = datetimes.values.astype('datetime64[ns]').view('int64')
+    if len(ns) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, None
+
+    if not np.any(ns[1:] < ns[:-1]) and ns[0] != np.iinfo(np.int64).min:
+        tz = datetimes.dt.tz
+        first = pd.Timestamp(ns[0], tz='UTC').tz_convert(tz).tz_localize(None).floor('D') if tz else pd.Timestamp(ns[0]).floor('D')
+        last = pd.Timestamp(ns[-1], tz='UTC').tz_convert(tz).tz_localize(None).floor('D') if tz else pd.Timestamp(ns[-1]).floor('D')
+        try:
+            midnights = pd.date_range(first, last + pd.Timedelta(days=1), freq='D', tz=tz)
+        except (ValueError, OverflowError):
+            midnights = None   # ie a local midnight that doesn't exist (DST change at midnight)
+        if midnights is not None:
+            bounds = np.searchsorted(ns, midnights.asi8, side='left')
+            days = np.arange(len(midnights) - 1) + first.value//NS_PER_DAY
+            has_rows = bounds[1:] > bounds[:-1]
+            return days[has_rows], bounds[:-1][has_rows], bounds[1:][has_rows], None
+
+    row_days = local_ns(datetimes) // NS_PER_DAY
+    order = np.argsort(row_days, kind='stable')
+    row_days = row_days[order]
+    starts = np.flatnonzero(np.r_[True, row_days[1:] != row_days[:-1]])
+    return row_days[starts], starts, np.r_[starts[1:], len(row_days)], order
+
+def segment_medians(values, ok, starts, ends, n_ok):
+    '''
+    Median of values[starts[i]:ends[i]] for each i, skipping values where ok is False (NaN if there are none).
+    W/ few rows per segment, all values are sorted by (segment, value) at once; w/ many, each segment is
+    partitioned separately (a sort of all the rows would cost more than the per-segment calls).
+    '''
+    if len(starts) == 0:
+        return np.zeros(0)
+    if len(values) > 100*len(starts):
+        return np.array([np.median(values[start:end][ok[start:end]]) if n else np.nan
+                         for start, end, n in zip(starts, ends, n_ok)])
+
+    seg = np.repeat(np.arange(len(starts), dtype=np.uint16 if len(starts) < 2**16 else np.int64), ends - starts)
+    v = np.where(ok, values, np.inf)
+    perm = np.argsort(v, kind='stable')
+    perm = perm[np.argsort(seg[perm], kind='stable')]
+    v = v[perm]
+    lo, hi = starts + np.maximum(n_ok - 1, 0)//2, starts + n_ok//2
+    with np.errstate(invalid='ignore'):
+        return np.where(n_ok > 0, (v[lo] + v[hi])/2, np.nan)
 
+def agg_by_date(df):
+    '''
+    Group LotSpot data by date and compute total # cars, and median/avg/max % capacity (NaNs are skipped, as in
+    a pandas groupby). Rows are grouped w/ day_slices and NumPy reduceat over each day's rows, rather than
+    grouping the column of date objects; date in the result is datetime64.
+    '''
+    days, starts, ends, order = day_slices(df['datetime'])
+    in_out = df['in_out'].values.astype(np.float64)
+    pc = df['percent_capacity'].values.astype(np.float64)
+    if order is not None:
+        in_out, pc = in_out[order], pc[order]
 
+    pc_ok = ~np.isnan(pc)
+    if len(days) > 0:
+        n_pc = np.diff(np.r_[0, np.cumsum(pc_ok)[ends - 1]])
+        total_cars = np.add.reduceat(np.where(np.isnan(in_out), 0, in_out), starts)
+        sum_pc = np.add.reduceat(np.where(pc_ok, pc, 0), starts)
+        max_pc = np.fmax.reduceat(pc, starts)
+    else:
+        n_pc, total_cars, sum_pc, max_pc = np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_pc = sum_pc/n_pc
+    med_pc = segment_medians(pc, pc_ok, starts, ends, n_pc)
+
+    return pd.DataFrame({'date': days.astype('datetime64[D]').astype('datetime64[ns]'),
+                         'total_cars': total_cars.astype(df['in_out'].dtype),
+                         'med_pc': med_pc, 'avg_pc': avg_pc, 'max_pc': max_pc})
+
+def fill_missing_dates(df_gb_day):
+    '''
+    Convert date column to datetime, and ensure we have all days in range (values will be nan if date is missing)
+    '''
+    df_gb_day['date'] = pd.to_datetime(df_gb_day['date'])
+
+    all_dates = pd.date_range(start=df_gb_day['date'].min(), end=df_gb_day['date'].max(), freq='D', name='date')
+    df_gb_day = df_gb_day.set_index('date').reindex(all_dates).reset_index()
+
+    return df_gb_day
 
 def agg_lotspot_daily(df):
     '''
@@ -81,42 +196,400 @@ def agg_lotspot_daily(df):
     RETURNS
     df_gb_day(Pandas Dataframe) : Dataframe aggregated by day
     '''
-    
-    df_gb_day = df.groupby('date').agg(total_cars=pd.NamedAgg(column='in_out',aggfunc='sum'),
-        med_pc = pd.NamedAgg(column='percent_capacity', aggfunc='median'),
-        avg_pc = pd.NamedAgg(column='percent_capacity', aggfunc='mean'),
-        max_pc = pd.NamedAgg(column='percent_capacity', aggfunc='max')).reset_index()
 
-    df_gb_day['date'] = pd.to_datetime(df_gb_day['date'])
+    df_gb_day = agg_by_date(df)
 
     # Some dates may be missing; ensure we have all days in range (values will be nan if date is missing)
-    all_dates = pd.date_range(start=df_gb_day['date'].min(), end=df_gb_day['date'].max(), freq='D')
-    df_all_dates = pd.DataFrame({'date':all_dates})
-    df_gb_day = pd.merge(df_all_dates, df_gb_day, how='left', left_on='date', right_on='date')
+    df_gb_day = fill_missing_dates(df_gb_day)
 
     return df_gb_day
 
+def stream_process_park_data(park_name, chunksize=500000, raw_writer=None):
+    '''
+    Read raw LotSpot data for a park **once**, in fixed-size chunks w/ compact dtypes, and produce the
+    processed raw, daily, and hourly data at the same time. Gives the same results as read_process_park_data,
+    agg_lotspot_daily, and read_process_park_data_into_hourly, but peak memory depends on chunksize rather
+    than the size of the file. Raw file must be sorted by timestamp.
+
+    INPUT
+    park_name (str) : Name of park to load
+    chunksize (int) : Number of rows to read at a time
+    raw_writer (function) : Called w/ (df_chunk, i_chunk) for each processed raw chunk (ie to save it);
+                            processed raw data is not kept in memory
+
+    RETURNS
+    df_daily, df_hourly (Pandas Dataframes) : Same as agg_lotspot_daily, read_process_park_data_into_hourly
+    '''
+    reader = pd.read_csv(raw_file_name(park_name), header=None, names=RAW_COL_NAMES, dtype=RAW_DTYPES, chunksize=chunksize)
+
+    daily_parts, hourly_parts = [], []
+    day_carry = None   # rows of the last date seen, which may continue in the next chunk
+    last_row = None    # last row seen, needed to pad-forward into the next chunk's hours
+    last_hour = None   # last hour already resampled
+
+    for i_chunk, chunk in enumerate(reader):
+        df = process_raw_lotspot(chunk)
+        if last_row is not None and df['datetime'].iloc[0] < last_row['datetime'].iloc[-1]:
+            raise ValueError('Raw LotSpot file for ' + park_name + ' is not sorted by timestamp')
+        if raw_writer is not None:
+            raw_writer(df, i_chunk)
+
+        # Aggregate all complete dates; hold on to the last one
+        df_day = df[['date','datetime','in_out','percent_capacity']]
+        if day_carry is not None:
+            df_day = pd.concat([day_carry, df_day])
+        complete = (df_day['date'] != df_day['date'].iloc[-1]).values
+        if complete.any():
+            daily_parts.append(agg_by_date(df_day[complete]))
+        day_carry = df_day[~complete]
+
+        # Resample this chunk (plus the last row of the previous one), keeping only new hours
+        df_h = df[['datetime','percent_capacity']]
+        if last_row is not None:
+            df_h = pd.concat([last_row, df_h])
+        df_hourly = resample_hourly(df_h)
+        if last_hour is not None:
+            df_hourly = df_hourly[df_hourly['datetime'] > last_hour]
+        if len(df_hourly) > 0:
+            hourly_parts.append(df_hourly)
+            last_hour = df_hourly['datetime'].iloc[-1]
+        last_row = df_h.iloc[[-1]]
+
+    daily_parts.append(agg_by_date(day_carry))
+    df_daily = fill_missing_dates(pd.concat(daily_parts, ignore_index=True))
+    df_hourly = add_hourly_fields(pd.concat(hourly_parts, ignore_index=True))
+
+    return df_daily, df_hourly
+
+def check_stream_matches(park_name, chunksize=500000):
+    '''
+    Check stream_process_park_data gives the same results as the whole-file functions.
+    Values must match; dtypes can differ (the streamed data uses compact dtypes).
+    '''
+    raw_chunks = []
+    df_daily, df_hourly = stream_process_park_data(park_name, chunksize=chunksize,
+                                                   raw_writer=lambda df, i_chunk: raw_chunks.append(df))
+    df = read_process_park_data(park_name)
+    pd.testing.assert_frame_equal(pd.concat(raw_chunks, ignore_index=True), df, check_dtype=False)
+    pd.testing.assert_frame_equal(df_daily, agg_lotspot_daily(df), check_dtype=False)
+    pd.testing.assert_frame_equal(df_hourly, read_process_park_data_into_hourly(park_name), check_dtype=False)
+
+def raw_file_end(park_name):
+    '''
+    Return (offset, last_line) of the raw file: offset is just past the last complete line,
+    last_line is that line (bytes). Used to check the file was only appended to since the last run.
+    '''
+    with open(raw_file_name(park_name), 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 4096))
+        tail = f.read()
+    if b'\n' not in tail:
+        return 0, b''
+    offset = size - (len(tail) - tail.rindex(b'\n') - 1)
+    lines = tail[:tail.rindex(b'\n')].split(b'\n')
+    return offset, lines[-1] + b'\n'
+
+def watermark_file_name(park_name):
+    # starts w/ '_' so it's ignored when reading the dataset
+    return os.path.join(dataset_dir('lotspot_hourly', park_name), '_watermark.json')
+
+def write_watermark(park_name, offset, last_line, last_row, last_hour):
+    '''
+    Save how far the hourly data for a park has been processed: the raw file offset/line reached,
+    the last raw row (needed to pad-forward into the next hours) and the last hour saved.
+    '''
+    watermark = {'offset': offset, 'last_line': last_line.decode(),
+                 'last_timestamp': int(last_row['datetime'].timestamp()),
+                 'last_percent_capacity': float(last_row['percent_capacity']),
+                 'last_hour': int(last_hour.timestamp())}
+    with open(watermark_file_name(park_name), 'w') as f:
+        json.dump(watermark, f)
+
+def read_watermark(park_name):
+    try:
+        with open(watermark_file_name(park_name), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_appended_raw(park_name, watermark, dtype=None):
+    '''
+    Read the rows added to the end of a park's raw file since a watermark (w/ offset and last_line) was saved
+
+    RETURNS
+    df (Pandas DataFrame) : The new rows, as in the raw file (None if the file was changed other than appended to)
+    offset, last_line : End of the raw file now (see raw_file_end)
+    '''
+    last_line = watermark['last_line'].encode()
+    with open(raw_file_name(park_name), 'rb') as f:
+        f.seek(max(0, watermark['offset'] - len(last_line)))
+        unchanged = f.read(len(last_line)) == last_line
+    if not unchanged:
+        return None, None, None
+
+    offset, new_last_line = raw_file_end(park_name)
+    if offset <= watermark['offset']:
+        return pd.DataFrame({col: pd.Series(dtype=(dtype or {}).get(col, 'int64')) for col in RAW_COL_NAMES}), offset, new_last_line
+    with open(raw_file_name(park_name), 'rb') as f:
+        f.seek(watermark['offset'])
+        df = pd.read_csv(io.BytesIO(f.read(offset - watermark['offset'])), header=None, names=RAW_COL_NAMES, dtype=dtype)
+    return df, offset, new_last_line
+
+def raw_watermark_file_name(park_name):
+    # kept apart from the hourly watermark, which stream_LotSpot.py also moves (w/o saving raw rows)
+    return os.path.join(dataset_dir('lotspot_raw', park_name), '_watermark.json')
+
+def write_raw_watermark(park_name, offset, last_line):
+    '''
+    Save how far the raw file has been read into lotspot_raw (and lotspot_daily)
+    '''
+    with open(raw_watermark_file_name(park_name), 'w') as f:
+        json.dump({'offset': offset, 'last_line': last_line.decode()}, f)
+
+def update_park_raw_daily(park_name):
+    '''
+    Incrementally update a park's processed raw and daily data: only raw rows added to the end of the raw file
+    since the last run (see write_raw_watermark) are read, processed, and appended to lotspot_raw, and only the
+    daily rows from the first month those rows are in onward are re-computed (from the store) and replaced.
+    Result is the same as re-doing the whole file.
+
+    RETURNS
+    n_raw (int) : Number of raw rows added
+    n_daily (int) : Number of daily rows re-written
+    Returns None if there is no raw watermark or the raw file was changed other than appended to
+    (the caller should re-do the whole file).
+    '''
+    try:
+        with open(raw_watermark_file_name(park_name), 'r') as f:
+            watermark = json.load(f)
+    except (OSError, ValueError):
+        return None
+    df, offset, last_line = read_appended_raw(park_name, watermark)
+    if df is None:
+        return None
+    if len(df) == 0:
+        return 0, 0
+
+    df = process_raw_lotspot(df)
+    write_dataset(df, 'lotspot_raw', park_name, mode='append', basename='inc-' + str(offset) + '-{i}.parquet')
+
+    # daily rows for every day from the start of the first month w/ new rows (or the first day, if that's the
+    # first month of data), from all of the raw rows in those months
+    first_month = int(month_key(df['datetime']).min())
+    month_start = pd.Timestamp(year=first_month//100, month=first_month%100, day=1, tz='US/Mountain')
+    df_months = read_dataset('lotspot_raw', park_name, start=month_start)
+    df_daily = agg_by_date(df_months)
+    earlier = any(name.startswith('year_month=') and int(name.split('=')[1]) < first_month
+                  for name in os.listdir(dataset_dir('lotspot_raw', park_name)))
+    start = month_start.tz_localize(None) if earlier else df_daily['date'].min()
+    all_dates = pd.date_range(start=start, end=df_daily['date'].max(), freq='D', name='date')
+    df_daily = df_daily.set_index('date').reindex(all_dates).reset_index()
+    write_dataset(df_daily, 'lotspot_daily', park_name, mode='replace_months')
+
+    write_raw_watermark(park_name, offset, last_line)
+    return len(df), len(df_daily)
+
+def rebuild_park_hourly(park_name, df_raw=None):
+    '''
+    Resample a park's whole raw file to hourly, save it and its occupancy cube, and save the watermark.
+    Returns # hourly rows. df_raw is the processed raw data (from read_process_park_data), if already loaded.
+    '''
+    offset, last_line = raw_file_end(park_name)
+    df_hourly = read_process_park_data_into_hourly(park_name)
+    write_dataset(df_hourly, 'lotspot_hourly', park_name, mode='replace_park')
+    write_cube(park_name, add_to_cube(empty_cube(), df_hourly))
+    if df_raw is None:
+        df_raw = pd.read_csv(raw_file_name(park_name), header=None, names=RAW_COL_NAMES, usecols=['percent_capacity','timestamp'])
+        last_row = {'datetime': pd.Timestamp(df_raw['timestamp'].iloc[-1], unit='s', tz='UTC'),
+                    'percent_capacity': df_raw['percent_capacity'].iloc[-1]*100}
+    else:
+        last_row = df_raw.iloc[-1]
+    write_watermark(park_name, offset, last_line, last_row, df_hourly['datetime'].iloc[-1])
+    return len(df_hourly)
+
+def update_park_hourly(park_name):
+    '''
+    Incrementally update a park's hourly data: only raw rows added to the end of the raw file since the
+    last run (see watermark) are read and resampled, and the new hours are appended to the hourly dataset
+    and added to the occupancy cube.
+    Result is the same as re-doing the whole file w/ read_process_park_data_into_hourly.
+    Falls back to a full rebuild if there is no watermark, or the raw file was changed other than appended to.
+
+    INPUT
+    park_name (str)
+
+    RETURNS
+    n_new (int) : Number of hourly rows added
+    '''
+    watermark = read_watermark(park_name)
+    if watermark is None:
+        return rebuild_park_hourly(park_name)
+
+    df, offset, new_last_line = read_appended_raw(park_name, watermark, dtype=RAW_DTYPES)
+    if df is None:
+        return rebuild_park_hourly(park_name)
+
+    df = df[df['timestamp'] > watermark['last_timestamp']].copy()
+    if len(df) == 0:
+        return 0
+    if (df['timestamp'].diff() < 0).any():
+        return rebuild_park_hourly(park_name)
+
+    df['percent_capacity'] = df['percent_capacity']*100
+    df['datetime'] = pd.to_datetime(df['timestamp'], origin='unix', unit='s', utc=True).dt.tz_convert('US/Mountain')
+
+    # resample new rows plus the last row already processed, keeping only hours not already saved
+    last_row = pd.DataFrame({'datetime': [pd.Timestamp(watermark['last_timestamp'], unit='s', tz='UTC').tz_convert('US/Mountain')],
+                             'percent_capacity': [watermark['last_percent_capacity']]})
+    df_hourly = resample_hourly(pd.concat([last_row, df[['datetime','percent_capacity']]], ignore_index=True))
+    df_hourly = df_hourly[df_hourly['datetime'] > pd.Timestamp(watermark['last_hour'], unit='s', tz='UTC')]
+    df_hourly = add_hourly_fields(df_hourly.reset_index(drop=True))
+
+    if len(df_hourly) > 0:
+        write_dataset(df_hourly, 'lotspot_hourly', park_name, mode='append', basename='inc-' + str(offset) + '-{i}.parquet')
+        update_cube(park_name, df_hourly)
+        last_hour = df_hourly['datetime'].iloc[-1]
+    else:
+        last_hour = pd.Timestamp(watermark['last_hour'], unit='s', tz='UTC')
+    write_watermark(park_name, offset, new_last_line, df.iloc[-1], last_hour)
+
+    return len(df_hourly)
+
+def process_park(park_name, stream=False, chunksize=500000, incremental=False):
+    '''
+    Run all the processing stages for one park and save the results.
+
+    INPUT
+    park_name (str)
+    stream (bool) : If True, use stream_process_park_data (bounded memory)
+    chunksize (int) : Rows per chunk if stream is True
+    incremental (bool) : If True, only process raw data added since the last run (see update_park_raw_daily
+                         and update_park_hourly); stats are then for the new rows only
+
+    RETURNS
+    stats (dict) : Row counts and time (s) for each stage
+    '''
+    stats = {}
+
+    if stream:
+        # Each raw chunk is saved as it's processed; daily and hourly are saved at the end
+        n_raw, last_raw_row = [0], [None]
+        def save_raw_chunk(df, i_chunk):
+            write_dataset(df, 'lotspot_raw', park_name, mode='replace_park' if i_chunk == 0 else 'append',
+                          basename='part-' + str(i_chunk) + '-{i}.parquet')
+            n_raw[0] += len(df)
+            last_raw_row[0] = df.iloc[-1]
+        t0 = time.time()
+        offset, last_line = raw_file_end(park_name)
+        df_daily, df_hourly = stream_process_park_data(park_name, chunksize=chunksize, raw_writer=save_raw_chunk)
+        write_raw_watermark(park_name, offset, last_line)
+        write_dataset(df_daily, 'lotspot_daily', park_name, mode='replace_park')
+        write_dataset(df_hourly, 'lotspot_hourly', park_name, mode='replace_park')
+        write_cube(park_name, add_to_cube(empty_cube(), df_hourly))
+        write_watermark(park_name, offset, last_line, last_raw_row[0], df_hourly['datetime'].iloc[-1])
+        stats['stream_s'] = time.time() - t0
+        stats['raw_rows'], stats['daily_rows'], stats['hourly_rows'] = n_raw[0], len(df_daily), len(df_hourly)
+        return stats
+
+    if incremental:
+        t0 = time.time()
+        n_rows = update_park_raw_daily(park_name)
+        if n_rows is not None:
+            stats['raw_rows'], stats['daily_rows'] = n_rows
+            stats['raw_s'] = time.time() - t0
+            t0 = time.time()
+            stats['hourly_rows'] = update_park_hourly(park_name)
+            stats['hourly_s'] = time.time() - t0
+            return stats
+
+    # Read in raw LotSpot data to pandas and save
+    t0 = time.time()
+    offset, last_line = raw_file_end(park_name)
+    df = read_process_park_data(park_name)
+    write_dataset(df, 'lotspot_raw', park_name, mode='replace_park')
+    write_raw_watermark(park_name, offset, last_line)
+    stats['raw_s'], stats['raw_rows'] = time.time() - t0, len(df)
+
+    # Aggregate to daily and save
+    t0 = time.time()
+    df_daily = agg_lotspot_daily(df)
+    write_dataset(df_daily, 'lotspot_daily', park_name, mode='replace_park')
+    stats['daily_s'], stats['daily_rows'] = time.time() - t0, len(df_daily)
+
+    # Resample to hourly data and save
+    t0 = time.time()
+    if incremental:
+        stats['hourly_rows'] = update_park_hourly(park_name)
+    else:
+        stats['hourly_rows'] = rebuild_park_hourly(park_name, df_raw=df)
+    stats['hourly_s'] = time.time() - t0
+
+    return stats
+
+def run_park(park_name, **kwargs):
+    '''
+    Run process_park for one park, catching any error so one bad park doesn't stop the others.
+    Returns (park_name, stats, error message or None)
+    '''
+    t0 = time.time()
+    try:
+        stats = process_park(park_name, **kwargs)
+        error = None
+    except Exception as e:
+        stats = {}
+        error = repr(e)
+    stats['total_s'] = time.time() - t0
+    return park_name, stats, error
+
+def run_parks(park_names, n_workers=None, **kwargs):
+    '''
+    Process several parks in parallel, w/ one park per worker process.
+
+    INPUT
+    park_names (list)
+    n_workers (int) : Number of worker processes (default is number of CPUs); 1 runs in this process
+    kwargs : Passed on to process_park
+
+    RETURNS
+    results (list) : (park_name, stats, error) for each park, in the order of park_names
+    '''
+    if n_workers == 1:
+        return [run_park(park_name, **kwargs) for park_name in park_names]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(run_park, park_name, **kwargs) for park_name in park_names]
+        return [future.result() for future in futures]
+
+def print_summary(results):
+    '''
+    Print table of rows and time for each park
+    '''
+    print('{:<22}{:>10}{:>10}{:>10}{:>10}  {}'.format('park', 'raw rows', 'daily', 'hourly', 'time (s)', 'status'))
+    for park_name, stats, error in results:
+        print('{:<22}{:>10}{:>10}{:>10}{:>10.1f}  {}'.format(park_name, stats.get('raw_rows', '-'), stats.get('daily_rows', '-'),
+                                                           stats.get('hourly_rows', '-'), stats['total_s'],
+                                                           'ok' if error is None else 'FAILED: ' + error))
+
 if __name__=='__main__':
 
+    parser = argparse.ArgumentParser(description='Process raw LotSpot data for all parks')
+    parser.add_argument('--stream', action='store_true', help='Read raw files in chunks (bounded memory)')
+    parser.add_argument('--chunksize', type=int, default=500000, help='Rows per chunk w/ --stream')
+    parser.add_argument('--workers', type=int, default=None, help='Number of parks to process in parallel (default is # CPUs)')
+    parser.add_argument('--incremental', action='store_true', help='Only process raw data added since last run (not w/ --stream)')
+    parser.add_argument('--check', action='store_true', help='Check streamed results match whole-file processing')
+    args = parser.parse_args()
+
     with open('./data/park_info.pkl', 'rb') as f:
         park_info = pickle.load(f)
 
-    for park_name in park_info.keys():
-
-        # Read in raw LotSpot data to pandas and save
-        df = read_process_park_data(park_name)
-        base_dir = './data/proc/LotSpot/'
-        df.to_csv(base_dir  + park_name + '_raw.csv', index=False)
-        df.to_pickle(base_dir  + park_name + '_raw.pkl')
-
-        # Aggregate to daily and save
-        df_daily = agg_lotspot_daily(df)
-        base_dir = './data/proc/LotSpot/'
-        df_daily.to_csv(base_dir  + park_name + '_daily.csv', index=False)
-        df_daily.to_pickle(base_dir  + park_name + '_daily.pkl')
-
-        # Resample to hourly data and save
-        df_hourly = read_process_park_data_into_hourly(park_name)
-        base_dir = './data/proc/LotSpot/'
-        df_hourly.to_csv(base_dir  + park_name + '_resampled_hourly.csv', index=False)
-        df_hourly.to_pickle(base_dir  + park_name + '_resampled_hourly.pkl')
+    if args.check:
+        for park_name in park_info.keys():
+            check_stream_matches(park_name, chunksize=args.chunksize)
+            print(park_name + ' : streamed results match')
+    else:
+        results = run_parks(list(park_info.keys()), n_workers=args.workers, stream=args.stream, chunksize=args.chunksize,
+                            incremental=args.incremental)
+        print_summary(results)
+        if any(error is not None for park_name, stats, error in results):
+            sys.exit(1)
@@ -0,0 +1,104 @@
+# Replay raw LotSpot files as a live event stream, for testing stream_LotSpot.py
+# Events from every park are merged in time order and sent to the stream's socket, sped up by --speed
+# (eg 3600 = an hour of events every second; 0 = as fast as possible).
+# --check instead runs each park's whole raw file through the online hourly bins (in this process) and checks
+# they match process_LotSpot.read_process_park_data_into_hourly.
+#
+# Usage: python src/replay_LotSpot.py [--port 8060] [--speed 3600] [--start 2020-01-01] [--end 2020-02-01]
+#        python src/replay_LotSpot.py --check
+
+import sys
+import time
+import pickle
+import socket
+import argparse
+import numpy as np
+import pandas as pd
+
+from process_LotSpot import RAW_COL_NAMES, RAW_DTYPES, raw_file_name, read_process_park_data_into_hourly
+from stream_LotSpot import HourlyBins, bins_frame
+
+
+def read_events(park_names, start=None, end=None):
+    '''
+    Raw LotSpot rows for several parks, w/ a park_name column, merged in time order
+
+    INPUT
+    start, end (str) : Only rows from start up to (not including) end, formatted like '2020-01-01' (local time)
+    '''
+    frames = []
+    for park_name in park_names:
+        df = pd.read_csv(raw_file_name(park_name), header=None, names=RAW_COL_NAMES, dtype=RAW_DTYPES)
+        df.insert(0, 'park_name', park_name)
+        if start is not None:
+            df = df[df['timestamp'] >= pd.Timestamp(start, tz='US/Mountain').timestamp()]
+        if end is not None:
+            df = df[df['timestamp'] < pd.Timestamp(end, tz='US/Mountain').timestamp()]
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True).sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def send_events(df, host='127.0.0.1', port=8060, speed=3600):
+    '''
+    Send events (see read_events) to a stream_LotSpot server, one line each, at speed x real time
+
+    RETURNS
+    n_sent (int)
+    '''
+    lines = (df['park_name'] + ',' + df['percent_capacity'].astype(str) + ',' + df['spots_taken'].astype(str) + ','
+             + df['total_spots'].astype(str) + ',' + df['timestamp'].astype(str) + ',' + df['in_out'].astype(str) + '\n')
+    due = (df['timestamp'].values - df['timestamp'].values[0])/speed if speed > 0 else np.zeros(len(df))
+    t0 = time.time()
+    with socket.create_connection((host, port)) as sock:
+        i = 0
+        while i < len(lines):
+            # send everything that's due in one go, then wait for the next event
+            j = np.searchsorted(due, time.time() - t0, side='right')
+            j = max(j, i + 1)
+            sock.sendall(''.join(lines.values[i:j]).encode())
+            i = j
+            if i < len(lines):
+                time.sleep(max(0, min(due[i] - (time.time() - t0), 1)))
+    return len(lines)
+
+
+def check_replay_matches(park_name):
+    '''
+    Check the online hourly bins give the same hourly data as the batch resample for a park's raw file
+    '''
+    df = pd.read_csv(raw_file_name(park_name), header=None, names=RAW_COL_NAMES, dtype=RAW_DTYPES)
+    bins = HourlyBins()
+    closed = []
+    for ts, pc in zip(df['timestamp'].values.tolist(), (df['percent_capacity'].values*100).tolist()):
+        closed += bins.add(ts, pc) or []
+    closed += bins.close(bins.last_ts)
+    pd.testing.assert_frame_equal(bins_frame(closed), read_process_park_data_into_hourly(park_name), check_dtype=False)
+    return len(closed)
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Replay raw LotSpot files to stream_LotSpot.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8060)
+    parser.add_argument('--speed', type=float, default=3600, help='Times real time (0 = as fast as possible)')
+    parser.add_argument('--start', default=None, help='Only replay events from this day (YYYY-MM-DD)')
+    parser.add_argument('--end', default=None, help='Only replay events before this day (YYYY-MM-DD)')
+    parser.add_argument('--parks', nargs='+', default=None, help='Parks to replay (default all)')
+    parser.add_argument('--check', action='store_true', help='Check the online hourly bins match the batch resample')
+    args = parser.parse_args()
+
+    with open('./data/park_info.pkl', 'rb') as f:
+        park_info = pickle.load(f)
+    park_names = args.parks if args.parks is not None else list(park_info.keys())
+
+    if args.check:
+        for park_name in park_names:
+            n_hours = check_replay_matches(park_name)
+            print(park_name + ' : streamed hourly bins match (' + str(n_hours) + ' hours)')
+        sys.exit(0)
+
+    df = read_events(park_names, args.start, args.end)
+    t0 = time.time()
+    n_sent = send_events(df, args.host, args.port, args.speed)
+    print('Sent ' + str(n_sent) + ' events in ' + str(round(time.time() - t0, 1)) + ' s')
@@ -0,0 +1,192 @@
+# Columnar storage for processed LotSpot and weather data
+# Each dataset is a Parquet dataset partitioned by park and month
+# (ie ./data/store/lotspot_hourly/park_name=east_mount_falcon/year_month=202005/)
+# so readers can load just the columns and date range they need.
+# Usage: python src/storage.py migrate   (convert existing .pkl files into the store)
+
+import os
+import sys
+import shutil
+import hashlib
+import pickle
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+STORE_DIR = './data/store/'
+
+# Time column used for the month partition and date-range filters of each dataset
+TIME_COLUMNS = {'lotspot_raw': 'datetime',
+                'lotspot_daily': 'date',
+                'lotspot_hourly': 'datetime',
+                'weather_hourly': 'time',
+                'weather_daily': 'time',
+                'forecast_hourly': 'time',
+                'forecast_daily': 'time',
+                'predictions': 'time'}
+
+# (named so they don't clash w/ the 'month' column in the LotSpot data)
+PARTITIONING = ds.partitioning(pa.schema([('park_name', pa.string()), ('year_month', pa.int32())]), flavor='hive')
+PARTITION_COLUMNS = ['park_name', 'year_month']
+
+
+def dataset_dir(name, park_name=None, store_dir=STORE_DIR):
+    path = os.path.join(store_dir, name)
+    if park_name is not None:
+        path = os.path.join(path, 'park_name=' + park_name)
+    return path
+
+
+def month_key(times):
+    '''
+    Month partition key (ie 202005) for a Series of datetimes, or a single Timestamp
+    '''
+    if isinstance(times, pd.Series):
+        return (times.dt.year*100 + times.dt.month).astype('int32')
+    return times.year*100 + times.month
+
+
+def write_dataset(df, name, park_name, mode='replace_months', basename='part-{i}.parquet', store_dir=STORE_DIR):
+    '''
+    Write a park's DataFrame to a dataset in the store
+
+    INPUT
+    df (Pandas DataFrame) : Must contain the dataset's time column (see TIME_COLUMNS)
+    name (str) : Dataset name, ie 'lotspot_hourly'
+    park_name (str)
+    mode (str) : 'replace_months' (default) replaces only the months in df,
+                 'replace_park' deletes all the park's existing data first,
+                 'append' adds files next to existing ones (use a unique basename)
+    basename (str) : File name template; must contain '{i}'
+    '''
+    if mode == 'replace_park' and os.path.exists(dataset_dir(name, park_name, store_dir)):
+        shutil.rmtree(dataset_dir(name, park_name, store_dir))
+
+    df = df.assign(park_name=park_name, year_month=month_key(pd.to_datetime(df[TIME_COLUMNS[name]])))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(table, dataset_dir(name, store_dir=store_dir), format='parquet', partitioning=PARTITIONING,
+                     basename_template=basename,
+                     existing_data_behavior='overwrite_or_ignore' if mode == 'append' else 'delete_matching')
+
+
+def time_scalar(t, field_type):
+    '''
+    Convert a date/time (str or Timestamp) to a pyarrow scalar comparable w/ a timestamp/date column
+    '''
+    t = pd.Timestamp(t)
+    if pa.types.is_date(field_type):
+        return pa.scalar(t.date(), type=field_type)
+    if field_type.tz is not None:
+        t = t.tz_localize(field_type.tz) if t.tz is None else t.tz_convert(field_type.tz)
+    return pa.scalar(t, type=field_type)
+
+
+def read_dataset(name, park_name=None, columns=None, start=None, end=None, store_dir=STORE_DIR):
+    '''
+    Read (part of) a dataset from the store. Only the partitions/columns needed are read.
+
+    INPUT
+    name (str) : Dataset name, ie 'lotspot_hourly'
+    park_name (str) : Only read this park (default is all parks, w/ a 'park_name' column added)
+    columns (list) : Only read these columns (default is all)
+    start, end (str or Timestamp) : Only read rows w/ time column >= start and < end.
+                                    Naive times are taken to be local (the time column's timezone).
+
+    OUTPUT
+    df (Pandas DataFrame) : Sorted by the time column (if it was read)
+    '''
+    time_col = TIME_COLUMNS[name]
+    dataset = ds.dataset(dataset_dir(name, store_dir=store_dir), format='parquet', partitioning=PARTITIONING)
+
+    filters = []
+    if park_name is not None:
+        filters.append(ds.field('park_name') == park_name)
+    if start is not None:
+        filters.append(ds.field('year_month') >= month_key(pd.Timestamp(start)))
+        filters.append(ds.field(time_col) >= time_scalar(start, dataset.schema.field(time_col).type))
+    if end is not None:
+        filters.append(ds.field('year_month') <= month_key(pd.Timestamp(end)))
+        filters.append(ds.field(time_col) < time_scalar(end, dataset.schema.field(time_col).type))
+    row_filter = None
+    for f in filters:
+        row_filter = f if row_filter is None else row_filter & f
+
+    if columns is None:
+        columns = [col for col in dataset.schema.names if col not in PARTITION_COLUMNS]
+        if park_name is None:
+            columns = columns + ['park_name']
+
+    df = dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+    if time_col in df.columns:
+        df = df.sort_values(time_col, kind='mergesort').reset_index(drop=True)
+    return df
+
+
+def dataset_exists(name, park_name=None, store_dir=STORE_DIR):
+    return os.path.exists(dataset_dir(name, park_name, store_dir))
+
+
+def dataset_fingerprint(name, park_name=None, store_dir=STORE_DIR):
+    '''
+    sha1 hex digest of the contents (and relative paths) of a dataset's Parquet files, so anything built from it
+    can tell whether the data has changed. Returns None if the dataset doesn't exist.
+    '''
+    path = dataset_dir(name, park_name, store_dir)
+    if not os.path.exists(path):
+        return None
+    files = sorted(os.path.join(root, file) for root, dirs, file_names in os.walk(path)
+                   for file in file_names if file.endswith('.parquet'))
+    h = hashlib.sha1()
+    for file in files:
+        h.update(os.path.relpath(file, path).encode())
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def migrate_pickles(park_names, store_dir=STORE_DIR):
+    '''
+    Copy existing processed .pkl files (made before the store existed) into the store.
+    Returns list of (dataset name, park, number of rows) migrated.
+    '''
+    lotspot_dir = './data/proc/LotSpot/'
+    combined_dir = './data/proc/weather/historical/combined/'
+    forecast_dir = './data/proc/weather/forecasts/'
+
+    migrated = []
+    for park_name in park_names:
+        files = {'lotspot_raw': lotspot_dir + park_name + '_raw.pkl',
+                 'lotspot_daily': lotspot_dir + park_name + '_daily.pkl',
+                 'lotspot_hourly': lotspot_dir + park_name + '_resampled_hourly.pkl',
+                 'weather_hourly': combined_dir + park_name + '_historical_combined_wea_hourly.pkl',
+                 'weather_daily': combined_dir + park_name + '_historical_combined_wea_daily.pkl'}
+        for name, file in files.items():
+            if os.path.exists(file):
+                df = pd.read_pickle(file)
+                write_dataset(df, name, park_name, mode='replace_park', store_dir=store_dir)
+                migrated.append((name, park_name, len(df)))
+
+        if os.path.exists(forecast_dir):
+            for file in sorted(os.listdir(forecast_dir)):
+                for kind in ['hourly', 'daily']:
+                    if file.startswith(park_name + '_forecast_') and file.endswith('_' + kind + '.pkl'):
+                        date_req = file[len(park_name + '_forecast_'):-len('_' + kind + '.pkl')]
+                        df = pd.read_pickle(forecast_dir + file)
+                        write_dataset(df, 'forecast_' + kind, park_name, mode='append',
+                                      basename='forecast-' + date_req + '-{i}.parquet', store_dir=store_dir)
+                        migrated.append(('forecast_' + kind, park_name, len(df)))
+    return migrated
+
+
+if __name__=='__main__':
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('Usage: python src/storage.py migrate')
+        sys.exit(1)
+
+    with open('./data/park_info.pkl', 'rb') as f:
+        park_info = pickle.load(f)
+
+    for name, park_name, n_rows in migrate_pickles(list(park_info.keys())):
+        print('Migrated ' + name + ' for ' + park_name + ' (' + str(n_rows) + ' rows)')
@@ -0,0 +1,289 @@
+# Streaming LotSpot ingestion: read events (the raw file fields) as they happen, from a local socket or by
+# tailing the raw files, keep each park's current occupancy in memory, and roll events into hourly bins
+# w/ the same values as process_LotSpot.resample_hourly (resample('H').pad(limit=3)).
+# Closed hours are flushed to the lotspot_hourly store (and occupancy cube) every few minutes, and the
+# park's watermark is moved along, so process_LotSpot.py --incremental carries on from where the stream got to.
+# Current occupancy for every park is written to ./data/live_occupancy.json.
+#
+# Usage: python src/stream_LotSpot.py --port 8060                  (lines: park_name,percent_capacity,spots_taken,total_spots,timestamp,in_out)
+#        python src/stream_LotSpot.py --tail                       (follow ./data/raw/LotSpot/<park>.csv for every park)
+# See replay_LotSpot.py to feed old raw files through it.
+
+import os
+import json
+import time
+import pickle
+import signal
+import argparse
+import threading
+import socketserver
+import numpy as np
+import pandas as pd
+
+from storage import write_dataset
+from process_LotSpot import raw_file_name, add_hourly_fields, read_watermark, write_watermark
+from occupancy_cube import update_cube
+
+LIVE_FILE = './data/live_occupancy.json'
+# same as resample_hourly
+PAD_LIMIT = 3
+
+
+class HourlyBins:
+    '''
+    Online version of resample_hourly for one park: events (unix timestamp, % capacity) go in, in time order,
+    and each hour comes out (as (hour timestamp, % capacity)) once no later event can change it.
+    An hour's value is the last event at or before it, if that was no more than PAD_LIMIT hours before
+    (NaN otherwise), exactly as resample('H').pad(limit=3).
+
+    INPUT
+    last_ts, last_pc : Last event already binned (eg from the watermark), to carry on from
+    last_hour (int) : Last hour (unix timestamp) already output
+    '''
+
+    def __init__(self, last_ts=None, last_pc=None, last_hour=None, limit=PAD_LIMIT):
+        self.last_ts, self.last_pc = last_ts, last_pc
+        self.next_hour = None if last_hour is None else last_hour + 3600
+        self.limit = limit
+
+    def value_at(self, hour):
+        if self.last_ts is None or self.last_ts > hour:
+            return np.nan
+        if self.last_ts == hour:
+            return self.last_pc
+        # number of hours padded forward from the last event, counting this one
+        n_filled = (hour - (self.last_ts//3600)*3600)//3600
+        return self.last_pc if n_filled <= self.limit else np.nan
+
+    def close(self, upto):
+        '''
+        Output every hour at or before unix time upto that hasn't been output yet
+        '''
+        if self.next_hour is None:
+            return []
+        last = (upto//3600)*3600
+        closed = [(hour, self.value_at(hour)) for hour in range(self.next_hour, last + 1, 3600)]
+        self.next_hour = max(self.next_hour, last + 3600)
+        return closed
+
+    def add(self, ts, pc):
+        '''
+        Add an event; returns the hours it closes. Events at or before the last one are ignored (returns None).
+        '''
+        if self.last_ts is not None and ts <= self.last_ts:
+            return None
+        if self.next_hour is None:
+            self.next_hour = (ts//3600)*3600
+        closed = self.close(ts - 1)
+        self.last_ts, self.last_pc = ts, pc
+        return closed
+
+
+def bins_frame(closed):
+    '''
+    Hourly DataFrame (same columns as read_process_park_data_into_hourly) from a list of (hour, % capacity)
+    '''
+    df = pd.DataFrame({'datetime': pd.to_datetime([hour for hour, pc in closed], unit='s', utc=True).tz_convert('US/Mountain'),
+                       'percent_capacity': np.array([pc for hour, pc in closed], dtype=np.float64)})
+    return add_hourly_fields(df)
+
+
+class LotSpotStream:
+    '''
+    Per-park occupancy state and hourly bins for streamed LotSpot events. Each park carries on from its
+    watermark (see process_LotSpot.write_watermark), so hours already in the store aren't repeated.
+    Thread-safe; events can come from several connections.
+
+    INPUT
+    park_names (list)
+    flush_every (float) : Save closed hours to the store at most this often (seconds)
+    grace (float) : An hour is closed once the clock is this many seconds past it (events can arrive a bit late)
+    live_file (str) : Where to write current occupancy (None to not write it)
+    '''
+
+    def __init__(self, park_names, flush_every=300, grace=120, live_file=LIVE_FILE):
+        self.flush_every = flush_every
+        self.grace = grace
+        self.live_file = live_file
+        self.lock = threading.Lock()
+        self.bins, self.pending, self.current, self.file_pos = {}, {}, {}, {}
+        self.counts = {'events': 0, 'ignored': 0, 'bad_lines': 0, 'hours_flushed': 0}
+        self.last_flush = time.time()
+        for park_name in park_names:
+            watermark = read_watermark(park_name)
+            if watermark is None:
+                self.bins[park_name] = HourlyBins()
+                self.file_pos[park_name] = (0, b'')
+            else:
+                self.bins[park_name] = HourlyBins(watermark['last_timestamp'], watermark['last_percent_capacity'],
+                                                  watermark['last_hour'])
+                self.file_pos[park_name] = (watermark['offset'], watermark['last_line'].encode())
+            self.pending[park_name] = []
+
+    def add_event(self, park_name, percent_capacity, spots_taken, total_spots, timestamp, in_out=None):
+        '''
+        Add one event (fields as in the raw files: percent_capacity is a fraction, timestamp is unix seconds)
+        '''
+        with self.lock:
+            closed = self.bins[park_name].add(int(timestamp), float(percent_capacity)*100)
+            if closed is None:
+                self.counts['ignored'] += 1
+                return
+            self.pending[park_name] += closed
+            self.counts['events'] += 1
+            self.current[park_name] = {'time': pd.Timestamp(int(timestamp), unit='s', tz='UTC').tz_convert('US/Mountain').isoformat(),
+                                       'percent_capacity': round(float(percent_capacity)*100, 1),
+                                       'spots_taken': int(spots_taken), 'total_spots': int(total_spots)}
+
+    def add_line(self, line, park_name=None):
+        '''
+        Add an event from a line of text: 'percent_capacity,spots_taken,total_spots,timestamp,in_out' (as in the
+        raw files) if park_name is given, otherwise w/ the park name first
+        '''
+        fields = line.strip().split(',')
+        try:
+            if park_name is None:
+                park_name, fields = fields[0], fields[1:]
+            self.add_event(park_name, *[float(field) for field in fields[:5]])
+        except (KeyError, ValueError, TypeError):
+            with self.lock:
+                self.counts['bad_lines'] += 1
+
+    def tick(self, now=None, force_flush=False, event_time=False):
+        '''
+        Close every park's hours up to now (unix time; default is the clock) less the grace period, and save
+        closed hours if it's time to (or force_flush). If event_time, each park's hours are closed up to its own
+        last event instead of now (for replays, where parks' events can arrive well out of step).
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            for park_name, bins in self.bins.items():
+                if event_time and bins.last_ts is None:
+                    continue
+                upto = bins.last_ts if event_time else now
+                self.pending[park_name] += bins.close(int(upto - self.grace))
+        if force_flush or time.time() - self.last_flush >= self.flush_every:
+            self.flush()
+
+    def finish(self):
+        '''
+        Close each park's hours up to its last event (so the saved hours match resample_hourly on the same events)
+        and save them
+        '''
+        with self.lock:
+            for park_name, bins in self.bins.items():
+                if bins.last_ts is not None:
+                    self.pending[park_name] += bins.close(bins.last_ts)
+        self.flush()
+
+    def flush(self):
+        '''
+        Save each park's closed hours to the hourly store and its cube, and move its watermark along
+        '''
+        with self.lock:
+            jobs = [(park_name, closed, self.bins[park_name].last_ts, self.bins[park_name].last_pc, self.file_pos[park_name])
+                    for park_name, closed in self.pending.items() if len(closed) > 0]
+            for park_name, closed, last_ts, last_pc, file_pos in jobs:
+                self.pending[park_name] = []
+            self.last_flush = time.time()
+        for park_name, closed, last_ts, last_pc, (offset, last_line) in jobs:
+            df_hourly = bins_frame(closed)
+            write_dataset(df_hourly, 'lotspot_hourly', park_name, mode='append',
+                          basename='stream-' + str(closed[0][0]) + '-{i}.parquet')
+            update_cube(park_name, df_hourly)
+            last_row = {'datetime': pd.Timestamp(last_ts, unit='s', tz='UTC'), 'percent_capacity': last_pc}
+            write_watermark(park_name, offset, last_line, last_row, df_hourly['datetime'].iloc[-1])
+            with self.lock:
+                self.counts['hours_flushed'] += len(closed)
+        if self.live_file is not None:
+            self.write_live()
+
+    def write_live(self):
+        with self.lock:
+            live = {'updated': pd.Timestamp.now(tz='US/Mountain').isoformat(timespec='seconds'), 'parks': dict(self.current),
+                    'counts': dict(self.counts)}
+        os.makedirs(os.path.dirname(self.live_file), exist_ok=True)
+        with open(self.live_file + '.tmp', 'w') as f:
+            json.dump(live, f, indent=1)
+        os.replace(self.live_file + '.tmp', self.live_file)
+
+
+class EventHandler(socketserver.StreamRequestHandler):
+    '''
+    One line per event: park_name,percent_capacity,spots_taken,total_spots,timestamp,in_out
+    '''
+
+    def handle(self):
+        for line in self.rfile:
+            self.server.stream.add_line(line.decode())
+
+
+def make_server(stream, host='127.0.0.1', port=8060):
+    '''
+    Make (but don't start) a TCP server that adds each line it gets to stream. Use port=0 to pick a free port.
+    '''
+    server = socketserver.ThreadingTCPServer((host, port), EventHandler)
+    server.daemon_threads = True
+    server.stream = stream
+    return server
+
+
+def tail_raw_files(stream, park_names):
+    '''
+    Add any complete lines appended to each park's raw file since the last call (starting from the park's
+    watermark offset), and remember how far each file has been read
+    '''
+    for park_name in park_names:
+        offset, last_line = stream.file_pos[park_name]
+        if not os.path.exists(raw_file_name(park_name)) or os.path.getsize(raw_file_name(park_name)) <= offset:
+            continue
+        with open(raw_file_name(park_name), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        if b'\n' not in data:
+            continue
+        data = data[:data.rindex(b'\n') + 1]
+        lines = data.split(b'\n')[:-1]
+        for line in lines:
+            stream.add_line(line.decode(), park_name=park_name)
+        with stream.lock:
+            stream.file_pos[park_name] = (offset + len(data), lines[-1] + b'\n')
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Stream LotSpot events into hourly bins and the store')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8060, help='Port to listen for events on')
+    parser.add_argument('--tail', action='store_true', help='Follow the raw files instead of listening on a port')
+    parser.add_argument('--flush-every', type=float, default=300, help='Save closed hours this often (seconds)')
+    parser.add_argument('--grace', type=float, default=120, help='Close an hour this many seconds after it ends')
+    parser.add_argument('--event-time', action='store_true',
+                        help="Close each park's hours by its latest event time instead of the clock (for replays)")
+    args = parser.parse_args()
+
+    with open('./data/park_info.pkl', 'rb') as f:
+        park_info = pickle.load(f)
+    park_names = list(park_info.keys())
+
+    stream = LotSpotStream(park_names, flush_every=args.flush_every, grace=args.grace)
+    if not args.tail:
+        server = make_server(stream, args.host, args.port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print('Listening for LotSpot events on ' + args.host + ':' + str(args.port), flush=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    while not stop.is_set():
+        if args.tail:
+            tail_raw_files(stream, park_names)
+        stream.tick(event_time=args.event_time)
+        stop.wait(1)
+
+    # save what's closed before exiting
+    if args.event_time:
+        stream.finish()
+    else:
+        stream.tick(force_flush=True)
+    print(stream.counts, flush=True)
@@ -0,0 +1,157 @@
+# Generate realistic-looking synthetic data for benchmarking/testing the pipeline
+# without the real LotSpot files or a Dark Sky API key
+
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+from darksky_decode import DAILY_TIME_FIELDS
+from get_darksky_weather import parse_darksky_historical, daily_file_names
+from process_LotSpot import RAW_COL_NAMES, raw_file_name
+from combine_weather import DAILY_FILE_DIR
+
+SUMMARIES = ['Clear', 'Partly Cloudy', 'Mostly Cloudy', 'Overcast', 'Light Rain', 'Possible Light Snow']
+ICONS = ['clear-day', 'clear-night', 'partly-cloudy-day', 'partly-cloudy-night', 'cloudy', 'rain', 'snow', 'wind']
+
+
+def make_darksky_data_point(rng, t, hourly=True):
+    '''
+    Make a single Dark Sky data point dict for unix time t
+    '''
+    temp = float(rng.uniform(10, 90))
+    point = {'time': int(t),
+             'summary': SUMMARIES[rng.randint(len(SUMMARIES))],
+             'icon': ICONS[rng.randint(len(ICONS))],
+             'precipIntensity': round(float(rng.exponential(0.01)), 4),
+             'precipProbability': round(float(rng.uniform()), 2)}
+    if point['precipIntensity'] > 0.01:
+        point['precipType'] = 'rain' if temp > 32 else 'snow'
+    if hourly:
+        point.update({'temperature': temp, 'apparentTemperature': temp - float(rng.uniform(0, 5))})
+    else:
+        point.update({'moonPhase': round(float(rng.uniform()), 2), 'precipIntensityMax': point['precipIntensity']*2,
+                      'temperatureHigh': temp + 10, 'temperatureLow': temp - 10,
+                      'apparentTemperatureHigh': temp + 8, 'apparentTemperatureLow': temp - 12,
+                      'temperatureMin': temp - 10, 'temperatureMax': temp + 10,
+                      'apparentTemperatureMin': temp - 12, 'apparentTemperatureMax': temp + 8})
+        for field in DAILY_TIME_FIELDS[1:]:
+            point[field] = int(t + rng.randint(0, 86400))
+    point.update({'dewPoint': float(rng.uniform(0, 50)), 'humidity': round(float(rng.uniform()), 2),
+                  'pressure': float(rng.uniform(1000, 1030)), 'windSpeed': float(rng.uniform(0, 20)),
+                  'windGust': float(rng.uniform(0, 40)), 'windBearing': int(rng.randint(0, 360)),
+                  'cloudCover': round(float(rng.uniform()), 2), 'uvIndex': int(rng.randint(0, 10)),
+                  'visibility': 10})
+    return point
+
+
+def make_darksky_response(lat, lon, day, forecast=False, seed=None):
+    '''
+    Make a fake Dark Sky API response (decoded json dict)
+
+    INPUT
+    lat, lon (float)
+    day (str) : Day requested, formatted like '2020-05-01'
+    forecast (bool) : If True make a forecast (48 hours, 8 days) instead of a historical day (24 hours, 1 day)
+    seed (int) : Random seed
+
+    OUTPUT
+    dat_dict (dict)
+    '''
+    rng = np.random.RandomState(seed)
+    t0 = int(pd.Timestamp(day, tz='America/Denver').timestamp())
+    n_hours, n_days = (48, 8) if forecast else (24, 1)
+    return {'latitude': lat, 'longitude': lon, 'timezone': 'America/Denver', 'offset': -6,
+            'currently': {'time': t0 + 600},
+            'hourly': {'summary': 'x', 'icon': 'clear-day',
+                       'data': [make_darksky_data_point(rng, t0 + 3600*i) for i in range(n_hours)]},
+            'daily': {'summary': 'x', 'icon': 'clear-day',
+                      'data': [make_darksky_data_point(rng, t0 + 86400*i, hourly=False) for i in range(n_days)]}}
+
+
+def make_lotspot_raw(capacity, start, n_days, cars_per_day=None, seed=None):
+    '''
+    Make fake raw LotSpot data for one lot: a row each time a car enters or leaves, w/ more cars around midday,
+    on weekends, and in summer. Cars stay ~2 hours; spots taken is capped at capacity (the lot looks full).
+    A few rows have in_out = 2, like the sensor glitches in the real files.
+
+    INPUT
+    capacity (int) : Number of spots (< 256)
+    start (str) : First day, formatted like '2019-08-30'
+    n_days (int)
+    cars_per_day (float) : Average cars on a weekday (default 1.5 x capacity)
+    seed (int) : Random seed
+
+    OUTPUT
+    df (Pandas DataFrame) : Columns in the raw file order (see process_LotSpot.RAW_COL_NAMES), sorted by timestamp
+    '''
+    rng = np.random.RandomState(seed)
+    if cars_per_day is None:
+        cars_per_day = 1.5*capacity
+    days = pd.date_range(start, periods=n_days, freq='D', tz='US/Mountain')
+    rate = cars_per_day*np.where(days.dayofweek >= 5, 1.8, 1)*(1 + 0.3*np.sin(2*np.pi*(days.dayofyear - 100)/365))
+    n_cars = rng.poisson(rate)
+
+    day_start = np.repeat(days.asi8//10**9, n_cars)
+    arrive = day_start + (np.clip(rng.normal(10.5, 2.5, len(day_start)), 5, 19)*3600).astype(np.int64)
+    leave = arrive + np.maximum(rng.gamma(2, 3600, len(arrive)), 300).astype(np.int64)
+    glitch = rng.choice(np.concatenate([arrive, leave]), len(arrive)//100)
+
+    timestamp = np.concatenate([arrive, leave, glitch])
+    in_out = np.concatenate([np.ones(len(arrive), np.int8), np.zeros(len(leave), np.int8), np.full(len(glitch), 2, np.int8)])
+    order = np.argsort(timestamp, kind='stable')
+    timestamp, in_out = timestamp[order], in_out[order]
+    # no two rows at the same second, like the real files (resampling needs unique times)
+    steps = np.arange(len(timestamp))
+    timestamp = np.maximum.accumulate(timestamp - steps) + steps
+    spots_taken = np.clip(np.cumsum(np.where(in_out == 1, 1, np.where(in_out == 0, -1, 0))), 0, capacity)
+
+    return pd.DataFrame({'percent_capacity': spots_taken/capacity, 'spots_taken': spots_taken, 'total_spots': capacity,
+                         'timestamp': timestamp, 'in_out': in_out})[RAW_COL_NAMES]
+
+
+def make_park_info(n_parks, seed=None):
+    '''
+    Park info dict (see make_park_info.py) for n_parks fake parks spread around the real ones
+    '''
+    rng = np.random.RandomState(seed)
+    park_info = {}
+    for i in range(n_parks):
+        park_info['synthetic_park_' + str(i).zfill(2)] = {'pretty_name': 'Synthetic Park ' + str(i),
+                                                           'lat': round(float(rng.uniform(39.6, 39.8)), 6),
+                                                           'lon': round(float(rng.uniform(-105.4, -105.2)), 6),
+                                                           'capacity': int(rng.randint(25, 100))}
+    return park_info
+
+
+def write_synthetic_parks(base_dir, n_parks, n_days, start='2019-08-30', seed=47):
+    '''
+    Write everything the pipeline reads for n_parks fake parks x n_days, under base_dir (laid out like the repo):
+    data/park_info.pkl, a raw LotSpot csv for each park, and the daily/hourly historical weather pickles for each
+    park and day (as saved by get_darksky_weather.py, from fake Dark Sky responses).
+
+    RETURNS
+    park_info (dict)
+    n_rows (int) : Total rows in the raw LotSpot files
+    '''
+    park_info = make_park_info(n_parks, seed=seed)
+    os.makedirs(os.path.join(base_dir, 'data'), exist_ok=True)
+    with open(os.path.join(base_dir, 'data', 'park_info.pkl'), 'wb') as f:
+        pickle.dump(park_info, f)
+
+    weather_dir = os.path.join(base_dir, DAILY_FILE_DIR)
+    os.makedirs(os.path.dirname(os.path.join(base_dir, raw_file_name('x'))), exist_ok=True)
+    os.makedirs(weather_dir, exist_ok=True)
+    n_rows = 0
+    for i, (park_name, info) in enumerate(park_info.items()):
+        df = make_lotspot_raw(info['capacity'], start, n_days, seed=seed + i)
+        df.to_csv(os.path.join(base_dir, raw_file_name(park_name)), header=False, index=False)
+        n_rows += len(df)
+
+        for j, day in enumerate(pd.date_range(start, periods=n_days, freq='D').strftime('%Y-%m-%d')):
+            dat_dict = make_darksky_response(info['lat'], info['lon'], day, seed=(seed + i)*100000 + j)
+            df_daily, df_hourly = parse_darksky_historical(dat_dict, info['lat'], info['lon'])
+            daily_file, hourly_file = daily_file_names(weather_dir, park_name, day)
+            df_daily.to_pickle(daily_file)
+            df_hourly.to_pickle(hourly_file)
+    return park_info, n_rows
@@ -0,0 +1,251 @@
+# Long-running scheduler for the Dark Sky jobs (instead of running get_DarkSky_forecast_job.py and
+# get_DarkSky_historical_job.py from cron). park_info and one keep-alive HTTP session are loaded once and kept,
+# and the forecast and historical pulls run at set times each day.
+# On startup (and every historical run) any days missing from the historical daily files are fetched, so a
+# missed day isn't lost; the forecast is fetched at startup if there isn't one for today yet.
+# Job times and failures are written to ./data/scheduler_metrics.json after every job (and printed on SIGUSR1).
+#
+# Usage: python src/weather_scheduler.py [--forecast-at 06:00 18:00] [--historical-at 02:00]
+#                                        [--history-start 2019-08-30] [--once]
+
+import os
+import json
+import time
+import pickle
+import signal
+import argparse
+import threading
+from datetime import datetime
+import pandas as pd
+
+from darksky_client import DARKSKY_BASE_URL, CACHE_DIR, TokenBucket, make_session
+from get_darksky_weather import backfill_historical
+from get_DarkSky_forecast_job import get_darksky_forecast, save_forecast, forecast_basename
+from combine_weather import DAILY_FILE_DIR, list_daily_files, combine_weather
+from storage import dataset_dir
+
+METRICS_FILE = './data/scheduler_metrics.json'
+JOBS = ['forecast', 'historical']
+
+
+class WeatherScheduler:
+    '''
+    Runs the forecast and historical weather jobs for all parks on a daily schedule
+
+    INPUT
+    park_info (dict) : See make_park_info.py
+    api_key (str)
+    forecast_at, historical_at (list) : Times of day ('HH:MM', local time in tz) to run each job
+    history_start (str) : First day historical weather should exist for (default is each park's earliest daily file)
+    tz (str) : Time zone for the schedule and for "yesterday"
+    rate (float) : Max API requests per second
+    n_workers (int) : Threads used to fetch historical days
+    base_url, cache_dir : See darksky_client.py
+    metrics_file (str) : Where to write the metrics after each job
+    '''
+
+    def __init__(self, park_info, api_key, forecast_at=('06:00',), historical_at=('02:00',), history_start=None,
+                 tz='US/Mountain', rate=10, n_workers=8, base_url=DARKSKY_BASE_URL, cache_dir=CACHE_DIR,
+                 metrics_file=METRICS_FILE):
+        self.park_info = park_info
+        self.api_key = api_key
+        self.schedule = {'forecast': list(forecast_at), 'historical': list(historical_at)}
+        self.history_start = history_start
+        self.tz = tz
+        self.n_workers = n_workers
+        self.base_url = base_url
+        self.cache_dir = cache_dir
+        self.metrics_file = metrics_file
+
+        self.session = make_session(pool_size=n_workers)
+        self.rate_limiter = TokenBucket(rate)
+        self.stop = threading.Event()
+        self.next_run = {}
+        self.metrics = {job: {'runs': 0, 'failures': 0, 'last_start': None, 'last_s': None, 'max_s': 0, 'total_s': 0,
+                              'last_error': None, 'last_result': None} for job in JOBS}
+        self.metrics['started'] = datetime.now().isoformat(timespec='seconds')
+
+    def today(self):
+        return pd.Timestamp.now(tz=self.tz).strftime('%Y-%m-%d')
+
+    def yesterday(self):
+        return (pd.Timestamp.now(tz=self.tz).normalize() - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+
+    def missing_history_days(self):
+        '''
+        Days w/o both daily and hourly historical files, from the start day through yesterday
+
+        OUTPUT
+        missing (dict) : {park_name : sorted list of days (str)}
+        '''
+        os.makedirs(DAILY_FILE_DIR, exist_ok=True)
+        files = list_daily_files(DAILY_FILE_DIR)
+        end = self.yesterday()
+        missing = {}
+        for park_name in self.park_info:
+            have = set(files.get((park_name, 'hourly'), {})) & set(files.get((park_name, 'daily'), {}))
+            start = self.history_start or (min(have) if len(have) > 0 else end)
+            days = [str(day)[0:10] for day in pd.date_range(start=start, end=end)]
+            missing[park_name] = [day for day in days if day not in have]
+        return missing
+
+    def missing_forecasts(self):
+        '''
+        Parks w/o a forecast requested today. (Past days' forecasts can't be fetched any more, so only today counts.)
+        '''
+        prefix = forecast_basename(self.today()).split('{i}')[0]
+        missing = []
+        for park_name in self.park_info:
+            path = dataset_dir('forecast_hourly', park_name)
+            found = any(file.startswith(prefix) for root, dirs, file_names in os.walk(path) for file in file_names)
+            if not found:
+                missing.append(park_name)
+        return missing
+
+    def run_forecast(self, park_names=None):
+        '''
+        Get and save the forecast for some (default all) parks
+        '''
+        park_names = list(self.park_info) if park_names is None else park_names
+        failed = []
+        for park_name in park_names:
+            info = self.park_info[park_name]
+            try:
+                date_req, df_daily, df_hourly = get_darksky_forecast(self.api_key, lat=info['lat'], lon=info['lon'],
+                                                                     session=self.session, rate_limiter=self.rate_limiter,
+                                                                     base_url=self.base_url, cache_dir=self.cache_dir)
+                # saved under today's date in tz (not the host's), which is what missing_forecasts looks for
+                save_forecast(park_name, self.today(), df_daily, df_hourly)
+            except Exception as e:
+                failed.append((park_name, repr(e)))
+        if len(failed) > 0:
+            raise RuntimeError(str(len(failed)) + ' of ' + str(len(park_names)) + ' parks failed, eg ' + str(failed[0]))
+        return {'parks': len(park_names)}
+
+    def run_historical(self):
+        '''
+        Fetch every missing historical day (normally just yesterday) for each park and add them to the combined weather
+        '''
+        missing = {park_name: days for park_name, days in self.missing_history_days().items() if len(days) > 0}
+        fetched, failed = 0, []
+        for park_name, days in missing.items():
+            # backfill skips days that already have files, so the range can span the gaps
+            summary = backfill_historical(self.api_key, {park_name: self.park_info[park_name]}, days[0], days[-1],
+                                          base_dir=DAILY_FILE_DIR + '/', n_workers=self.n_workers, base_url=self.base_url,
+                                          cache_dir=self.cache_dir, session=self.session, rate_limiter=self.rate_limiter)
+            fetched += summary['fetched']
+            failed += summary['failed']
+        if fetched > 0:
+            combine_weather(list(missing), incremental=True)
+        if len(failed) > 0:
+            raise RuntimeError(str(len(failed)) + ' of ' + str(fetched + len(failed)) + ' days failed, eg ' + str(failed[0]))
+        return {'fetched': fetched}
+
+    def run_job(self, job, **kwargs):
+        '''
+        Run a job, recording its time and any error in the metrics (errors are not raised)
+        '''
+        metrics = self.metrics[job]
+        metrics['last_start'] = datetime.now().isoformat(timespec='seconds')
+        t0 = time.time()
+        try:
+            metrics['last_result'] = getattr(self, 'run_' + job)(**kwargs)
+            metrics['last_error'] = None
+        except Exception as e:
+            metrics['failures'] += 1
+            # request errors include the url, which has the API key in it
+            metrics['last_error'] = repr(e).replace(self.api_key, '<key>') if self.api_key else repr(e)
+        seconds = time.time() - t0
+        metrics['runs'] += 1
+        metrics['last_s'] = round(seconds, 3)
+        metrics['max_s'] = round(max(metrics['max_s'], seconds), 3)
+        metrics['total_s'] = round(metrics['total_s'] + seconds, 3)
+        print(metrics['last_start'] + ' ' + job + ' : ' + ('ok' if metrics['last_error'] is None else 'FAILED ' + metrics['last_error'])
+              + ' in ' + str(round(seconds, 1)) + ' s', flush=True)
+        self.write_metrics()
+
+    def catch_up(self):
+        '''
+        Fetch any missing historical days, and today's forecast if it hasn't been fetched
+        '''
+        missing = self.missing_history_days()
+        self.metrics['startup_missing_days'] = sum(len(days) for days in missing.values())
+        if self.metrics['startup_missing_days'] > 0:
+            self.run_job('historical')
+        missing_forecasts = self.missing_forecasts()
+        if len(missing_forecasts) > 0:
+            self.run_job('forecast', park_names=missing_forecasts)
+
+    def next_time(self, job, now):
+        '''
+        Next scheduled run of a job after now (tz-aware Timestamp)
+        '''
+        # built as local wall-clock times then localized, so runs stay at the set time of day across DST changes
+        day = now.tz_localize(None).normalize()
+        times = [(day + pd.Timedelta(days=days) + pd.Timedelta(hm + ':00')).tz_localize(self.tz, ambiguous=True,
+                                                                                        nonexistent='shift_forward')
+                 for days in [0, 1] for hm in self.schedule[job]]
+        return min(t for t in times if t > now)
+
+    def get_metrics(self):
+        metrics = dict(self.metrics, next_run={job: str(t) for job, t in self.next_run.items()})
+        for job in JOBS:
+            runs = self.metrics[job]['runs']
+            metrics[job] = dict(self.metrics[job], mean_s=round(self.metrics[job]['total_s']/runs, 3) if runs else None)
+        return metrics
+
+    def write_metrics(self):
+        os.makedirs(os.path.dirname(self.metrics_file), exist_ok=True)
+        with open(self.metrics_file + '.tmp', 'w') as f:
+            json.dump(self.get_metrics(), f, indent=1)
+        os.replace(self.metrics_file + '.tmp', self.metrics_file)
+
+    def run(self):
+        '''
+        Catch up, then run each job at its scheduled times until stop is set
+        '''
+        self.catch_up()
+        now = pd.Timestamp.now(tz=self.tz)
+        self.next_run = {job: self.next_time(job, now) for job in JOBS if len(self.schedule[job]) > 0}
+        self.write_metrics()
+        if len(self.next_run) == 0:
+            print('No job times given; nothing scheduled after catching up', flush=True)
+            self.stop.set()
+        while not self.stop.is_set():
+            now = pd.Timestamp.now(tz=self.tz)
+            for job, t in self.next_run.items():
+                if now >= t:
+                    self.run_job(job)
+                    self.next_run[job] = self.next_time(job, pd.Timestamp.now(tz=self.tz))
+            wait = min(self.next_run.values()) - pd.Timestamp.now(tz=self.tz)
+            # wake up at least every minute, so a clock change (or suspend) doesn't push a run back
+            self.stop.wait(min(max(wait.total_seconds(), 0), 60))
+        self.session.close()
+
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description='Run the Dark Sky forecast and historical jobs on a schedule')
+    parser.add_argument('--forecast-at', nargs='*', default=['06:00'], help='Times of day (HH:MM) to get the forecast')
+    parser.add_argument('--historical-at', nargs='*', default=['02:00'], help="Times of day (HH:MM) to get yesterday's weather")
+    parser.add_argument('--history-start', default=None,
+                        help='Backfill historical weather from this day (default is each park\'s earliest daily file)')
+    parser.add_argument('--rate', type=float, default=10, help='Max requests per second')
+    parser.add_argument('--once', action='store_true', help='Only catch up on missing days/forecasts, then exit')
+    args = parser.parse_args()
+
+    with open('./data/park_info.pkl', 'rb') as f:
+        park_info = pickle.load(f)
+
+    API_KEY = os.getenv('DARKSKY_API_KEY')
+
+    scheduler = WeatherScheduler(park_info, API_KEY, forecast_at=args.forecast_at, historical_at=args.historical_at,
+                                 history_start=args.history_start, rate=args.rate)
+    if args.once:
+        scheduler.catch_up()
+        scheduler.write_metrics()
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop.set())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: print(json.dumps(scheduler.get_metrics(), indent=1), flush=True))
+        scheduler.run()